@@ -7,6 +7,13 @@ import time
 from datetime import datetime
 import threading
 import json
+import argparse
+import asyncio
+import signal
+import functools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Tuple
 
 # Function to temporarily redirect stderr
 @contextlib.contextmanager
@@ -27,7 +34,6 @@ def redirect_stderr():
 
 # Import rich components
 from rich.console import Console
-from rich.prompt import Prompt
 from rich.panel import Panel
 from rich.markdown import Markdown
 from rich.live import Live
@@ -46,41 +52,242 @@ from modules.model_selector import ModelSelector
 with redirect_stderr():
     from modules.brain import Brain
     from modules.resource_manager import ResourceManager
-    from modules.gpu_manager import GPUManager
     from modules.coqui import generate_audio, play_audio_file, init
     from modules.config import Config
     from modules.personal_info_manager import PersonalInfoManager
     from modules.user_manager import UserManager
     from modules.prompt_template import PromptTemplate
+    from modules.history_window import HistoryWindow
+    from modules.context_packer import ContextOverflowError, ContextPacker
+    from modules.auto_tuner import AutoTuner
+    from modules.startup import StartupOrchestrator
+    from modules.model_server import ModelServer
+    from modules.semantic_cache import SemanticCache
+    from modules.embeddings import Embedder
+    from modules.conversation_memory import ConversationMemory
+    from modules.conversation_summary import RollingSummary
+    from modules.speech_pipeline import SpeechPipeline
+    from modules.cancellation import CancellationToken
+    from modules.metrics import TurnMetrics
+    from modules.mock_backends import MockTTS
+    from modules.bench import run_benchmarks
+    from modules.profiler import Profiler, tracer
 
 console = Console()
+
+class GenerationTimer:
+    """Renderable that shows how long we have been waiting on the model."""
+    def __init__(self):
+        self.start_time = time.time()
+
+    def __rich__(self) -> Text:
+        # Called by Live's refresh thread
+        with tracer.span("live refresh", "ui"):
+            elapsed = time.time() - self.start_time
+            return Text(f"Generating... {elapsed:.1f}s", style="dim")
+
+class InputReader:
+    """
+    Reads lines from stdin on a daemon thread and hands them to the event loop.
+
+    Reading never blocks the loop, and text typed while a reply is being
+    generated or spoken is picked up right away (``None`` marks end of input).
+    Lines are stamped with their arrival time, so a barge-in only reacts to
+    input that arrived during the turn, not to lines already waiting.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._lines: Deque[Tuple[Optional[str], float]] = deque()
+        self._arrived = asyncio.Event()
+        # Piped input is a script of turns, not someone interrupting
+        self.interactive = sys.stdin.isatty()
+        threading.Thread(target=self._read, name="stdin-reader", daemon=True).start()
+
+    def _read(self):
+        while True:
+            line = sys.stdin.readline()
+            self._loop.call_soon_threadsafe(self._push, line.rstrip("\n") if line else None)
+            if not line:
+                return
+
+    def _push(self, line: Optional[str]):
+        self._lines.append((line, time.monotonic()))
+        self._arrived.set()
+
+    async def _wait_until(self, ready):
+        while not ready():
+            self._arrived.clear()
+            await self._arrived.wait()
+
+    async def next_line(self) -> Optional[str]:
+        await self._wait_until(lambda: self._lines)
+        return self._lines.popleft()[0]
+
+    async def arrival_after(self, since: float):
+        """Return once a line that arrived after ``since`` (a ``time.monotonic()`` value) is waiting."""
+        await self._wait_until(lambda: any(arrived > since for _, arrived in self._lines))
+
+    async def ask(self, prompt: str) -> Optional[str]:
+        if self._lines:
+            # Typed while Rena was talking; show it as the next message
+            line = self._lines.popleft()[0]
+            if line is not None:
+                console.print(f"{prompt}: {line}")
+            return line
+        console.print(f"{prompt}: ", end="")
+        return await self.next_line()
+
 class VoiceChatbot:
     def __init__(self):
+        # Stage spans (and a profiler around each turn) for a Chrome trace, with --profile;
+        # the mode is passed explicitly since --profile sets it after Profiler's defaults are bound
+        self.profiler = Profiler(Config.PROFILE_MODE, Config.PROFILE_DIR) if Config.PROFILE_ENABLED else None
         # Initialize components
         self.resource_manager = ResourceManager()
-        self.gpu_manager = GPUManager()
         self.model_selector = ModelSelector()
-        if not self.model_selector.select_and_initialize():
+        if not self.model_selector.select():
             console.print("[red]Model selection failed. Exiting.")
             sys.exit(1)
-        self.llm = self.model_selector.get_llm()
         self.using_gemini = self.model_selector.is_using_gemini()
-        self.coqui = init()
+        self.using_local = self.model_selector.backend == "local"
 
-        # Verify paths
+        # Verify paths before starting any slow work
         self._verify_paths()
         self.user_manager = UserManager()
         self.personal_info_manager = PersonalInfoManager(self.user_manager)
-        
+        # Update last interaction immediately at session start for accurate greeting
+        self.user_manager.update_last_interaction()
+        self.greeting = self._build_greeting()
+
         self.history = []
+        self.history_window = HistoryWindow()
         self.history_file = os.path.expanduser("~/my_AI/conversation_history.json")
         self.load_history()
+        self._window_start = 0  # index of the first history message in the last prompt
+        self.summary = RollingSummary() if Config.SUMMARY_ENABLED else None
+        if self.summary is not None:
+            if self.summary.covered > len(self.history):
+                self.summary.reset()  # The history file was replaced
+            elif self.summary.covered:
+                # Continue right after the summarized part instead of resending those messages
+                self._window_start = self.summary.covered
+                if self.summary.covered < len(self.history):
+                    self.history_window.start_at(self.history[self.summary.covered])
+
+        # Slow, independent steps run concurrently; the model loads (and warms up)
+        # while the TTS client comes up and the greeting is synthesized and played
+        self._llm = None
+        self._gpu_manager = None
+        self.context_packer = None
+        # Messages are embedded into the long-term memory here, in order, off the event loop
+        self._memory_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory")
+        self.startup = StartupOrchestrator()
+        self.startup.add("model", self._load_model)
+        if not Config.MOCK_BACKENDS:
+            # GPUManager imports torch; the fake backends (--mock) have no GPU to monitor
+            self.startup.add("gpu", self._create_gpu_manager)
+        # The fake TTS (--mock) needs neither a token nor the network
+        tts = MockTTS() if Config.MOCK_BACKENDS else None
+        self._synthesize = tts.generate_audio if tts else generate_audio
+        self._play = tts.play_audio_file if tts else play_audio_file
+        self.startup.add("tts", tts.init if tts else init)
+        self.startup.add("greeting audio", lambda: self._synthesize(self.greeting), depends_on=["tts"])
+        if Config.SEMANTIC_CACHE_ENABLED or Config.MEMORY_ENABLED:
+            self.startup.add("embedder", self._create_embedder)
+        if Config.SEMANTIC_CACHE_ENABLED:
+            self.startup.add("semantic cache", self._create_semantic_cache, depends_on=["embedder"])
+        if Config.MEMORY_ENABLED:
+            self.startup.add("memory", self._create_memory, depends_on=["embedder"])
+        
+        # Sentences are synthesized and played while the rest of the answer is generated
+        self.speech = SpeechPipeline(self._synthesize, self._play)
+        # Cancelled when the user interrupts: stops generation, pending TTS and playback of the turn
+        self.turn_token = CancellationToken()
+        # Latency breakdown of each turn, filled in by process_input and _respond
+        self.metrics = TurnMetrics() if Config.METRICS_ENABLED else None
+        self.turn_metrics: Dict = {}
+        self._metrics_tasks = set()
+        if self.metrics is not None and Config.METRICS_PORT:
+            self.metrics.serve(Config.METRICS_PORT)
+
+    def _load_model(self):
+        """Startup step: create the backend and run a warm-up inference."""
+        self.model_selector.initialize()
+        llm = self.model_selector.get_llm()
+        if hasattr(llm, 'warm_up'):
+            llm.warm_up()
+        return llm
+
+    @staticmethod
+    def _create_gpu_manager():
+        """Startup step: GPUManager imports torch, which takes a while."""
+        with redirect_stderr():
+            from modules.gpu_manager import GPUManager
+        return GPUManager()
+
+    @staticmethod
+    def _create_embedder():
+        """Startup step: load the embedding model shared by the semantic cache and the memory."""
+        if not os.path.exists(Config.EMBEDDING_MODEL_PATH):
+            console.print(f"[yellow]Warning: Semantic cache and long-term memory disabled, embedding model "
+                          f"not found at {Config.EMBEDDING_MODEL_PATH}[/yellow]")
+            return None
+        return Embedder(Config.EMBEDDING_MODEL_PATH)
+
+    def _create_semantic_cache(self):
+        """Startup step: load the semantic cache index."""
+        embedder = self.startup.result("embedder")
+        return SemanticCache(embedder) if embedder is not None else None
+
+    def _create_memory(self):
+        """Startup step: open the long-term memory, indexing the saved history on first use."""
+        embedder = self.startup.result("embedder")
+        if embedder is None:
+            return None
+        memory = ConversationMemory(embedder)
+        if not len(memory) and self.history:
+            memory.add_many(self.history)
+        return memory
+
+    @property
+    def memory(self):
+        """The long-term memory once it has loaded; turns never wait for it."""
+        return self.startup.result_or_none("memory")
+
+    @property
+    def semantic_cache(self):
+        """The semantic cache once it has loaded; turns never wait for it."""
+        return self.startup.result_or_none("semantic cache")
+
+    def _remember_reply(self, user_input: str, reply: str):
+        """Add a generated reply to the semantic cache."""
+        if self.semantic_cache is None or reply in ("[No response]", Config.ERROR_MESSAGES['model_error']):
+            return
+        self.semantic_cache.add(user_input, reply, self.user_manager.user_data.get('name', ''), self.history)
+
+    @property
+    def llm(self):
+        """The response backend; blocks only if it is still loading."""
+        if self._llm is None:
+            if not self.startup.done("model"):
+                with console.status("[dim]Waiting for the model to finish loading...[/dim]", spinner="dots"):
+                    self._llm = self.startup.result("model")
+            else:
+                self._llm = self.startup.result("model")
+        return self._llm
+
+    @property
+    def gpu_manager(self):
+        if self._gpu_manager is None and not Config.MOCK_BACKENDS:
+            self._gpu_manager = self.startup.result("gpu")
+        return self._gpu_manager
         
     def _verify_paths(self):
         """Verify all required paths exist."""
-        paths_to_check = {
-            'TinyLlama model': Config.TINYLLAMA_PATH
-        }
+        paths_to_check = {}
+        if self.using_local:
+            model_name = self.model_selector.model_name
+            paths_to_check[f'{model_name} model'] = Config.MODELS[model_name]
         
         for name, path in paths_to_check.items():
             if not os.path.exists(path):
@@ -90,90 +297,273 @@ class VoiceChatbot:
                 
 
         
-    def process_input(self, user_input: str):
+    def _create_context_packer(self) -> ContextPacker:
+        """Packer sized for the active backend's context and tokenizer."""
+        return ContextPacker(
+            getattr(self.llm, 'context_size', Config.CONTEXT_SIZE),
+            count_tokens=getattr(self.llm, 'count_tokens', None),
+            template=getattr(self.llm, 'prompt_template', None),
+            prefetch=getattr(self.llm, 'count_tokens_batch', None)
+        )
+
+    def switch_model(self, model_name: str):
+        """Switch the local backend to another registered model without restarting."""
+        if not self.using_local:
+            console.print("[yellow]Model switching is only available for the local backend.[/yellow]")
+            return
+        registry = self.llm.registry
+        if model_name not in registry.names():
+            console.print(f"[yellow]Unknown model '{model_name}'. Available: {', '.join(registry.available())}[/yellow]")
+            return
+        if not os.path.exists(registry.path(model_name)):
+            console.print(f"[red]{Config.ERROR_MESSAGES['file_not_found'].format(path=registry.path(model_name))}[/red]")
+            return
+        self.llm.switch_model(model_name)
+        self.context_packer = self._create_context_packer()
+        console.print(f"[yellow]Switched to {model_name}. It will load on the next message.[/yellow]")
+
+    async def process_input(self, user_input: str, cancel_token: Optional[CancellationToken] = None):
+        start_time = time.time()
         # --- Personal info extraction and query handling ---
-        pi_response = self.personal_info_manager.extract_and_store(user_input)
+        with tracer.span("personal info extraction"):
+            pi_response = self.personal_info_manager.extract_and_store(user_input)
         if pi_response:
-            return pi_response, 0
-        profile_query_response = self.personal_info_manager.handle_profile_query(user_input)
+            return pi_response, 0, None
+        with tracer.span("profile query check"):
+            profile_query_response = self.personal_info_manager.handle_profile_query(user_input)
         if profile_query_response:
-            return profile_query_response, 0
+            return profile_query_response, 0, None
+        if self.semantic_cache is not None:
+            with tracer.span("semantic cache lookup") as span_args:
+                cached_reply = self.semantic_cache.lookup(user_input, self.user_manager.user_data.get('name', ''),
+                                                          self.history)
+                span_args["hit"] = bool(cached_reply)
+            if cached_reply:
+                return cached_reply, 0, None
+        self.turn_metrics["intent_check_seconds"] = time.time() - start_time
         try:
-            if not self.resource_manager.check_resources():
-                if not self.resource_manager.wait_for_resources():
-                    return Config.ERROR_MESSAGES['resource_error']
-            import threading
-            import time
-            from rich.live import Live
-            from rich.text import Text
-            from modules.prompt_template import PromptTemplate
-
+            with tracer.span("resource check"):
+                resources_ok = await asyncio.to_thread(self.resource_manager.check_resources)
+            if not resources_ok:
+                if not await asyncio.to_thread(self.resource_manager.wait_for_resources):
+                    return Config.ERROR_MESSAGES['resource_error'], 0, None
             # --- MEMORY-AWARE PROMPT CONSTRUCTION ---
-            context_turns = Config.MAX_HISTORY if hasattr(Config, 'MAX_HISTORY') else 10
-            conversation_history = self.get_recent_history(context_turns)
+            # Token-budgeted packing; the history window only changes when a block is evicted
+            if self.context_packer is None:
+                self.context_packer = self._create_context_packer()
+            build_start = time.time()
             system_prompt = PromptTemplate.get_system_prompt()
             user_info = self.user_manager.user_data.get('name', '')
-            prompt = PromptTemplate.get_chat_prompt(
+            # Older messages relevant to this input, from the whole saved conversation
+            with tracer.span("memory recall"):
+                recalled = self.memory.recall(user_input) if self.memory is not None else None
+            with tracer.span("prompt packing") as span_args:
+                packed = self.context_packer.pack(
                 system_prompt=system_prompt,
-                conversation_history=conversation_history,
+                history=self.history,
                 user_input=user_input,
-                user_info=user_info
-            )
+                user_info=user_info,
+                history_window=self.history_window,
+                max_tokens=Config.MAX_TOKENS,
+                recalled=recalled,
+                summary=self.summary.text if self.summary is not None else ""
+                )
+                span_args["prompt_tokens"] = packed.prompt_tokens
+            # The local model takes the memoized token ids of the prompt segments
+            prompt = packed.tokens or packed.prompt
+            self._window_start = len(self.history) - len(packed.history)
+            self.turn_metrics["prompt_build_seconds"] = time.time() - build_start
+            self.turn_metrics["prompt_tokens"] = packed.prompt_tokens
 
-            response_result = [None]
-            generation_time = [0]
-            error_result = [None]
+            if Config.STREAM_RESPONSES:
+                result = await self._stream_response(prompt, packed.max_tokens, cancel_token)
+                if not (cancel_token and cancel_token.cancelled):
+                    self._remember_reply(user_input, result[0])
+                return result
 
-            def get_timer_display(start_time):
-                elapsed = time.time() - start_time
-                return Text(f"Generating... {elapsed:.1f}s", style="dim")
+            # The model runs in a worker thread; the event loop stays free for input and audio
+            generate = functools.partial(self._generate, prompt, max_tokens=packed.max_tokens, temperature=1.0,
+                                         **self._cancel_args(cancel_token))
+            with Live(GenerationTimer(), refresh_per_second=30, transient=True):
+                t0 = time.time()
+                response = await asyncio.get_running_loop().run_in_executor(None, generate)
+                generation_time = time.time() - t0
 
-            def generate_response_thread():
-                try:
-                    t0 = time.time()
-                    response = self.llm(prompt, max_tokens=Config.MAX_TOKENS, temperature=1.0)
-                    response_result[0] = response
-                    t1 = time.time()
-                    generation_time[0] = t1 - t0
-                except Exception as e:
-                    error_result[0] = e
-
-            start_time = time.time()
-            with Live(get_timer_display(start_time), refresh_per_second=30, transient=True) as live:
-                thread = threading.Thread(target=generate_response_thread)
-                thread.start()
-                while thread.is_alive():
-                    live.update(get_timer_display(start_time))
-                    time.sleep(0.05)
-                thread.join()
-
-            if error_result[0] is not None:
-                raise error_result[0]
-            if response_result[0] is None:
-                return Config.ERROR_MESSAGES['model_error'], 0
-            if isinstance(response_result[0], dict) and 'choices' in response_result[0] and response_result[0]['choices']:
-                return response_result[0]['choices'][0]['text'], generation_time[0]
-            elif isinstance(response_result[0], str):
-                return response_result[0], generation_time[0]
+            if response is None:
+                return Config.ERROR_MESSAGES['model_error'], 0, None
+            if isinstance(response, dict) and 'choices' in response and response['choices']:
+                if not (cancel_token and cancel_token.cancelled):
+                    self._remember_reply(user_input, response['choices'][0]['text'])
+                return response['choices'][0]['text'], generation_time, None
+            elif isinstance(response, str):
+                return response, generation_time, None
             else:
-                return "[No response]", generation_time[0]
+                return "[No response]", generation_time, None
+        except ContextOverflowError as e:
+            console.print(f"[red]{e}; raise Config.CONTEXT_SIZE or shorten the system prompt[/red]")
+            return Config.ERROR_MESSAGES['model_error'], 0, None
         except Exception as e:
-            if 'error_result' in locals() and error_result[0] is None:
-                pass
-            return Config.ERROR_MESSAGES['model_error'], 0
+            return Config.ERROR_MESSAGES['model_error'], 0, None
+
+    def _generate(self, prompt, **kwargs):
+        """Blocking model call on a worker thread, traced with the model's stats."""
+        with tracer.span("generation", "model", backend=self.model_selector.backend) as span_args:
+            try:
+                return self.llm(prompt, **kwargs)
+            finally:
+                span_args.update(getattr(self.llm, 'last_stats', {}))
+
+    def _cancel_args(self, cancel_token: Optional[CancellationToken]) -> Dict:
+        """Only the local Brain checks the token itself; other backends are stopped by closing the stream."""
+        return {"cancel_token": cancel_token} if self.using_local and cancel_token is not None else {}
+
+    async def _stream_chunks(self, prompt: str, max_tokens: int, cancel_token: Optional[CancellationToken]):
+        """
+        Async iterator over the model's completion chunks.
+
+        The blocking llama stream is consumed on a worker thread (which also
+        closes it, so the model lock is taken and released on one thread) and
+        handed to the event loop through a queue.
+        """
+        loop = asyncio.get_running_loop()
+        chunks: asyncio.Queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            stream = None
+            try:
+                with tracer.span("generation", "model", backend=self.model_selector.backend) as span_args:
+                    try:
+                        stream = self.llm(prompt, max_tokens=max_tokens, temperature=1.0, stream=True,
+                                          **self._cancel_args(cancel_token))
+                        for chunk in stream:
+                            if cancel_token is not None and cancel_token.cancelled:
+                                break
+                            loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+                    finally:
+                        # Closing the stream stops the backend's generation and frees the model
+                        if hasattr(stream, 'close'):
+                            stream.close()
+                        span_args.update(getattr(self.llm, 'last_stats', {}))
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, e)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, done)
+
+        producer = loop.run_in_executor(None, produce)
+        try:
+            while True:
+                chunk = await chunks.get()
+                if chunk is done:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            if cancel_token is not None and not producer.done():
+                cancel_token.cancel("abandoned")
+            await producer
+
+    async def _stream_response(self, prompt: str, max_tokens: int = Config.MAX_TOKENS,
+                               cancel_token: Optional[CancellationToken] = None):
+        """
+        Stream the model output to the terminal as tokens are decoded.
+
+        A "Generating..." timer is shown until the first token arrives, then
+        each chunk is printed immediately. Returns the full text, the total
+        generation time and the time to the first visible token. Generation
+        stops at the next token once ``cancel_token`` is cancelled.
+        """
+        pieces = []
+        first_token_time = None
+        timer = GenerationTimer()
+        live = Live(timer, refresh_per_second=10, transient=True, console=console)
+        live.start()
+        try:
+            async for chunk in self._stream_chunks(prompt, max_tokens, cancel_token):
+                text = chunk['choices'][0]['text'] if isinstance(chunk, dict) else str(chunk)
+                if not pieces:
+                    # Leading whitespace is not a visible token
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                    first_token_time = time.time() - timer.start_time
+                    tracer.instant("first token")
+                    live.stop()
+                    console.print("\n[bold blue]Rena:[/bold blue] ", end="")
+                print(text, end="", flush=True)
+                self.speech.feed(text)
+                pieces.append(text)
+        finally:
+            live.stop()
+        generation_time = time.time() - timer.start_time
+        if not pieces:
+            return "[No response]", generation_time, None
+        return "".join(pieces), generation_time, first_token_time
         
+    def _prefill_next_turn(self):
+        """Let the local model evaluate the known part of the next prompt while the user types."""
+        if not self.using_local or not self.startup.done("model") or not hasattr(self.llm, 'prefill'):
+            return
+        if self.context_packer is None:
+            self.context_packer = self._create_context_packer()
+        with tracer.span("speculative prefill"):
+            try:
+                prefix = self.context_packer.known_prefix(
+                    PromptTemplate.get_system_prompt(),
+                    self.history,
+                    self.user_manager.user_data.get('name', ''),
+                    self.history_window,
+                    summary=self.summary.text if self.summary is not None else ""
+                )
+            except ContextOverflowError:
+                return  # Reported by the next turn
+            self.llm.prefill(prefix)
+
+    async def _summarize_evicted(self):
+        """Fold messages evicted from the history window into the rolling summary, as idle work."""
+        if (self.summary is None or not self.using_local or not self.startup.done("model")
+                or not hasattr(self.llm, 'generate_when_idle')):
+            return
+        if self.llm.idle_tasks.pending("summary") or not self.summary.ready(self.history, self._window_start):
+            return
+        if self.context_packer is None:
+            self.context_packer = self._create_context_packer()
+        count_tokens = self.context_packer.count_tokens
+        # Tokenizes the batch; kept off the event loop
+        summary_pass = await asyncio.to_thread(
+            self.summary.begin_pass, self.history, self._window_start, count_tokens,
+            self.context_packer.n_ctx - self.summary.max_tokens - 8
+        )
+        self.llm.generate_when_idle(
+            "summary", summary_pass["prompt"],
+            lambda text: self.summary.apply(summary_pass, text, count_tokens),
+            max_tokens=self.summary.max_tokens, temperature=0.3,
+            stop=["\nUser:", "\nAssistant:", "\n\n\n"]
+        )
+
     def get_recent_history(self, context_turns=20):
         """Return the last N turns of conversation as a list of dicts."""
         return self.history[-context_turns:]
 
-    def add_to_history(self, role, content):
-        """Add a message to the conversation history."""
+    def add_to_history(self, role, content, remember=True):
+        """Add a message to the conversation history (and, if ``remember``, to long-term memory)."""
         self.history.append({"role": role, "content": content})
         self.save_history()  # Save after each addition for persistence
+        if (remember and self.memory is not None
+                and content not in ("[No response]", Config.ERROR_MESSAGES['model_error'])):
+            self._memory_writer.submit(self._add_to_memory, role, content)
+
+    def _add_to_memory(self, role, content):
+        """Worker job: embed a message into the long-term memory."""
+        try:
+            self.memory.add(role, content)
+        except Exception as e:
+            console.print(f"[yellow]Warning: Could not add message to long-term memory: {e}[/yellow]")
 
     def save_history(self):
         os.makedirs(os.path.dirname(self.history_file), exist_ok=True)
-        with open(self.history_file, "w") as f:
+        with tracer.span("save history", "io"), open(self.history_file, "w") as f:
             json.dump(self.history, f, indent=2)
 
     def load_history(self):
@@ -183,6 +573,40 @@ class VoiceChatbot:
         else:
             self.history = []
         
+    def _model_threads(self):
+        """Threads the local model uses, known without waiting for it to load."""
+        if not self.using_local:
+            return None
+        if self._llm is not None:
+            return max(self._llm.n_threads, self._llm.n_threads_batch)
+        tuned = AutoTuner().lookup(Config.MODELS[self.model_selector.model_name]) or {}
+        n_threads_batch = tuned.get("n_threads_batch", Config.N_THREADS_BATCH) or os.cpu_count()
+        return max(tuned.get("n_threads", Config.N_THREADS), n_threads_batch)
+
+    def _build_greeting(self) -> str:
+        """Personalized greeting string (time-aware, brief, with time-of-day)."""
+        now = datetime.now()
+        hour = now.hour
+        if 5 <= hour < 12:
+            time_greeting = "Good morning"
+        elif 12 <= hour < 18:
+            time_greeting = "Good afternoon"
+        elif 18 <= hour < 22:
+            time_greeting = "Good evening"
+        else:
+            time_greeting = "Hello"
+        days, hours, minutes, seconds = self.user_manager.get_time_since_last_meeting()
+        name = self.user_manager.user_data.get("name", "User")
+        if days > 0:
+            time_str = f"{days} day{'s' if days != 1 else ''}"
+        elif hours > 0:
+            time_str = f"{hours} hour{'s' if hours != 1 else ''}"
+        elif minutes > 0:
+            time_str = f"{minutes} minute{'s' if minutes != 1 else ''}"
+        else:
+            time_str = "a moment"
+        return f"{time_greeting} {name}, it has been {time_str} since we spoke. How can I help you?"
+
     def get_resource_table(self) -> Table:
         """Create a table showing current resource usage."""
         # dim the table box lines
@@ -192,12 +616,13 @@ class VoiceChatbot:
         
         # Get resource metrics
         cpu_percent = self.resource_manager.get_cpu_usage()
-        target_cores = self.resource_manager.get_target_cores()
+        target_cores = self.resource_manager.get_target_cores(self._model_threads())
         memory_percent = self.resource_manager.get_memory_usage()
         
         # Get GPU metrics if available
-        gpu_percent = self.gpu_manager.get_gpu_usage()
-        gpu_memory = self.gpu_manager.get_gpu_memory_usage()
+        gpu_manager = self.gpu_manager
+        gpu_percent = gpu_manager.get_gpu_usage() if gpu_manager is not None else 0.0
+        gpu_memory = gpu_manager.get_gpu_memory_usage() if gpu_manager is not None else 0.0
         
         # Add rows
         table.add_row(f"[dim]Target CPU Cores[/dim]", f"[dim]{target_cores}[/dim]")
@@ -212,38 +637,15 @@ class VoiceChatbot:
         return table
         
     def run(self):
-        # Update last interaction immediately at session start for accurate greeting
-        self.user_manager.update_last_interaction()
         # Show initial resource status
         resource_table = self.get_resource_table()
         console.print(Panel.fit(resource_table, title="System Status"))
 
         # Show available commands/tips above the welcome block
-        console.print("[dim]Type 'exit' to quit, 'clear' to clear history[/dim]")
+        console.print("[dim]Type 'exit' to quit, 'clear' to clear history, 'stop' to stop speaking, "
+                      "'model <name>' to switch local models; Ctrl+C interrupts a reply[/dim]")
 
-        # Get personalized greeting string (time-aware, brief, with time-of-day)
-        from datetime import datetime
-        now = datetime.now()
-        hour = now.hour
-        if 5 <= hour < 12:
-            time_greeting = "Good morning"
-        elif 12 <= hour < 18:
-            time_greeting = "Good afternoon"
-        elif 18 <= hour < 22:
-            time_greeting = "Good evening"
-        else:
-            time_greeting = "Hello"
-        days, hours, minutes, seconds = self.user_manager.get_time_since_last_meeting()
-        name = self.user_manager.user_data.get("name", "User")
-        if days > 0:
-            time_str = f"{days} day{'s' if days != 1 else ''}"
-        elif hours > 0:
-            time_str = f"{hours} hour{'s' if hours != 1 else ''}"
-        elif minutes > 0:
-            time_str = f"{minutes} minute{'s' if minutes != 1 else ''}"
-        else:
-            time_str = "a moment"
-        brief_greeting = f"{time_greeting} {name}, it has been {time_str} since we spoke. How can I help you?"
+        brief_greeting = self.greeting
 
         # Show welcome message with brief greeting (no tips inside)
         console.print(Panel.fit(
@@ -251,89 +653,340 @@ class VoiceChatbot:
             f"{brief_greeting}",
             title="Welcome"
         ))
-        # Play audio for the opening greeting
+        # Greeting audio was synthesized while the model loaded; it plays while the user types
         try:
-            audio_path = generate_audio(brief_greeting)
-            play_audio_file(audio_path)
+            greeting_audio = self.startup.result("greeting audio")
         except Exception as e:
+            greeting_audio = None
             console.print(f"[yellow]Audio playback failed: {e}[/yellow]")
+        # TTS is required; surface its initialization error as before
+        self.startup.result("tts")
+        self.startup.print_timings()
+        self._prefill_next_turn()
 
-        while True:
-            try:
+        asyncio.run(self.conversation_loop(greeting_audio))
+
+    async def conversation_loop(self, greeting_audio: Optional[str] = None):
+        """
+        Read input and answer turns until the user exits.
+
+        Input is read on its own thread, generation runs in an executor and
+        speech in the speech pipeline, so the stages overlap: the next message
+        can be typed while a reply is still being spoken, and typing one while
+        Rena is still answering interrupts her (barge-in).
+        """
+        loop = asyncio.get_running_loop()
+        self.input_reader = InputReader(loop)
+        self._main_task = asyncio.current_task()
+        self._turn_task = None
+        try:
+            loop.add_signal_handler(signal.SIGINT, self._on_interrupt)
+        except (NotImplementedError, RuntimeError):
+            pass  # No loop signal handlers here (e.g. Windows); Ctrl+C exits
+        if greeting_audio:
+            asyncio.create_task(self._play_greeting(greeting_audio, self.turn_token))
+
+        try:
+            while True:
                 # Get user input
-                user_input = Prompt.ask("\n\n[bold green]You[/bold green]")
+                user_input = await self.input_reader.ask("\n\n[bold green]You[/bold green]")
+                if user_input is None:
+                    break
+                # Barge-in: new input silences whatever is left of the previous reply
+                if self.input_reader.interactive:
+                    self.turn_token.cancel("barge-in")
                 
                 # Check for special commands
                 if user_input.lower() == 'exit':
                     break
+                elif user_input.lower() == 'stop':
+                    continue
                 elif user_input.lower() == 'clear':
                     console.print("[yellow]Conversation history cleared.[/yellow]")
                     self.history = []
+                    self.history_window.reset()
+                    self._window_start = 0
+                    if self.summary is not None:
+                        self.summary.reset()
                     self.save_history()
+                    self._prefill_next_turn()
+                    continue
+                elif user_input.lower() == 'models' or user_input.lower().startswith('model '):
+                    if user_input.lower() == 'models':
+                        if self.using_local:
+                            registry = self.llm.registry
+                            for name in registry.available():
+                                marker = "*" if name == self.llm.model_name else " "
+                                loaded = " (loaded)" if registry.is_loaded(name) else ""
+                                console.print(f"[dim]{marker} {name}{loaded}[/dim]")
+                    else:
+                        self.switch_model(user_input.split(None, 1)[1].strip().lower())
                     continue
-                    
-                # Process input and get response
-                response, generation_time = self.process_input(user_input)
 
-                # --- Audio Synthesis and Playback Start ---
-                audio_file_path = None
-                audio_thread = None
                 try:
-                    # Show spinner while synthesizing (no text)
-                    with console.status("", spinner="dots") as status:
-                        audio_file_path = generate_audio(response)
-                    
-                    # Synthesis finished (spinner stops automatically)
-                    
-                        if audio_file_path:
-                            # Start audio playback in a separate thread
-                            audio_thread = threading.Thread(target=play_audio_file, args=(audio_file_path,))
-                            audio_thread.start()
-                        else:
-                            console.print("[yellow]Skipping audio playback due to synthesis error.[/yellow]")
+                    await self._run_turn(user_input)
                 except Exception as e:
-                    console.print(f"[red]Error during TTS synthesis or playback initiation: {str(e)}[/red]")
-                # --- Audio Synthesis and Playback End ---
-
-                # --- Text Animation Start ---
-                # Use a fixed, natural typing speed instead of calculating based on total duration
-                # Adjust this value (seconds per character) for desired speed
-                typing_char_delay = 0.05 # Example: 30 milliseconds per character
-
-                console.print("\n[bold blue]Rena:[/bold blue] ", end="")
-                for char in response:
-                    print(char, end="", flush=True)
-                    time.sleep(typing_char_delay) # Use the fixed delay
-                print("\n")
-                #add timer emoji 
-                console.print(f'[dim]🕒 {generation_time:.1f}s[/dim]'.ljust(25)) # Pad to overwrite "Synthesizing..."
-
-                # --- Text Animation End ---
-
-                # Note: We don't explicitly join the audio_thread here.
-                # This allows the loop to continue to the next prompt even if audio is finishing.
-                # The play_audio_file function handles cleanup in the thread.
-
-                self.add_to_history("user", user_input)
-                self.add_to_history("assistant", response)
-
-            except KeyboardInterrupt:
-                console.print("\n[yellow]Interrupted by user. Exiting...[/yellow]")
-                break
-            except Exception as e:
-                console.print(f"[red]Error: {str(e)}[/red]")
-                # If an error occurred, ensure any potentially orphaned audio thread is handled
-                # (though in this simple case, letting it finish or error out is usually okay)
-                continue
+                    console.print(f"[red]Error: {str(e)}[/red]")
+        except asyncio.CancelledError:
+            console.print("\n[yellow]Interrupted by user. Exiting...[/yellow]")
+        finally:
+            # Let the audio and generation threads finish before the loop shuts down
+            self.turn_token.cancel("exit")
+            # The last turn's audio is cut now; record its metrics before the loop closes
+            if self._metrics_tasks:
+                await asyncio.gather(*self._metrics_tasks, return_exceptions=True)
+            try:
+                loop.remove_signal_handler(signal.SIGINT)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    def _on_interrupt(self):
+        """Ctrl+C stops the reply in progress; at the prompt it exits."""
+        if self._turn_task is not None and not self._turn_task.done():
+            self.turn_token.cancel("interrupted")
+        else:
+            self._main_task.cancel()
+
+    async def _play_greeting(self, audio_path: str, cancel_token: CancellationToken):
+        try:
+            await asyncio.to_thread(self._play, audio_path, cancel_token)
+        except Exception as e:
+            console.print(f"[yellow]Audio playback failed: {e}[/yellow]")
+
+    async def _run_turn(self, user_input: str):
+        """Answer one message; a message typed meanwhile interrupts the answer and is handled next."""
+        self.turn_token = CancellationToken()
+        self.speech.start_turn(self.turn_token)
+        if self.profiler is not None:
+            self._turn_task = asyncio.create_task(self._profiled_respond(user_input, self.turn_token))
+        else:
+            self._turn_task = asyncio.create_task(self._respond(user_input, self.turn_token))
+        if not self.input_reader.interactive:
+            await self._turn_task
+            return
+        # Only input typed after the turn started interrupts it; it stays queued as the next message
+        next_input = asyncio.create_task(self.input_reader.arrival_after(time.monotonic()))
+        try:
+            await asyncio.wait({self._turn_task, next_input}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if next_input.done():
+                self.turn_token.cancel("barge-in")
+            else:
+                next_input.cancel()
+            await self._turn_task
+
+    async def _profiled_respond(self, user_input: str, cancel_token: CancellationToken):
+        with self.profiler.turn(chars=len(user_input)) as span_args:
+            await self._respond(user_input, cancel_token)
+            span_args["cancelled"] = cancel_token.cancelled
+
+    async def _respond(self, user_input: str, cancel_token: CancellationToken):
+        self.turn_metrics = {}
+        # Process input and get response; streamed sentences go to TTS as they complete
+        response, generation_time, first_token_time = await self.process_input(user_input, cancel_token)
+        if first_token_time is None:
+            # Not streamed (cached, canned or error reply): speak it as a whole
+            self.speech.feed(response)
+        self.speech.finish()
+
+        # --- Text Animation Start ---
+        # Use a fixed, natural typing speed instead of calculating based on total duration
+        # Adjust this value (seconds per character) for desired speed
+        typing_char_delay = 0.05 # Example: 30 milliseconds per character
+
+        # Streamed responses are already on screen
+        if first_token_time is None and not cancel_token.cancelled:
+            console.print("\n[bold blue]Rena:[/bold blue] ", end="")
+            for char in response:
+                if cancel_token.cancelled:
+                    break
+                print(char, end="", flush=True)
+                await asyncio.sleep(typing_char_delay) # Use the fixed delay
+        print("\n")
+        #add timer emoji 
+        timing = f'🕒 {generation_time:.1f}s'
+        if first_token_time is not None:
+            timing += f'  ⚡ first token {first_token_time:.2f}s'
+        llm_stats = getattr(self.llm, 'last_stats', {}) if generation_time else {}
+        if llm_stats.get('prefix_hit_ratio') is not None:
+            timing += f"  ♻️ prefix reuse {llm_stats['prefix_hit_ratio']:.0%}"
+        if llm_stats.get('prefill_tokens'):
+            timing += (f"  📥 prefill {llm_stats['prefill_tokens']} tok {llm_stats['prefill_ms']:.0f}ms"
+                       f" ({llm_stats['n_threads_batch']} threads)")
+        if llm_stats.get('tokens_per_second'):
+            timing += f"  ⏩ {llm_stats['tokens_per_second']:.1f} tok/s"
+            if llm_stats.get('n_threads'):
+                timing += f" ({llm_stats['n_threads']} threads)"
+        if llm_stats.get('draft_acceptance_rate') is not None:
+            timing += f"  🎯 draft acceptance {llm_stats['draft_acceptance_rate']:.0%}"
+        if llm_stats.get('cache_hit'):
+            timing += "  💾 cached"
+        first_audio_time = await asyncio.to_thread(self.speech.wait_for_first_audio, Config.FIRST_AUDIO_TIMEOUT)
+        if first_audio_time is not None:
+            timing += f"  🔊 first audio {first_audio_time:.2f}s"
+        if cancel_token.cancelled:
+            timing += "  ⏹️ stopped"
+        console.print(f'[dim]{timing}[/dim]'.ljust(25)) # Pad to overwrite "Synthesizing..."
+        if self.metrics is not None:
+            self.turn_metrics.update({
+                "generation_seconds": generation_time or None,
+                "time_to_first_token_seconds": first_token_time,
+                "generated_tokens": llm_stats.get('completion_tokens'),
+                "prefill_tokens_per_second": llm_stats.get('prefill_tps') or None,
+                "decode_tokens_per_second": llm_stats.get('tokens_per_second') or None,
+                "time_to_first_audio_seconds": first_audio_time,
+            })
+            if llm_stats.get('prompt_tokens'):
+                self.turn_metrics["prompt_tokens"] = llm_stats['prompt_tokens']
+            # Recorded once the reply has been spoken, so playback is included
+            task = asyncio.create_task(self._record_turn_metrics(self.turn_metrics, self.speech.turn_stats,
+                                                                 cancel_token))
+            self._metrics_tasks.add(task)
+            task.add_done_callback(self._metrics_tasks.discard)
+
+        # --- Text Animation End ---
+
+        # Note: We don't wait for the remaining clips here.
+        # This allows the loop to continue to the next prompt while audio is finishing;
+        # the speech pipeline plays them in order in the background.
+
+        interrupted = cancel_token.cancelled
+        if interrupted and response.strip() in ("", "[No response]"):
+            # Stopped before any reply; the exchange stays out of history, memory and summary
+            self._prefill_next_turn()
+            return
+        if interrupted:
+            # The model sees that the reply was cut off; the fragment is not kept in long-term memory
+            response = response.rstrip() + Config.INTERRUPTED_REPLY_MARK
+        self.add_to_history("user", user_input)
+        self.add_to_history("assistant", response, remember=not interrupted)
+        # Queued before the prefill, which must be the last thing left in the KV cache
+        await self._summarize_evicted()
+        self._prefill_next_turn()
                 
+    async def _record_turn_metrics(self, values: Dict, speech_stats: Dict, cancel_token: CancellationToken):
+        """Add the turn's TTS figures once its clips are played, then record it."""
+        await asyncio.to_thread(self.speech.wait_for_turn, speech_stats, Config.METRICS_AUDIO_TIMEOUT)
+        if speech_stats["clips"]:
+            values["tts_synthesis_seconds"] = speech_stats["synthesis_time"]
+            values["playback_seconds"] = speech_stats["playback_time"]
+            if speech_stats["playback_time"] > 0 and not cancel_token.cancelled:
+                values["tts_real_time_factor"] = speech_stats["synthesis_time"] / speech_stats["playback_time"]
+        backend = self.model_selector.backend
+        self.metrics.record(values, backend=backend, cancelled=cancel_token.cancelled)
+
     def cleanup(self):
         """Cleanup resources."""
-        if not self.using_gemini and hasattr(self.llm, 'clear_history'):
-            self.llm.clear_history()
-        if hasattr(self, 'gpu_manager'):
+        if not hasattr(self, 'startup'):
+            return
+        self.turn_token.cancel("exit")
+        # A model that failed to load must not re-raise here and skip the steps below
+        model = self.startup.result_or_none("model")
+        if self.using_local and hasattr(model, 'clear_history'):
+            model.clear_history()
+        response_cache = getattr(model, 'response_cache', None)
+        if response_cache is not None:
+            response_cache.save()
+            cache_stats = response_cache.stats()
+            console.print(f"[dim]Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                          f"({cache_stats['hit_rate']:.0%}), {cache_stats['entries']} entries[/dim]")
+        if self.semantic_cache is not None:
+            self.semantic_cache.save()
+        # Pending embeddings are written before the memory is flushed
+        self._memory_writer.shutdown(wait=True)
+        if self.memory is not None:
+            self.memory.flush()
+        if self.summary is not None and self.summary.covered:
+            summary_stats = self.summary.stats()
+            console.print(f"[dim]Conversation summary: {summary_stats['covered']} messages in "
+                          f"{summary_stats['summary_tokens']} tokens, saving {summary_stats['tokens_saved']} "
+                          f"prompt tokens per turn[/dim]")
+        if self.metrics is not None:
+            self.metrics.shutdown()
+        if self.profiler is not None:
+            self.profiler.save()
+        if self.startup.result_or_none("gpu") is not None:
             self.gpu_manager.cleanup()
+        self.startup.shutdown()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rena voice chatbot")
+    parser.add_argument(
+        "--calibrate", nargs="*", metavar="MODEL",
+        help="benchmark llama thread/batch/GPU settings for the given models "
+             "(default: all available), cache the best ones and exit"
+    )
+    parser.add_argument(
+        "--serve", action="store_true",
+        help="keep the local model loaded and serve an OpenAI-compatible API "
+             "(/v1/completions, /v1/chat/completions) instead of starting the chat"
+    )
+    parser.add_argument("--model", default=Config.DEFAULT_MODEL, help="model to serve (with --serve)")
+    parser.add_argument("--host", default=Config.SERVER_HOST, help="address to listen on (with --serve)")
+    parser.add_argument("--port", type=int, default=Config.SERVER_PORT, help="port to listen on (with --serve)")
+    parser.add_argument("--socket", default=Config.SERVER_SOCKET or None,
+                        help="listen on this Unix socket instead of TCP (with --serve)")
+    parser.add_argument(
+        "--bench", nargs="*", metavar="BACKEND",
+        help="replay the benchmark prompt corpus against the given backends (local, daemon, gemini, mock; "
+             "default: local), save the results and compare them with the previous run"
+    )
+    parser.add_argument("--bench-models", nargs="+", metavar="MODEL",
+                        help="local models to benchmark (with --bench; default: all available)")
+    parser.add_argument("--repetitions", type=int, default=Config.BENCH_REPETITIONS,
+                        help="runs of every prompt (with --bench)")
+    parser.add_argument("--baseline", help="results file to compare with (with --bench; default: previous run)")
+    parser.add_argument("--mock", action="store_true",
+                        help="use a deterministic fake model and TTS (no model file, network or tokens needed)")
+    parser.add_argument("--profile", nargs="?", const="spans", choices=Profiler.MODES,
+                        help="record every pipeline stage in a Chrome trace (open in Perfetto); 'cprofile' also "
+                             "runs cProfile around each turn, 'sample' a stack sampler over all threads")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve per-turn latency metrics at http://127.0.0.1:PORT/metrics")
+    return parser.parse_args()
+
+def calibrate(model_names):
+    """Run the AutoTuner for each model; later starts pick up the cached settings."""
+    tuner = AutoTuner()
+    names = model_names or [name for name, path in Config.MODELS.items() if os.path.exists(path)]
+    for name in names:
+        if name not in Config.MODELS:
+            console.print(f"[yellow]Unknown model '{name}'. Available: {', '.join(Config.MODELS)}[/yellow]")
+            continue
+        tuner.calibrate(Config.MODELS[name])
+
+def serve(args):
+    """Load the model once and serve it until interrupted."""
+    if args.model not in Config.MODELS:
+        console.print(f"[red]Unknown model '{args.model}'. Available: {', '.join(Config.MODELS)}[/red]")
+        return
+    brain = Brain(model_name=args.model)
+    brain.warm_up()
+    server = ModelServer(brain, host=args.host, port=args.port, socket_path=args.socket)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        console.print("[yellow]Model server stopped.[/yellow]")
 
 def main():
+    args = parse_args()
+    if args.calibrate is not None:
+        calibrate(args.calibrate)
+        return
+    if args.serve:
+        serve(args)
+        return
+    if args.bench is not None:
+        if not run_benchmarks(args.bench, args.bench_models, args.repetitions, args.baseline):
+            sys.exit(1)
+        return
+    if args.mock:
+        Config.MOCK_BACKENDS = True
+    if args.profile is not None:
+        Config.PROFILE_ENABLED = True
+        Config.PROFILE_MODE = args.profile
+    if args.metrics_port is not None:
+        Config.METRICS_PORT = args.metrics_port
     chatbot = None
     try:
         chatbot = VoiceChatbot()
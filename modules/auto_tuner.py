@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import hashlib
+import platform
+import warnings
+import statistics
+from datetime import datetime
+from typing import Dict, List, Optional
+import psutil
+import llama_cpp
+from llama_cpp import Llama
+from rich.console import Console
+from rich.table import Table
+from rich.box import SIMPLE
+from modules.config import Config
+from modules.prompt_cache import model_fingerprint
+from modules.prompt_template import PromptTemplate
+
+console = Console()
+
+def host_fingerprint() -> str:
+    """Identify the hardware the tuning was measured on."""
+    cpu_model = platform.processor()
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu_model = line.split(":", 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    parts = [
+        platform.system(),
+        platform.machine(),
+        cpu_model,
+        str(psutil.cpu_count(logical=True)),
+        str(psutil.cpu_count(logical=False)),
+        str(round(psutil.virtual_memory().total / 1024 ** 3)),
+        str(gpu_offload_supported()),
+    ]
+    return hashlib.sha256("|".join(parts).encode()).hexdigest()[:16]
+
+def gpu_offload_supported() -> bool:
+    """Whether this llama-cpp build can offload layers to a GPU."""
+    try:
+        return bool(llama_cpp.llama_supports_gpu_offload())
+    except Exception:
+        return False
+
+class AutoTuner:
+    """
+    Calibrates llama thread count, batch size and GPU layers for a host.
+
+    A short prefill and decode microbenchmark is run over a grid of settings;
+    the configuration with the lowest estimated turn time is cached per
+    (host fingerprint, model hash) and returned by ``lookup()`` on later starts.
+    """
+
+    def __init__(self, cache_file: str = Config.TUNING_CACHE_FILE):
+        self.cache_file = cache_file
+
+    def _load_cache(self) -> Dict:
+        try:
+            with open(self.cache_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_cache(self, cache: Dict):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        with open(self.cache_file, "w") as f:
+            json.dump(cache, f, indent=2)
+
+    @staticmethod
+    def cache_key(model_path: str) -> str:
+        return f"{host_fingerprint()}:{model_fingerprint(model_path)}"
+
+    def lookup(self, model_path: str) -> Optional[Dict]:
+        """Return the cached best settings for this host and model, if calibrated."""
+        try:
+            return self._load_cache().get(self.cache_key(model_path))
+        except OSError:
+            return None
+
+    @staticmethod
+    def thread_candidates() -> List[int]:
+        """Thread counts worth trying on this host."""
+        logical = psutil.cpu_count(logical=True) or 1
+        physical = psutil.cpu_count(logical=False) or logical
+        candidates = {max(1, physical // 2), physical, logical, min(4, logical), min(8, logical)}
+        return sorted(candidates)
+
+    @staticmethod
+    def batch_candidates(prompt_length: int) -> List[int]:
+        """Batch sizes worth trying; larger batches than the prompt behave like the prompt length."""
+        candidates = [n_batch for n_batch in (128, 256, 512) if n_batch <= prompt_length]
+        return candidates or [128]
+
+    @staticmethod
+    def gpu_layer_candidates() -> List[int]:
+        return [0, -1] if gpu_offload_supported() else [0]
+
+    def _benchmark(self, llm: Llama, prompt_tokens: List[int], n_threads: int) -> Dict[str, float]:
+        """Measure prefill and decode speed with the given thread count (median of ``TUNE_REPEATS`` runs)."""
+        llama_cpp.llama_set_n_threads(llm.ctx, n_threads, n_threads)
+        # Untimed run, so thread start-up and page faults don't count against the first setting
+        self._run(llm, prompt_tokens, decode_tokens=2)
+        runs = [self._run(llm, prompt_tokens, Config.TUNE_DECODE_TOKENS)
+                for _ in range(max(1, Config.TUNE_REPEATS))]
+        prefill_time = statistics.median(run[0] for run in runs)
+        decode_time = statistics.median(run[1] for run in runs)
+
+        prefill_tps = len(prompt_tokens) / prefill_time
+        decode_tps = Config.TUNE_DECODE_TOKENS / decode_time
+        return {
+            "prefill_tps": prefill_tps,
+            "decode_tps": decode_tps,
+            # Expected time of a typical turn, the quantity we minimise
+            "turn_time": Config.TUNE_PROMPT_TOKENS / prefill_tps + Config.TUNE_GENERATION_TOKENS / decode_tps,
+        }
+
+    @staticmethod
+    def _run(llm: Llama, prompt_tokens: List[int], decode_tokens: int):
+        """Prefill ``prompt_tokens`` from an empty cache and decode; returns both durations in seconds."""
+        llm.reset()
+        start = time.perf_counter()
+        llm.eval(prompt_tokens)
+        prefill_time = time.perf_counter() - start
+
+        # Decode one token at a time, as generation does
+        token = prompt_tokens[-1]
+        start = time.perf_counter()
+        for _ in range(decode_tokens):
+            llm.eval([token])
+        return prefill_time, time.perf_counter() - start
+
+    def calibrate(self, model_path: str, n_ctx: int = Config.CONTEXT_SIZE) -> Dict:
+        """Benchmark the settings grid for ``model_path`` and cache the best one."""
+        console.print(f"[dim][blue]Calibrating llama settings for {os.path.basename(model_path)}...[/blue][/dim]")
+        table = Table(box=SIMPLE)
+        for column in ["GPU layers", "Batch", "Threads", "Prefill tok/s", "Decode tok/s", "Turn time"]:
+            table.add_column(f"[dim]{column}[/dim]")
+
+        # Only the vocabulary is needed to size the benchmark prompt
+        vocab = Llama(model_path=model_path, vocab_only=True, verbose=False)
+        text = PromptTemplate.get_static_prefix(PromptTemplate.get_system_prompt())
+        prompt_tokens = vocab.tokenize(text.encode("utf-8"))[:Config.TUNE_PROMPT_TOKENS]
+        vocab.close()
+
+        best = None
+        for n_gpu_layers in self.gpu_layer_candidates():
+            for n_batch in self.batch_candidates(len(prompt_tokens)):
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    llm = Llama(
+                        model_path=model_path,
+                        n_ctx=n_ctx,
+                        n_batch=n_batch,
+                        n_gpu_layers=n_gpu_layers,
+                        use_mmap=True,  # Reloads hit the page cache
+                        verbose=False
+                    )
+                results = []
+                for n_threads in self.thread_candidates():
+                    result = self._benchmark(llm, prompt_tokens, n_threads)
+                    result.update(n_threads=n_threads)
+                    results.append(result)
+                    table.add_row(str(n_gpu_layers), str(n_batch), str(n_threads),
+                                  f"{result['prefill_tps']:.1f}", f"{result['decode_tps']:.1f}",
+                                  f"{result['turn_time']:.2f}s")
+                llm.close()
+
+                # Prefill and decode get separate thread counts, so each phase takes its fastest
+                prefill = max(results, key=lambda r: r["prefill_tps"])
+                decode = max(results, key=lambda r: r["decode_tps"])
+                result = {
+                    "n_threads": decode["n_threads"],
+                    "n_threads_batch": prefill["n_threads"],
+                    "n_batch": n_batch,
+                    "n_gpu_layers": n_gpu_layers,
+                    "prefill_tps": prefill["prefill_tps"],
+                    "decode_tps": decode["decode_tps"],
+                    "turn_time": (Config.TUNE_PROMPT_TOKENS / prefill["prefill_tps"]
+                                  + Config.TUNE_GENERATION_TOKENS / decode["decode_tps"]),
+                }
+                if best is None or result["turn_time"] < best["turn_time"]:
+                    best = result
+
+        best["calibrated_at"] = datetime.now().isoformat()
+        console.print(table)
+        console.print(f"[green]Best: {best['n_threads']} decode / {best['n_threads_batch']} prefill threads, "
+                      f"batch {best['n_batch']}, "
+                      f"{best['n_gpu_layers']} GPU layers[/green]")
+
+        cache = self._load_cache()
+        cache[self.cache_key(model_path)] = best
+        self._save_cache(cache)
+        return best
@@ -0,0 +1,366 @@
+import os
+import json
+import time
+import hashlib
+import platform
+import threading
+import statistics
+import subprocess
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+import psutil
+from rich.console import Console
+from rich.table import Table
+from rich.box import SIMPLE
+from modules.config import Config
+from modules.prompt_template import PromptTemplate
+
+console = Console()
+
+# Summary metrics compared between runs, and whether a higher value is better
+COMPARED_METRICS = {
+    "time_to_first_token": False,
+    "prefill_tps": True,
+    "decode_tps": True,
+    "latency": False,
+    "peak_rss_mb": False,
+    "output_tokens": None,  # reported, never a regression
+}
+
+# Run before the measured ones; not in the corpus, so no measured prompt finds its tokens cached
+WARMUP_ENTRY = {"id": "warm-up", "prompt": "Warm-up request, please reply with one short sentence."}
+
+class PeakRSS:
+    """Samples the resident set size of this process on a thread and keeps the maximum."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.peak = 0
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = self._process.memory_info().rss
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+class BenchmarkSuite:
+    """
+    Reproducible latency benchmark of the configured backends and models.
+
+    Every prompt of the corpus (``Config.BENCH_CORPUS_FILE``, one JSON object
+    per line with an ``id``, the ``prompt`` and optionally a ``history``) is
+    rendered with the chat prompt template and streamed through each target
+    ``repetitions`` times, greedily and with the response cache disabled.
+    Every run starts from a cold KV cache apart from the static prompt
+    prefix, as a real turn does, so repetitions don't reuse each other's
+    prompt. A run records time to first token, prefill and decode tokens/s,
+    total latency, peak RSS of this process and output length. Results are saved
+    as JSON (``SCHEMA_VERSION``, code revision and host included) in
+    ``Config.BENCH_DIR``; ``compare`` reports the change of every metric's
+    median against an earlier run and flags regressions.
+    """
+
+    SCHEMA_VERSION = 1
+    BACKENDS = ("local", "daemon", "gemini", "mock")
+
+    def __init__(self, corpus_file: str = Config.BENCH_CORPUS_FILE,
+                 repetitions: int = Config.BENCH_REPETITIONS,
+                 max_tokens: int = Config.BENCH_MAX_TOKENS,
+                 results_dir: str = Config.BENCH_DIR):
+        self.corpus_file = corpus_file
+        self.repetitions = max(1, repetitions)
+        self.max_tokens = max_tokens
+        self.results_dir = results_dir
+        self.corpus = self.load_corpus()
+
+    def load_corpus(self) -> List[Dict]:
+        with open(self.corpus_file, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def corpus_hash(self) -> str:
+        material = json.dumps(self.corpus, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(material).hexdigest()[:16]
+
+    def render_prompt(self, entry: Dict) -> str:
+        return PromptTemplate.get_chat_prompt(PromptTemplate.get_system_prompt(),
+                                              entry.get("history", []), entry["prompt"])
+
+    def targets(self, backends: List[str], models: Optional[List[str]] = None) -> List[Tuple[str, str, Callable]]:
+        """(backend, model, factory) for every requested backend and available model."""
+        targets = []
+        for backend in backends:
+            if backend == "local":
+                names = models or [name for name, path in Config.MODELS.items() if os.path.exists(path)]
+                for name in names:
+                    if name not in Config.MODELS or not os.path.exists(Config.MODELS[name]):
+                        console.print(f"[yellow]Warning: Skipping model '{name}': not found[/yellow]")
+                        continue
+                    targets.append(("local", name, lambda name=name: self._local_backend(name)))
+            elif backend == "daemon":
+                targets.append(("daemon", Config.SERVER_URL, self._daemon_backend))
+            elif backend == "gemini":
+                if not os.environ.get("GEMINI_API_KEY"):
+                    console.print("[yellow]Warning: Skipping Gemini: GEMINI_API_KEY is not set[/yellow]")
+                    continue
+                targets.append(("gemini", "gemini-1.5-flash", self._gemini_backend))
+            elif backend == "mock":
+                targets.append(("mock", "mock", self._mock_backend))
+            else:
+                console.print(f"[yellow]Unknown backend '{backend}'. Available: {', '.join(self.BACKENDS)}[/yellow]")
+        return targets
+
+    @staticmethod
+    def _local_backend(name: str):
+        from modules.brain import Brain
+        brain = Brain(model_name=name)
+        brain.response_cache = None
+        return brain
+
+    @staticmethod
+    def _daemon_backend():
+        from modules.model_client import ModelServerClient
+        return ModelServerClient(Config.SERVER_URL)
+
+    @staticmethod
+    def _mock_backend():
+        from modules.mock_backends import MockLLM
+        return MockLLM()
+
+    @staticmethod
+    def _gemini_backend():
+        from modules.gemini_client import GeminiClient
+        return GeminiClient(os.environ["GEMINI_API_KEY"])
+
+    @staticmethod
+    def reset_cache(llm):
+        """Drop the KV cache of a local model; the Brain restores the static prefix on the next call."""
+        model = getattr(llm, "llm", None)
+        if hasattr(model, "reset"):
+            model.reset()
+
+    def run_once(self, llm, prompt: str, **params) -> Dict:
+        """Stream one completion from a cold cache and measure it."""
+        self.reset_cache(llm)
+        first_token_time = None
+        chunks = 0
+        pieces = []
+        with PeakRSS() as rss:
+            start = time.perf_counter()
+            for chunk in llm(prompt, max_tokens=self.max_tokens, temperature=0.0,
+                             stop=["User:", "\n\n"], stream=True, **params):
+                text = chunk["choices"][0].get("text", "")
+                if first_token_time is None and text.strip():
+                    first_token_time = time.perf_counter() - start
+                chunks += 1
+                pieces.append(text)
+            latency = time.perf_counter() - start
+        stats = getattr(llm, "last_stats", {}) or {}
+        output_tokens = stats.get("completion_tokens", chunks)
+        decode_tps = stats.get("tokens_per_second")
+        if not decode_tps and first_token_time is not None and output_tokens > 1 and latency > first_token_time:
+            decode_tps = (output_tokens - 1) / (latency - first_token_time)
+        return {
+            "time_to_first_token": first_token_time,
+            "prefill_tps": stats.get("prefill_tps") or None,
+            "decode_tps": decode_tps or None,
+            "latency": latency,
+            "peak_rss_mb": rss.peak / (1024 * 1024),
+            "output_tokens": output_tokens,
+            "output_chars": len("".join(pieces)),
+        }
+
+    def run(self, backends: List[str], models: Optional[List[str]] = None) -> Dict:
+        """Benchmark every target and return the results document."""
+        report = {
+            "schema_version": self.SCHEMA_VERSION,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "revision": self._revision(),
+            "host": {
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpu_count": os.cpu_count(),
+                "memory_mb": psutil.virtual_memory().total // (1024 * 1024),
+            },
+            "settings": {
+                "corpus": os.path.basename(self.corpus_file),
+                "corpus_hash": self.corpus_hash(),
+                "repetitions": self.repetitions,
+                "max_tokens": self.max_tokens,
+            },
+            "targets": [],
+        }
+        for backend, model, factory in self.targets(backends, models):
+            console.print(f"[dim][blue]Benchmarking {backend}/{model}...[/blue][/dim]")
+            try:
+                llm = factory()
+                # Pages the weights in (local) or opens the connection; not measured
+                self.run_once(llm, self.render_prompt(WARMUP_ENTRY))
+            except Exception as e:
+                console.print(f"[yellow]Warning: Skipping {backend}/{model}: {e}[/yellow]")
+                continue
+            prompts = []
+            runs_started = 0
+            for entry in self.corpus:
+                prompt = self.render_prompt(entry)
+                runs = []
+                for _ in range(self.repetitions):
+                    runs_started += 1
+                    # The daemon keeps its response cache; a distinct seed keys every run apart
+                    params = {"seed": runs_started} if backend == "daemon" else {}
+                    try:
+                        runs.append(self.run_once(llm, prompt, **params))
+                    except Exception as e:
+                        console.print(f"[yellow]Warning: {backend}/{model} failed on '{entry['id']}': {e}[/yellow]")
+                prompts.append({"id": entry["id"], "runs": runs})
+            all_runs = [run for prompt in prompts for run in prompt["runs"]]
+            report["targets"].append({
+                "backend": backend,
+                "model": model,
+                "summary": self.summarize(all_runs),
+                "prompts": prompts,
+            })
+            if hasattr(llm, "close"):
+                llm.close()
+            del llm
+        return report
+
+    @staticmethod
+    def summarize(runs: List[Dict]) -> Dict:
+        """Median and 90th percentile of every metric over the runs."""
+        summary = {"runs": len(runs)}
+        for metric in list(COMPARED_METRICS) + ["output_chars"]:
+            values = sorted(run[metric] for run in runs if run.get(metric) is not None)
+            if values:
+                summary[metric] = statistics.median(values)
+                summary[f"{metric}_p90"] = values[min(len(values) - 1, int(len(values) * 0.9))]
+        return summary
+
+    def save(self, report: Dict) -> str:
+        os.makedirs(self.results_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(self.results_dir, f"bench-{stamp}.json")
+        suffix = 1
+        while os.path.exists(path):
+            suffix += 1
+            path = os.path.join(self.results_dir, f"bench-{stamp}-{suffix}.json")
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        return path
+
+    def previous_run(self, exclude: Optional[str] = None) -> Optional[str]:
+        """The most recent saved results other than ``exclude``."""
+        if not os.path.isdir(self.results_dir):
+            return None
+        runs = sorted(name for name in os.listdir(self.results_dir)
+                      if name.startswith("bench-") and name.endswith(".json"))
+        runs = [os.path.join(self.results_dir, name) for name in runs]
+        runs = [path for path in runs if exclude is None or os.path.abspath(path) != os.path.abspath(exclude)]
+        return runs[-1] if runs else None
+
+    @staticmethod
+    def compare(baseline: Dict, current: Dict,
+                threshold: float = Config.BENCH_REGRESSION_THRESHOLD) -> List[Dict]:
+        """
+        Per target and metric, the relative change of the median from
+        ``baseline`` to ``current``; worse by more than ``threshold`` is a
+        regression.
+        """
+        if baseline.get("settings", {}).get("corpus_hash") != current.get("settings", {}).get("corpus_hash"):
+            console.print("[yellow]Warning: The runs used different prompt corpora; "
+                          "the comparison is only indicative[/yellow]")
+        baseline_targets = {(t["backend"], t["model"]): t["summary"] for t in baseline.get("targets", [])}
+        rows = []
+        for target in current.get("targets", []):
+            old = baseline_targets.get((target["backend"], target["model"]))
+            if old is None:
+                continue
+            for metric, higher_is_better in COMPARED_METRICS.items():
+                before, after = old.get(metric), target["summary"].get(metric)
+                if not before or after is None:
+                    continue
+                change = (after - before) / before
+                regression = higher_is_better is not None and (
+                    change < -threshold if higher_is_better else change > threshold)
+                rows.append({"backend": target["backend"], "model": target["model"], "metric": metric,
+                             "baseline": before, "current": after, "change": change,
+                             "regression": regression})
+        return rows
+
+    @staticmethod
+    def print_summary(report: Dict):
+        table = Table(box=SIMPLE)
+        for column in ["Target", "First token", "Prefill tok/s", "Decode tok/s", "Latency", "Peak RSS", "Tokens"]:
+            table.add_column(f"[dim]{column}[/dim]")
+
+        def fmt(value, pattern):
+            return pattern.format(value) if value is not None else "-"
+
+        for target in report["targets"]:
+            summary = target["summary"]
+            table.add_row(f"{target['backend']}/{target['model']}",
+                          fmt(summary.get("time_to_first_token"), "{:.2f}s"),
+                          fmt(summary.get("prefill_tps"), "{:.1f}"),
+                          fmt(summary.get("decode_tps"), "{:.1f}"),
+                          fmt(summary.get("latency"), "{:.2f}s"),
+                          fmt(summary.get("peak_rss_mb"), "{:.0f} MB"),
+                          fmt(summary.get("output_tokens"), "{:.0f}"))
+        console.print(table)
+
+    @staticmethod
+    def print_comparison(rows: List[Dict], baseline_path: str):
+        table = Table(box=SIMPLE, title=f"[dim]Compared with {os.path.basename(baseline_path)}[/dim]")
+        for column in ["Target", "Metric", "Baseline", "Current", "Change", ""]:
+            table.add_column(f"[dim]{column}[/dim]")
+        for row in rows:
+            flag = "[red]REGRESSION[/red]" if row["regression"] else ""
+            table.add_row(f"{row['backend']}/{row['model']}", row["metric"], f"{row['baseline']:.3g}",
+                          f"{row['current']:.3g}", f"{row['change']:+.1%}", flag)
+        console.print(table)
+
+    @staticmethod
+    def _revision() -> Optional[str]:
+        """Git revision of the code being benchmarked, if available."""
+        try:
+            result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        except (OSError, subprocess.SubprocessError):
+            return None
+        return result.stdout.strip() or None
+
+def run_benchmarks(backends: List[str], models: Optional[List[str]] = None,
+                   repetitions: int = Config.BENCH_REPETITIONS, baseline: Optional[str] = None) -> bool:
+    """Run, save and compare a benchmark; returns False if a regression was found."""
+    suite = BenchmarkSuite(repetitions=repetitions)
+    report = suite.run(backends or ["local"], models)
+    if not report["targets"]:
+        console.print("[red]Nothing to benchmark.[/red]")
+        return True
+    path = suite.save(report)
+    suite.print_summary(report)
+    console.print(f"[green]Results saved to {path}[/green]")
+
+    baseline = baseline or suite.previous_run(exclude=path)
+    if baseline is None:
+        return True
+    with open(baseline, "r") as f:
+        rows = suite.compare(json.load(f), report)
+    if rows:
+        suite.print_comparison(rows, baseline)
+    regressions = [row for row in rows if row["regression"]]
+    if regressions:
+        console.print(f"[red]{len(regressions)} regression(s) beyond "
+                      f"{Config.BENCH_REGRESSION_THRESHOLD:.0%} against {os.path.basename(baseline)}[/red]")
+    return not regressions
@@ -1,6 +1,8 @@
-from llama_cpp import Llama
+import llama_cpp
+from llama_cpp import Llama, StoppingCriteriaList
 import time
-from typing import List, Dict, Optional
+import functools
+from typing import Callable, List, Dict, Optional, Iterator, Union
 from rich.console import Console
 import os
 import sys
@@ -9,6 +11,8 @@ import warnings
 import random
 import json
 import re
+import threading
+from collections import deque
 from datetime import datetime
 
 # Add project root to Python path
@@ -23,12 +27,33 @@ try:
 except ImportError:
     PROFILE_EDITOR_AVAILABLE = False
 from modules.config import Config
+from modules.prompt_cache import PrefixStateCache
+from modules.history_window import HistoryWindow
+from modules.context_packer import ContextPacker
+from modules.speculative import DraftStats, build_draft_model, draft_compatible
+from modules.model_registry import ModelRegistry
+from modules.auto_tuner import AutoTuner
+from modules.response_cache import ResponseCache
+from modules.idle_tasks import IdleTaskRunner
+from modules.cancellation import CancellationToken
+from modules.resource_manager import ResourceManager
 
 console = Console()
 
 class Brain:
     """Handles the chatbot's reasoning and response generation."""
     
+    # Sampling parameters for goodbye messages
+    GOODBYE_PARAMS = dict(
+        max_tokens=100,
+        stop=["\n\n", "User:", "Assistant:"],
+        echo=False,
+        temperature=0.7,  # Lower temperature for more controlled output
+        top_p=0.9,
+        frequency_penalty=0.2,
+        presence_penalty=0.2
+    )
+
     @staticmethod
     @contextlib.contextmanager
     def suppress_stderr():
@@ -41,15 +66,39 @@ class Brain:
             finally:
                 sys.stderr = old_stderr
 
-    def __init__(self, model_path: str = Config.TINYLLAMA_PATH, 
-                 context_size: int = Config.CONTEXT_SIZE):
-        self.model_path = model_path
+    def __init__(self, model_path: Optional[str] = None, 
+                 context_size: int = Config.CONTEXT_SIZE,
+                 model_name: str = Config.DEFAULT_MODEL,
+                 registry: Optional[ModelRegistry] = None):
         self.context_size = context_size
-        self.llm = None
-        self.prompt_template = PromptTemplate()
+        self.registry = registry or ModelRegistry(loader=self._load_llama, context_tokens=context_size)
+        if model_path is not None:
+            model_name = self.registry.register(os.path.splitext(os.path.basename(model_path))[0], model_path)
+        self.model_name = model_name
+        self.model_path = self.registry.path(model_name)
+        self._llm = None
+        self.prompt_template = PromptTemplate(tokenize=self._tokenize)
         self.conversation_history: List[Dict[str, str]] = []
+        self.history_window = HistoryWindow()
+        self.context_packer = ContextPacker(context_size, count_tokens=self.count_tokens,
+                                            template=self.prompt_template)
         self.chatty_expressions = self._load_chatty_expressions()
         self.user_manager = UserManager()
+        self.last_response = ""
+        self.last_stats: Dict = {}
+        self._prefix_tokens: List[int] = []
+        self._prefix_text = ""
+        self._prefix_state = None
+        self._draft_model = None  # Shared by all targets it fits, see _draft_for
+        self._draft_built = False
+        # llama-cpp is not re-entrant; one completion at a time per Brain
+        self._lock = threading.RLock()
+        self.response_cache = ResponseCache() if Config.RESPONSE_CACHE_ENABLED else None
+        # Goodbyes generated ahead of time while the user is typing: (name, reply)
+        self.idle_tasks = IdleTaskRunner()
+        self.goodbye_pool: deque = deque(maxlen=Config.GOODBYE_POOL_SIZE)
+        self.resource_manager = ResourceManager()
+        self._user_info_block = None  # ((profile, topics), text) of the last user information block
         self._initialize_model()    
     
     def _load_chatty_expressions(self) -> Dict[str, List[str]]:
@@ -70,39 +119,315 @@ class Brain:
                 "enthusiasm": ["I'm excited to tell you that "]
             }
     
+    @property
+    def llm(self) -> Llama:
+        """The active model, loaded through the registry on first use."""
+        if self._llm is None:
+            self._initialize_model()
+        return self._llm
+
+    def switch_model(self, model_name: str):
+        """
+        Make ``model_name`` the active model.
+
+        The model itself is loaded lazily on the next generation; the registry
+        evicts least recently used models if memory would exceed its budget.
+        """
+        with self.idle_tasks.turn(), self._lock:
+            # A prefill of the old model's KV cache is useless now
+            self.idle_tasks.discard("prefill")
+            self.model_path = self.registry.path(model_name)
+            self.model_name = model_name
+            self._llm = None
+            self._prefix_state = None
+        # Token counts and tokenized segments depend on the tokenizer
+        self.prompt_template = PromptTemplate(tokenize=self._tokenize)
+        self.context_packer = ContextPacker(self.context_size, count_tokens=self.count_tokens,
+                                            template=self.prompt_template)
+
+    @property
+    def n_threads(self) -> int:
+        """Threads the active model decodes with."""
+        return self.llm.n_threads
+
+    @property
+    def n_threads_batch(self) -> int:
+        """Threads the active model evaluates prompts (prefill) with."""
+        return self.llm.n_threads_batch
+
+    def llama_settings(self, model_path: str) -> Dict:
+        """Thread, batch and GPU settings for a model: calibrated if available, else Config defaults."""
+        settings = {
+            "n_threads": Config.N_THREADS,
+            "n_threads_batch": Config.N_THREADS_BATCH or os.cpu_count(),
+            "n_batch": Config.N_BATCH,
+            "n_gpu_layers": Config.N_GPU_LAYERS,
+        }
+        tuner = AutoTuner()
+        tuned = tuner.lookup(model_path)
+        if tuned is None and Config.AUTO_TUNE:
+            tuned = tuner.calibrate(model_path, self.context_size)
+        if tuned:
+            settings.update({key: tuned[key] for key in settings if key in tuned})
+        return settings
+
+    def _load_llama(self, model_path: str) -> Llama:
+        """Construct a Llama instance for ``model_path`` (used as the registry loader)."""
+        settings = self.llama_settings(model_path)
+        draft_model = self._draft_for(model_path)
+        # Suppress warnings during model initialization
+        with self.suppress_stderr():
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                return Llama(
+                    model_path=model_path,
+                    n_ctx=self.context_size,
+                    n_threads=settings["n_threads"],
+                    n_threads_batch=settings["n_threads_batch"],
+                    n_gpu_layers=settings["n_gpu_layers"],
+                    n_batch=settings["n_batch"],  # Process tokens in batches
+                    use_mmap=True,  # Use memory mapping for faster loading
+                    use_mlock=True,  # Lock model in memory to prevent swapping
+                    offload_kqv=True,  # Offload key, query, value matrices to GPU
+                    main_gpu=0,  # Use first GPU
+                    tensor_split=None,  # Let llama.cpp handle tensor splitting
+                    rope_freq_base=0.0,  # Use the value stored in the GGUF (differs per model)
+                    rope_freq_scale=1.0,  # Standard scaling
+                    mul_mat_q=True,  # Use quantized matrix multiplication
+                    f16_kv=True,  # Use 16-bit key-value cache
+                    draft_model=draft_model,  # Speculative decoding (Config.SPECULATIVE_MODE)
+                    verbose=False  # Idle-time generation runs off the main thread, where stderr is not suppressed
+                )
+
+    def _draft_for(self, model_path: str) -> Optional[DraftStats]:
+        """
+        The draft model for one target, with its own counters.
+
+        The draft model is loaded once and shared; each target the registry
+        loads is checked against its vocabulary first. None when speculation
+        is off or the vocabularies differ.
+        """
+        if not self._draft_built:
+            self._draft_model = build_draft_model()
+            self._draft_built = True
+        if self._draft_model is None:
+            return None
+        try:
+            compatible = draft_compatible(self._draft_model, model_path)
+        except Exception as e:
+            console.print(f"[yellow]Warning: Could not read the vocabulary of {model_path}: {e}[/yellow]")
+            return None
+        if not compatible:
+            console.print(f"[yellow]Warning: Draft model {Config.DRAFT_MODEL_PATH} does not share the vocabulary "
+                          f"of {os.path.basename(model_path)}; speculative decoding is off for it[/yellow]")
+            return None
+        return DraftStats(self._draft_model)
+
+    @property
+    def prefix_tokens(self) -> List[int]:
+        """Token ids of the static prompt prefix (empty without the prefix cache)."""
+        return list(self._prefix_tokens)
+
+    @property
+    def draft_stats(self) -> Optional[DraftStats]:
+        """Draft counters of the current model (None without speculative decoding)."""
+        return getattr(self._llm, 'draft_model', None)
+
     def _initialize_model(self):
-        """Initialize the TinyLlama model."""
+        """Initialize the selected model."""
         try:
             os.environ['LLAMA_CPP_LOG_LEVEL'] = '-1'
-            console.print("[dim][blue]Initializing TinyLlama model...[/blue][/dim]")
-            
-            # Suppress warnings during model initialization
-            with self.suppress_stderr():
-                with warnings.catch_warnings():
-                    warnings.simplefilter('ignore')
-                    self.llm = Llama(
-                        model_path=self.model_path,
-                        n_ctx=self.context_size,
-                        n_threads=Config.N_THREADS,
-                        n_gpu_layers=-1,
-                        n_batch=512,  # Process tokens in batches
-                        use_mmap=True,  # Use memory mapping for faster loading
-                        use_mlock=True,  # Lock model in memory to prevent swapping
-                        offload_kqv=True,  # Offload key, query, value matrices to GPU
-                        main_gpu=0,  # Use first GPU
-                        tensor_split=None,  # Let llama.cpp handle tensor splitting
-                        rope_freq_base=10000.0,  # Optimize for speed
-                        rope_freq_scale=1.0,  # Standard scaling
-                        mul_mat_q=True,  # Use quantized matrix multiplication
-                        f16_kv=True  # Use 16-bit key-value cache
-                    )
+            if not self.registry.is_loaded(self.model_name):
+                console.print(f"[dim][blue]Initializing {self.model_name} model...[/blue][/dim]")
+            self._llm = self.registry.get(self.model_name)
             
             console.print("[dim][green]Model initialized successfully![/green][/dim]")
+            if Config.PROMPT_CACHE_ENABLED:
+                self._prime_prefix_cache()
         except Exception as e:
             error_msg = Config.ERROR_MESSAGES['initialization_error'].format(error=str(e))
             console.print(f"[red]{error_msg}[/red]")
             raise
     
+    def _prime_prefix_cache(self):
+        """
+        Evaluate the static prompt prefix once and keep a snapshot of its KV state.
+
+        The snapshot is persisted on disk, so later starts with the same model
+        and prompt skip the prefill entirely. Turns whose prompt starts with the
+        prefix restore it instead of re-evaluating several hundred tokens.
+        """
+        try:
+            prefix_text = self.prompt_template.get_static_prefix(self.prompt_template.get_system_prompt())
+            # Tokenized as the first prompt segment, so it matches the token ids of packed prompts
+            prefix_tokens = list(self.prompt_template.segment(prefix_text, first=True).tokens)
+            cache = PrefixStateCache()
+            key = cache.make_key(self.model_path, prefix_text, self.context_size)
+            state = cache.load(key)
+            if state is None:
+                with self.suppress_stderr():
+                    self.llm.reset()
+                    self.llm.eval(prefix_tokens)
+                    state = self.llm.save_state()
+                cache.save(key, state)
+            else:
+                with self.suppress_stderr():
+                    self.llm.load_state(state)
+            self._prefix_text = prefix_text
+            self._prefix_tokens = prefix_tokens
+            self._prefix_state = state
+        except Exception as e:
+            console.print(f"[yellow]Warning: Prompt prefix cache unavailable: {e}[/yellow]")
+            self._prefix_state = None
+
+    def _restore_prefix_state(self, prompt):
+        """Reload the cached prefix state if the model's KV cache no longer holds it."""
+        if self._prefix_state is None:
+            return
+        n_prefix = len(self._prefix_tokens)
+        if isinstance(prompt, str):
+            if not prompt.startswith(self._prefix_text):
+                return
+        elif list(prompt[:n_prefix]) != self._prefix_tokens:
+            return
+        if self.llm.n_tokens >= n_prefix and list(self.llm.input_ids[:n_prefix]) == self._prefix_tokens:
+            # llama-cpp's own prefix matching will reuse it
+            return
+        with self.suppress_stderr():
+            self.llm.load_state(self._prefix_state)
+
+    def warm_up(self):
+        """
+        Run a one-token generation on top of the static prefix.
+
+        This pages the model weights in and leaves the prefix in the KV cache,
+        so the first real turn does not pay for either.
+        """
+        self(self._prefix_text or "Hello", max_tokens=1)
+
+    def release_model(self) -> Llama:
+        """
+        Hand the loaded model over to another owner (the daemon's BatchScheduler).
+
+        Idle-time jobs are stopped after their current step and no further
+        ones run; the Brain must not generate with the model afterwards.
+        """
+        with self.idle_tasks.turn(), self._lock:
+            self.idle_tasks.close()
+        return self.llm
+
+    def schedule_idle_work(self):
+        """
+        Queue idle-time jobs that refill the pre-generated reply pools.
+
+        Only turns through ``generate_response`` are served from the pools,
+        so they are filled once such a turn arrives, not at start-up; a plain
+        completion caller (main.py, the daemon) never pays for them.
+        """
+        missing = Config.GOODBYE_POOL_SIZE - len(self.goodbye_pool) - self.idle_tasks.pending("goodbye")
+        for _ in range(missing):
+            self.idle_tasks.submit("goodbye", self._pregenerate_goodbye)
+
+    def prefill(self, prefix: Union[str, List[int]]):
+        """
+        Evaluate a known prompt prefix (text or token ids) in the background until the next turn.
+
+        The tokens are fed in chunks of ``PREFILL_CHUNK_TOKENS`` as idle work,
+        so a turn that arrives first only waits for the chunk in flight. When
+        the next prompt starts with ``prefix_text``, llama-cpp's prefix
+        matching skips everything already evaluated; otherwise the extra KV
+        entries are simply overwritten.
+        """
+        if not Config.SPECULATIVE_PREFILL:
+            return
+        self.idle_tasks.discard("prefill")
+        self.idle_tasks.submit("prefill", lambda: self._prefill_steps(prefix))
+
+    def prefill_next_turn(self):
+        """Prefill the input-independent start of the next turn's prompt."""
+        self.prefill(self.context_packer.known_prefix(
+            self.prompt_template.get_system_prompt(),
+            self.conversation_history,
+            history_window=self.history_window
+        ))
+
+    def _prefill_steps(self, prefix: Union[str, List[int]]):
+        """Idle job: extend the KV cache to cover ``prefix``, one chunk per step."""
+        with self._lock:
+            self._restore_prefix_state(prefix)
+            tokens = self.llm.tokenize(prefix.encode("utf-8")) if isinstance(prefix, str) else list(prefix)
+            n_past = Llama.longest_token_prefix(self.llm.input_ids[:self.llm.n_tokens].tolist(), tokens)
+            self.llm.n_tokens = n_past  # eval() drops the KV entries after this point
+            for start in range(n_past, len(tokens), Config.PREFILL_CHUNK_TOKENS):
+                self.llm.eval(tokens[start:start + Config.PREFILL_CHUNK_TOKENS])
+                yield
+
+    def generate_when_idle(self, name: str, prompt: str, on_done: Callable[[str], None], **params):
+        """
+        Queue a completion as idle work, decoded one token per step.
+
+        ``on_done`` receives the generated text once it is complete; a job
+        preempted by a turn starts over later.
+        """
+        self.idle_tasks.submit(name, lambda: self._idle_generation_steps(prompt, on_done, params))
+
+    def _idle_generation_steps(self, prompt: str, on_done: Callable[[str], None], params: Dict):
+        pieces = []
+        with self._lock:
+            for chunk in self.llm(prompt, stream=True, **params):
+                pieces.append(chunk['choices'][0]['text'])
+                yield
+        on_done("".join(pieces))
+
+    def _pregenerate_goodbye(self):
+        """Idle job: generate one goodbye for the pool, stepping once per token."""
+        name = self.user_manager.user_data.get("name", "")
+        pieces = []
+        with self._lock:
+            for chunk in self.llm(self._goodbye_prompt(name), stream=True, **self.GOODBYE_PARAMS):
+                pieces.append(chunk['choices'][0]['text'])
+                yield
+        reply = self._clean_goodbye("".join(pieces))
+        if reply:
+            self.goodbye_pool.append((name, reply))
+
+    def _take_pooled_goodbye(self, name: str) -> Optional[str]:
+        """A pre-generated goodbye for this user, if one is ready."""
+        for _ in range(len(self.goodbye_pool)):
+            pooled_name, reply = self.goodbye_pool.popleft()
+            if pooled_name == name:
+                return reply
+        return None
+
+    @staticmethod
+    def _goodbye_prompt(name: str, user_input: Optional[str] = None) -> str:
+        """Prompt for a goodbye message; without ``user_input`` it suits any farewell."""
+        said = f'\nThe user said: "{user_input}"' if user_input else ""
+        return f"""Generate a natural and warm goodbye message. The user's name is {name if name else 'there'}. {said}
+Generate a single, natural-sounding goodbye message that:
+1. Acknowledges the conversation
+2. Expresses appreciation
+3. Wishes them well
+4. Sounds natural and conversational
+5. Is appropriate for the time of day if mentioned
+6. Uses their name if available
+7. Is between 1-2 sentences
+
+Response:"""
+
+    @staticmethod
+    def _clean_goodbye(response_text: str) -> str:
+        """Tidy a generated goodbye message."""
+        response_text = response_text.strip()
+        
+        # Remove any potential role markers or unwanted prefixes
+        response_text = re.sub(r'^(Assistant|User|A|B):\s*', '', response_text)
+        
+        # Ensure the response ends with appropriate punctuation
+        if response_text and not response_text.endswith(('.', '!', '?')):
+            response_text += '!'
+        return response_text
+
     def _check_for_user_commands(self, user_input: str) -> Optional[str]:
         """Check for special user commands related to user management."""
         user_input_lower = user_input.lower()
@@ -438,204 +763,379 @@ class Brain:
                 # Get user's name for personalization
                 user_data = self.user_manager.user_data
                 name = user_data.get("name", "")
-                
-                # Create a prompt for generating a natural goodbye
-                goodbye_prompt = f"""Generate a natural and warm goodbye message. The user's name is {name if name else 'there'}. 
-The user said: "{user_input}"
-Generate a single, natural-sounding goodbye message that:
-1. Acknowledges the conversation
-2. Expresses appreciation
-3. Wishes them well
-4. Sounds natural and conversational
-5. Is appropriate for the time of day if mentioned
-6. Uses their name if available
-7. Is between 1-2 sentences
 
-Response:"""
+                # Prefer a goodbye pre-generated while the user was typing
+                pooled = self._take_pooled_goodbye(name)
+                self.schedule_idle_work()
+                if pooled:
+                    return pooled
                 
                 # Generate response with controlled parameters
-                with self.suppress_stderr():
+                with self.idle_tasks.turn(), self._lock, self.suppress_stderr():
                     with warnings.catch_warnings():
                         warnings.simplefilter('ignore')
-                        response = self.llm(
-                            goodbye_prompt,
-                            max_tokens=100,
-                            stop=["\n\n", "User:", "Assistant:"],
-                            echo=False,
-                            temperature=0.7,  # Lower temperature for more controlled output
-                            top_p=0.9,
-                            frequency_penalty=0.2,
-                            presence_penalty=0.2
+                        response = self._cached_llm_call(
+                            self._goodbye_prompt(name, user_input), **self.GOODBYE_PARAMS
                         )
                 
                 # Extract and clean the response
-                response_text = response['choices'][0]['text'].strip()
-                
-                # Remove any potential role markers or unwanted prefixes
-                response_text = re.sub(r'^(Assistant|User|A|B):\s*', '', response_text)
-                
-                # Ensure the response ends with appropriate punctuation
-                if not response_text.endswith(('.', '!', '?')):
-                    response_text += '!'
-                
-                return response_text
+                return self._clean_goodbye(response['choices'][0]['text']) or "Goodbye! Take care!"
         
         return None
 
-    def generate_response(self, user_input: str, max_tokens: int = Config.MAX_TOKENS) -> tuple:
-        """Generate a response to user input."""
-        try:
-            # Update interaction time at the beginning of processing
-            self.user_manager.update_last_interaction()
+    def __call__(self, prompt: str, stream: bool = False,
+                 cancel_token: Optional[CancellationToken] = None, **kwargs):
+        """
+        Run a raw completion against the loaded model.
 
-            # Validate input
-            if not user_input or not user_input.strip():
-                return "I notice you sent an empty message. I'm here to chat - feel free to share your thoughts!", 0
-                
-            # Check for very short or incomplete messages
-            if len(user_input.strip()) < 3:
-                return "I see you're trying to say something, but it seems quite short. Could you elaborate a bit more?", 0
-                
-            # Check for trailing ellipsis or incomplete sentences
-            if user_input.strip().endswith('...') or user_input.strip().endswith('..'):
-                return "I notice you ended your message with '...'. Would you like to complete your thought?", 0
-                
-            # Check for goodbye messages
-            goodbye_response = self._check_for_goodbye(user_input)
-            if goodbye_response:
-                return goodbye_response, 0
-                
-            # First, check for user management commands
-            command_response = self._check_for_user_commands(user_input)
-            if command_response:
-                return command_response, 0
-            
-            # Check if this is a greeting and provide time since last conversation
-            greeting_response = self._check_for_greeting(user_input)
-            if greeting_response:
-                return greeting_response, 0
-                
-            # Check for birthday reminder
-            birthday_reminder = self.user_manager.get_birthday_reminder()
-            
-            # Get user information for context
-            user_info = self._get_relevant_user_info(user_input)
-            
-            # Get the full prompt
-            system_prompt = self.prompt_template.get_system_prompt()
-            full_prompt = self.prompt_template.get_chat_prompt(
-                system_prompt,
-                self.conversation_history,
-                user_input,
-                user_info
-            )
-            
-            # Get conversation style preferences
-            conv_style = self.user_manager.user_data.get("conversation_style", {})
-            formality = conv_style.get("formality", "casual")
-            detail_level = conv_style.get("detail_level", "balanced")
-            humor_level = conv_style.get("humor", "moderate")
-            
-            # Adjust generation parameters based on conversation style
-            temperature = 0.8
-            if formality == "formal" or formality == "professional":
-                temperature = 0.7
-            elif formality == "friendly":
-                temperature = 0.9
-                
-            # Adjust max tokens based on detail level
-            detail_multiplier = {
-                "minimal": 0.7,
-                "balanced": 1.0,
-                "detailed": 1.3,
-                "comprehensive": 1.5
-            }.get(detail_level, 1.0)
-            adjusted_max_tokens = int(max_tokens * detail_multiplier)
-            
-            # Generate response
-            start_time = time.time()
+        Mirrors the llama-cpp-python call signature (and GeminiClient) so the
+        Brain can be used directly as the ``llm`` of the chatbot. With
+        ``stream=True`` a generator of completion chunks is returned. Calls
+        from several threads are serialized; for concurrent users, put a
+        BatchScheduler in front of the model instead. A ``cancel_token`` is
+        checked after every decoded token; a cancelled completion ends early
+        with finish reason ``"cancelled"``.
+        """
+        self.last_stats = {}
+        if stream:
+            return self._stream_completion(prompt, cancel_token=cancel_token, **kwargs)
+        if cancel_token is not None:
+            return self._cancellable_completion(prompt, cancel_token, **kwargs)
+        with self.idle_tasks.turn(), self._lock:
+            self._restore_prefix_state(prompt)
+            self._record_prefix_reuse(prompt)
+            self._adapt_threads()
+            if self.draft_stats is not None:
+                self.draft_stats.reset()
+            hits = self.response_cache.hits if self.response_cache else 0
             with self.suppress_stderr():
                 with warnings.catch_warnings():
                     warnings.simplefilter('ignore')
-                    response = self.llm(
-                        full_prompt,
-                        max_tokens=adjusted_max_tokens,
-                        stop=["User:", "\n\n"],
-                        echo=False,
-                        temperature=0.7,  # Lower temperature for faster, more focused responses
-                        top_p=0.9,
-                        top_k=40,  # Limit token sampling to top 40
-                        frequency_penalty=0.1,  # Reduced penalty for faster generation
-                        presence_penalty=0.1,  # Reduced penalty for faster generation
-                        repeat_penalty=1.1,  # Slightly increased to prevent repetition
-                        tfs_z=1.0,  # Tail free sampling for better quality/speed balance
-                        mirostat_mode=0,  # Disable mirostat for speed
-                        mirostat_tau=5.0,
-                        mirostat_eta=0.1
-                    )
-            generation_time = time.time() - start_time
-            
-            # Extract the response text
-            response_text = response['choices'][0]['text'].strip()
-            
-            # --- Replace parenthetical emotions with emojis ---
-            emotion_to_emoji = {
-                "smiling": "😊",
-                "laughing": "😄",
-                "winking": "😉",
-                "sad": "😢",
-                "crying": "😭",
-                "surprised": "😮",
-                "thinking": "🤔",
-                "confused": "😕",
-                "angry": "😠",
-                # Add more mappings as needed
-            }
+                    response = self._cached_llm_call(prompt, **kwargs)
+            self.last_stats["cache_hit"] = bool(self.response_cache) and self.response_cache.hits > hits
+            completion_tokens = response.get("usage", {}).get("completion_tokens", 0)
+            self._record_decode_stats(completion_tokens)
+            self._record_phase_timings()
+            return response
 
-            def replace_emotion(match):
-                emotion = match.group(1).lower()
-                # Return emoji or empty string if no match, effectively removing the text
-                return emotion_to_emoji.get(emotion, "") 
+    def _stream_completion(self, prompt: str, cancel_token: Optional[CancellationToken] = None, **kwargs):
+        """Yield completion chunks from the model as each token is decoded."""
+        with self.idle_tasks.turn(), self._lock:
+            self._restore_prefix_state(prompt)
+            self._record_prefix_reuse(prompt)
+            self._adapt_threads()
+            if self.draft_stats is not None:
+                self.draft_stats.reset()
+            completion_tokens = 0
+            hits = self.response_cache.hits if self.response_cache else 0
+            chunks = None
+            try:
+                with self.suppress_stderr():
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('ignore')
+                        chunks = self._cached_llm_call(prompt, stream=True, cancel_token=cancel_token, **kwargs)
+                        for chunk in chunks:
+                            if cancel_token is not None and cancel_token.cancelled:
+                                self.last_stats["cancelled"] = True
+                                break
+                            completion_tokens += 1
+                            yield chunk
+            finally:
+                # Stop llama's generator (and skip caching a partial reply) before releasing the model
+                if hasattr(chunks, "close"):
+                    chunks.close()
+                self.last_stats["cache_hit"] = bool(self.response_cache) and self.response_cache.hits > hits
+                self._record_decode_stats(completion_tokens)
+                self._record_phase_timings()
 
-            # Pattern: \( + optional whitespace + letters + optional whitespace + \)
-            response_text = re.sub(r'\(\s*([a-zA-Z]+)\s*\)', replace_emotion, response_text)
-            # Remove potential leading/trailing whitespace left after replacement
-            response_text = response_text.strip()
-            # --- End of emoji replacement ---
+    def _cancellable_completion(self, prompt: str, cancel_token: CancellationToken, **kwargs) -> Dict:
+        """Non-streaming completion assembled from the token stream, so it can be cancelled."""
+        pieces = []
+        finish_reason = None
+        for chunk in self._stream_completion(prompt, cancel_token=cancel_token, **kwargs):
+            choice = chunk["choices"][0]
+            pieces.append(choice.get("text", ""))
+            finish_reason = choice.get("finish_reason") or finish_reason
+        if cancel_token.cancelled:
+            finish_reason = "cancelled"
+        return {
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": self.model_path,
+            "choices": [{"text": "".join(pieces), "index": 0, "logprobs": None,
+                         "finish_reason": finish_reason}],
+            "usage": {"completion_tokens": self.last_stats.get("completion_tokens", 0)},
+        }
 
-            # Validate response to prevent training data leaks
-            response_text = self._validate_response(response_text)
-            
-            # Add chatty expressions based on content, context, and humor level
-            response_text = self._add_chatty_expressions(response_text, user_input, humor_level)
+    def _cached_llm_call(self, prompt: str, stream: bool = False,
+                         cancel_token: Optional[CancellationToken] = None, **kwargs):
+        """Call the model, answering from the response cache when possible."""
+        llm = self.llm
+        if cancel_token is not None:
+            # Checked by llama after every sampled token, even while the stream holds back
+            # incomplete UTF-8; bound here so it stays out of the response cache key
+            llm = functools.partial(llm, stopping_criteria=StoppingCriteriaList(
+                [lambda input_ids, logits: cancel_token.cancelled]))
+        if self.response_cache is None:
+            return llm(prompt, stream=stream, **kwargs)
+        return self.response_cache.cached_call(llm, self.model_path, prompt, stream=stream, **kwargs)
+
+    def _record_decode_stats(self, completion_tokens: int):
+        """Record the completion length and, with speculative decoding, the draft acceptance rate."""
+        self.last_stats["completion_tokens"] = completion_tokens
+        if self.draft_stats is not None:
+            self.last_stats["draft_acceptance_rate"] = self.draft_stats.acceptance_rate(completion_tokens)
+
+    def _adapt_threads(self):
+        """
+        Set this call's prefill and decode thread counts.
+
+        Prefill is compute-bound and scales with cores; decode is bound by
+        memory bandwidth and stalls when any of its threads is descheduled.
+        Both start from the configured (or calibrated) counts and, with
+        Config.ADAPTIVE_THREADS, are lowered to the cores other processes
+        leave free.
+        """
+        n_threads, n_threads_batch = self.llm.n_threads, self.llm.n_threads_batch
+        if Config.ADAPTIVE_THREADS:
+            n_threads, n_threads_batch = self.resource_manager.llama_threads(n_threads, n_threads_batch)
+        llama_cpp.llama_set_n_threads(self.llm.ctx, n_threads, n_threads_batch)
+        llama_cpp.llama_perf_context_reset(self.llm.ctx)
+        self.last_stats["n_threads"] = n_threads
+        self.last_stats["n_threads_batch"] = n_threads_batch
+
+    def _record_phase_timings(self):
+        """
+        Record the time llama spent evaluating the prompt and decoding, from its perf counters.
+
+        Both speeds come from llama's own counters rather than wall time, so
+        sampling, detokenizing and the consumer of the stream don't count
+        against them; the metrics and the benchmark report the same figures.
+        """
+        perf = llama_cpp.llama_perf_context(self.llm.ctx)
+        self.last_stats["prefill_tokens"] = perf.n_p_eval
+        self.last_stats["prefill_ms"] = perf.t_p_eval_ms
+        self.last_stats["decode_ms"] = perf.t_eval_ms
+        self.last_stats["prefill_tps"] = perf.n_p_eval / perf.t_p_eval_ms * 1000 if perf.t_p_eval_ms > 0 else 0.0
+        self.last_stats["tokens_per_second"] = perf.n_eval / perf.t_eval_ms * 1000 if perf.t_eval_ms > 0 else 0.0
+
+    def count_tokens(self, text: str) -> int:
+        """Number of model tokens in ``text``."""
+        return len(self.llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def _tokenize(self, text: bytes, add_bos: bool, special: bool) -> List[int]:
+        """The active model's tokenizer, for PromptTemplate."""
+        return self.llm.tokenize(text, add_bos=add_bos, special=special)
+
+    def _record_prefix_reuse(self, prompt):
+        """Record how much of the prompt can be reused from the model's KV cache."""
+        tokens = self.llm.tokenize(prompt.encode("utf-8")) if isinstance(prompt, str) else list(prompt)
+        reused = Llama.longest_token_prefix(self.llm.input_ids[:self.llm.n_tokens].tolist(), tokens)
+        self.last_stats["prompt_tokens"] = len(tokens)
+        self.last_stats["reused_tokens"] = reused
+        self.last_stats["prefix_hit_ratio"] = reused / len(tokens) if tokens else 0.0
+
+    def _prepare_turn(self, user_input: str, max_tokens: int) -> Dict:
+        """
+        Run the pre-generation checks and build the prompt for a turn.
+
+        Returns a dict with either a ``reply`` (canned answer, no LLM call
+        needed) or the ``prompt`` and sampling parameters for the model.
+        """
+        # Update interaction time at the beginning of processing
+        self.user_manager.update_last_interaction()
+        # This turn may be a goodbye, and so may the next; refilled once the turn is over
+        self.schedule_idle_work()
+
+        # Validate input
+        if not user_input or not user_input.strip():
+            return {"reply": "I notice you sent an empty message. I'm here to chat - feel free to share your thoughts!"}
             
-            # Add birthday reminder if applicable
-            if birthday_reminder:
-                response_text = f"{response_text}\n\n{birthday_reminder}"
+        # Check for very short or incomplete messages
+        if len(user_input.strip()) < 3:
+            return {"reply": "I see you're trying to say something, but it seems quite short. Could you elaborate a bit more?"}
             
-            # Track interaction
-            self._track_interaction(user_input, response_text)
+        # Check for trailing ellipsis or incomplete sentences
+        if user_input.strip().endswith('...') or user_input.strip().endswith('..'):
+            return {"reply": "I notice you ended your message with '...'. Would you like to complete your thought?"}
             
-            # Update conversation history
-            self.conversation_history.append({
-                "role": "user",
-                "content": user_input,
-                "timestamp": datetime.now().isoformat()
-            })
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": response_text,
-                "timestamp": datetime.now().isoformat()
-            })
+        # Check for goodbye messages
+        goodbye_response = self._check_for_goodbye(user_input)
+        if goodbye_response:
+            return {"reply": goodbye_response}
             
-            # Keep conversation history manageable
-            if len(self.conversation_history) > Config.MAX_HISTORY:
-                self.conversation_history = self.conversation_history[-Config.MAX_HISTORY:]
+        # First, check for user management commands
+        command_response = self._check_for_user_commands(user_input)
+        if command_response:
+            return {"reply": command_response}
+        
+        # Check if this is a greeting and provide time since last conversation
+        greeting_response = self._check_for_greeting(user_input)
+        if greeting_response:
+            return {"reply": greeting_response}
             
-            # Update the last meeting time
-            self.user_manager.update_last_interaction()
+        # Check for birthday reminder
+        birthday_reminder = self.user_manager.get_birthday_reminder()
+        
+        # Get user information for context
+        user_info = self._get_relevant_user_info(user_input)
+        
+        system_prompt = self.prompt_template.get_system_prompt()
+        
+        # Get conversation style preferences
+        conv_style = self.user_manager.user_data.get("conversation_style", {})
+        formality = conv_style.get("formality", "casual")
+        detail_level = conv_style.get("detail_level", "balanced")
+        humor_level = conv_style.get("humor", "moderate")
+        
+        # Adjust generation parameters based on conversation style
+        temperature = 0.8
+        if formality == "formal" or formality == "professional":
+            temperature = 0.7
+        elif formality == "friendly":
+            temperature = 0.9
             
-            return response_text, generation_time
+        # Adjust max tokens based on detail level
+        detail_multiplier = {
+            "minimal": 0.7,
+            "balanced": 1.0,
+            "detailed": 1.3,
+            "comprehensive": 1.5
+        }.get(detail_level, 1.0)
+        adjusted_max_tokens = int(max_tokens * detail_multiplier)
+
+        # Get the full prompt, packed to leave room for the answer
+        packed = self.context_packer.pack(
+            system_prompt,
+            self.conversation_history,
+            user_input,
+            user_info,
+            history_window=self.history_window,
+            max_tokens=adjusted_max_tokens
+        )
+
+        return {
+            "prompt": packed.tokens or packed.prompt,
+            "max_tokens": packed.max_tokens,
+            "humor_level": humor_level,
+            "birthday_reminder": birthday_reminder,
+        }
+
+    def _generation_params(self, max_tokens: int) -> Dict:
+        """Sampling parameters used for regular chat turns."""
+        return dict(
+            max_tokens=max_tokens,
+            stop=["User:", "\n\n"],
+            echo=False,
+            temperature=0.7,  # Lower temperature for faster, more focused responses
+            top_p=0.9,
+            top_k=40,  # Limit token sampling to top 40
+            frequency_penalty=0.1,  # Reduced penalty for faster generation
+            presence_penalty=0.1,  # Reduced penalty for faster generation
+            repeat_penalty=1.1,  # Slightly increased to prevent repetition
+            tfs_z=1.0,  # Tail free sampling for better quality/speed balance
+            mirostat_mode=0,  # Disable mirostat for speed
+            mirostat_tau=5.0,
+            mirostat_eta=0.1
+        )
+
+    def _finish_turn(self, user_input: str, response_text: str, turn: Dict) -> str:
+        """Post-process the raw model output and record the exchange."""
+        response_text = response_text.strip()
+        
+        # --- Replace parenthetical emotions with emojis ---
+        emotion_to_emoji = {
+            "smiling": "😊",
+            "laughing": "😄",
+            "winking": "😉",
+            "sad": "😢",
+            "crying": "😭",
+            "surprised": "😮",
+            "thinking": "🤔",
+            "confused": "😕",
+            "angry": "😠",
+            # Add more mappings as needed
+        }
+
+        def replace_emotion(match):
+            emotion = match.group(1).lower()
+            # Return emoji or empty string if no match, effectively removing the text
+            return emotion_to_emoji.get(emotion, "") 
+
+        # Pattern: \( + optional whitespace + letters + optional whitespace + \)
+        response_text = re.sub(r'\(\s*([a-zA-Z]+)\s*\)', replace_emotion, response_text)
+        # Remove potential leading/trailing whitespace left after replacement
+        response_text = response_text.strip()
+        # --- End of emoji replacement ---
+
+        # Validate response to prevent training data leaks
+        response_text = self._validate_response(response_text)
+        
+        # Add chatty expressions based on content, context, and humor level
+        response_text = self._add_chatty_expressions(response_text, user_input, turn["humor_level"])
+        
+        # Add birthday reminder if applicable
+        if turn["birthday_reminder"]:
+            response_text = f"{response_text}\n\n{turn['birthday_reminder']}"
+        
+        # Track interaction
+        self._track_interaction(user_input, response_text)
+        
+        # Update conversation history
+        self.conversation_history.append({
+            "role": "user",
+            "content": user_input,
+            "timestamp": datetime.now().isoformat()
+        })
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": response_text,
+            "timestamp": datetime.now().isoformat()
+        })
+        
+        # Keep conversation history manageable; trim in blocks so the prompt prefix stays stable
+        if len(self.conversation_history) > 2 * Config.MAX_HISTORY:
+            self.conversation_history = self.conversation_history[-Config.MAX_HISTORY:]
+        
+        # Update the last meeting time
+        self.user_manager.update_last_interaction()
+        
+        return response_text
+
+    def generate_response_stream(self, user_input: str, max_tokens: int = Config.MAX_TOKENS) -> Iterator[str]:
+        """
+        Generate a response to user input, yielding text as it is decoded.
+
+        The yielded chunks are the raw model output. Once the generator is
+        exhausted, the post-processed reply is available in ``last_response``
+        and the turn timings (``generation_time``, ``first_token_time``,
+        ``completion_tokens``) in ``last_stats``.
+        """
+        self.last_response = ""
+        self.last_stats = {"generation_time": 0, "first_token_time": None, "completion_tokens": 0}
+        try:
+            turn = self._prepare_turn(user_input, max_tokens)
+            if "reply" in turn:
+                self.last_response = turn["reply"]
+                yield turn["reply"]
+                return
+
+            # Generate response
+            start_time = time.time()
+            pieces = []
+            for chunk in self._stream_completion(turn["prompt"], **self._generation_params(turn["max_tokens"])):
+                text = chunk['choices'][0]['text']
+                if not pieces:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                    self.last_stats["first_token_time"] = time.time() - start_time
+                pieces.append(text)
+                yield text
+            self.last_stats["generation_time"] = time.time() - start_time
+
+            self.last_response = self._finish_turn(user_input, "".join(pieces), turn)
+            self.prefill_next_turn()
             
         except Exception as e:
             # --- Debugging: Print the specific exception --- 
@@ -645,7 +1145,15 @@ Response:"""
             # --- End Debugging ---
             error_msg = Config.ERROR_MESSAGES['model_error']
             console.print(f"[red]{error_msg}[/red]") # Keep the original generic message print as well
-            return self.prompt_template.get_error_prompt("model_error", str(e)), 0
+            self.last_response = self.prompt_template.get_error_prompt("model_error", str(e))
+            self.last_stats["generation_time"] = 0
+            yield self.last_response
+
+    def generate_response(self, user_input: str, max_tokens: int = Config.MAX_TOKENS) -> tuple:
+        """Generate a response to user input."""
+        for _ in self.generate_response_stream(user_input, max_tokens):
+            pass
+        return self.last_response, self.last_stats["generation_time"]
             
     def _check_for_greeting(self, user_input: str) -> Optional[str]:
         """Check if the input is a greeting and respond with time elapsed since last conversation."""
@@ -740,28 +1248,34 @@ Response:"""
         return None
         
     def _get_relevant_user_info(self, user_input: str) -> str:
-        """Get relevant user information based on the input query."""
+        """
+        Get relevant user information based on the input query.
+
+        The block depends only on the profile and on which topics the input
+        touches, so it is rebuilt only when one of them changes; otherwise
+        the same text is returned and its tokenized prompt segment is reused.
+        """
         user_data = self.user_manager.user_data
-        user_info = []
-        
-        # Always include name
-        name = user_data.get("name", "User")
-        user_info.append(f"Name: {name}")
-        
+        profile = json.dumps([user_data.get("name", "User"), user_data.get("personal_info", {})],
+                             sort_keys=True, default=str)
+        key = (profile, self._user_info_topics(user_input))
+        if self._user_info_block is None or self._user_info_block[0] != key:
+            self._user_info_block = (key, self._format_user_info(key[1]))
+        return self._user_info_block[1]
+
+    @staticmethod
+    def _user_info_topics(user_input: str) -> tuple:
+        """Profile topics the input asks about."""
         # Get keywords from user input
         input_lower = user_input.lower()
+        topics = []
         
         # Check for topics that might trigger personal information
         if any(word in input_lower for word in ["hobby", "hobbies", "interest", "interests", "like to do"]):
-            hobbies = user_data.get("personal_info", {}).get("hobbies", [])
-            if hobbies:
-                user_info.append(f"Hobbies: {', '.join(hobbies)}")
+            topics.append("hobbies")
                 
         if any(word in input_lower for word in ["family", "spouse", "partner", "wife", "husband", "children", "kids"]):
-            family = user_data.get("personal_info", {}).get("family", {})
-            if family:
-                family_info = [f"{relation}: {name}" for relation, name in family.items()]
-                user_info.append(f"Family: {', '.join(family_info)}")
+            topics.append("family")
                 
         if any(word in input_lower for word in ["favorite", "like", "prefer", "love"]):
             # Check for specific categories
@@ -774,28 +1288,56 @@ Response:"""
                 categories.append("food")
             if "book" in input_lower or "read" in input_lower:
                 categories.append("book")
-                
-            favorites = user_data.get("personal_info", {}).get("favorite_things", {})
-            if favorites:
-                if categories:
-                    # Add only relevant favorites
-                    for category in categories:
-                        if category in favorites:
-                            user_info.append(f"Favorite {category}: {favorites[category]}")
-                else:
-                    # Add all favorites if no specific category
-                    for category, item in favorites.items():
-                        user_info.append(f"Favorite {category}: {item}")
+            topics.append(("favorites", tuple(categories)))
                         
         if any(word in input_lower for word in ["job", "work", "career", "profession"]):
-            occupation = user_data.get("personal_info", {}).get("occupation")
-            if occupation:
-                user_info.append(f"Occupation: {occupation}")
+            topics.append("occupation")
                 
         if any(word in input_lower for word in ["live", "location", "city", "country", "from"]):
-            location = user_data.get("personal_info", {}).get("location")
-            if location:
-                user_info.append(f"Location: {location}")
+            topics.append("location")
+        return tuple(topics)
+
+    def _format_user_info(self, topics: tuple) -> str:
+        """The user information block for the given topics."""
+        user_data = self.user_manager.user_data
+        personal_info = user_data.get("personal_info", {})
+        user_info = []
+        
+        # Always include name
+        name = user_data.get("name", "User")
+        user_info.append(f"Name: {name}")
+
+        for topic in topics:
+            if topic == "hobbies":
+                hobbies = personal_info.get("hobbies", [])
+                if hobbies:
+                    user_info.append(f"Hobbies: {', '.join(hobbies)}")
+            elif topic == "family":
+                family = personal_info.get("family", {})
+                if family:
+                    family_info = [f"{relation}: {name}" for relation, name in family.items()]
+                    user_info.append(f"Family: {', '.join(family_info)}")
+            elif topic == "occupation":
+                occupation = personal_info.get("occupation")
+                if occupation:
+                    user_info.append(f"Occupation: {occupation}")
+            elif topic == "location":
+                location = personal_info.get("location")
+                if location:
+                    user_info.append(f"Location: {location}")
+            else:
+                _, categories = topic
+                favorites = personal_info.get("favorite_things", {})
+                if favorites:
+                    if categories:
+                        # Add only relevant favorites
+                        for category in categories:
+                            if category in favorites:
+                                user_info.append(f"Favorite {category}: {favorites[category]}")
+                    else:
+                        # Add all favorites if no specific category
+                        for category, item in favorites.items():
+                            user_info.append(f"Favorite {category}: {item}")
         
         # Return formatted user info or empty string if none
         return "\n".join(user_info) if user_info else ""
@@ -919,6 +1461,7 @@ Response:"""
     def clear_history(self):
         """Clear the conversation history."""
         self.conversation_history = []
+        self.history_window.reset()
         
     def get_history(self) -> List[Dict[str, str]]:
         """Get the current conversation history."""
@@ -926,8 +1469,8 @@ Response:"""
         
     def __del__(self):
         """Cleanup when the brain is destroyed."""
-        if self.llm:
-            del self.llm 
+        # The registry owns the models; just drop our reference
+        self._llm = None
 
 if __name__ == "__main__":
     pass 
\ No newline at end of file
@@ -0,0 +1,50 @@
+import threading
+from typing import Callable, List, Optional
+from rich.console import Console
+
+console = Console()
+
+class CancellationToken:
+    """
+    Shared flag that lets one turn be aborted from anywhere.
+
+    Generation loops poll ``cancelled`` once per token; resources that
+    cannot poll (e.g. a queued scheduler request) register a callback with
+    ``on_cancel`` that runs as soon as ``cancel()`` is called.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel the turn and run the registered callbacks (once)."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                console.print(f"[yellow]Warning: Cancellation callback failed: {e}[/yellow]")
+
+    def on_cancel(self, callback: Callable[[], None]):
+        """Run ``callback`` on cancellation; immediately if already cancelled."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until cancelled or ``timeout`` elapses; returns whether cancelled."""
+        return self._event.wait(timeout)
@@ -8,16 +8,130 @@ class Config:
     TINYLLAMA_PATH: str = os.path.expanduser('~/tinyllama/tinyllama-1.1b-chat-v1.0.Q5_K_M.gguf')
     #TINYLLAMA_PATH: str = os.path.expanduser('~/Nikita_Agent_model/ggml-nomic-ai-gpt4all-falcon-Q4_1.gguf')
 
+    # Local models known to the ModelRegistry (name -> GGUF path)
+    MODELS = {
+        'tinyllama': TINYLLAMA_PATH,
+        'mistral': os.path.expanduser('~/models/mistral-7b-instruct-v0.2.Q4_K_M.gguf'),
+        'gemma': os.path.expanduser('~/models/gemma-7b-it.Q4_K_M.gguf'),
+        'falcon': os.path.expanduser('~/Nikita_Agent_model/ggml-nomic-ai-gpt4all-falcon-Q4_1.gguf'),
+    }
+    DEFAULT_MODEL: str = 'tinyllama'
+    MODEL_MEMORY_BUDGET_MB: int = 0  # Resident model budget; 0 = 70% of physical RAM
+
     # Audio settings
     SAMPLE_RATE: str = '22050'
+    TTS_WORKERS: int = 2  # Sentences synthesized in parallel while earlier ones play
+    TTS_MIN_SENTENCE_CHARS: int = 20  # Shorter sentences are merged with the next one
+    FIRST_AUDIO_TIMEOUT: float = 30.0  # Max seconds to wait for a turn's first clip before showing the prompt
     
     # Model settings
     CONTEXT_SIZE: int = 1024
-    MAX_TOKENS: int = 1024
-    N_THREADS: int = 8
+    MAX_TOKENS: int = 1024  # Upper bound; clamped to the room left in the context
+    RESERVED_GENERATION_TOKENS: int = 384  # Context kept free for the answer when packing the prompt
+    N_THREADS: int = 8  # Decode threads when the host has not been calibrated (see AutoTuner)
+    N_THREADS_BATCH: int = 0  # Prompt (prefill) threads when not calibrated; 0 = every core
+    ADAPTIVE_THREADS: bool = True  # Lower both thread counts per call when other processes keep cores busy
+    N_BATCH: int = 512
+    N_GPU_LAYERS: int = -1
+
+    # Auto-tuning (python main.py --calibrate)
+    AUTO_TUNE: bool = False  # Calibrate automatically when a model has no cached settings
+    TUNING_CACHE_FILE: str = os.path.expanduser('~/my_AI/llama_tuning.json')
+    TUNE_PROMPT_TOKENS: int = 256  # Prefill benchmark length and typical prompt size
+    TUNE_DECODE_TOKENS: int = 32  # Decode benchmark steps
+    TUNE_GENERATION_TOKENS: int = 150  # Typical answer length used to score settings
+    TUNE_REPEATS: int = 3  # Timed runs per setting; the median is used
+    STREAM_RESPONSES: bool = True  # Print tokens as soon as they are decoded
+
+    # Speculative decoding: "off", "prompt_lookup" (draft-free n-gram lookup) or "draft" (small GGUF model)
+    SPECULATIVE_MODE: str = "off"
+    DRAFT_MODEL_PATH: str = os.path.expanduser('~/tinyllama/tinyllama-1.1b-chat-v1.0.Q5_K_M.gguf')
+    SPECULATIVE_NUM_PRED_TOKENS: int = 10
+    SPECULATIVE_MAX_NGRAM: int = 2
+
+    # Prompt cache settings
+    PROMPT_CACHE_ENABLED: bool = True  # Snapshot the KV state of the static prompt prefix
+    PROMPT_CACHE_DIR: str = os.path.expanduser('~/my_AI/prompt_cache')
+    PROMPT_SEGMENT_CACHE_SIZE: int = 4096  # Tokenized prompt segments (history messages etc.) kept in memory
+
+    # Response cache (memoized completions, local and Gemini)
+    RESPONSE_CACHE_ENABLED: bool = True
+    RESPONSE_CACHE_FILE: str = os.path.expanduser('~/my_AI/response_cache.json')
+    RESPONSE_CACHE_MAX_ENTRIES: int = 1000
+    RESPONSE_CACHE_TTL: float = 7 * 24 * 3600  # Seconds; 0 = never expire
+    RESPONSE_CACHE_VARIANTS: int = 3  # Answers collected per sampled prompt before serving from cache
+
+    # Semantic cache (answers paraphrased inputs from stored replies)
+    SEMANTIC_CACHE_ENABLED: bool = False
+    EMBEDDING_MODEL_PATH: str = os.path.expanduser('~/models/nomic-embed-text-v1.5.Q4_K_M.gguf')
+    EMBEDDING_CONTEXT_SIZE: int = 512
+    SEMANTIC_CACHE_DIR: str = os.path.expanduser('~/my_AI/semantic_cache')
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92  # Minimum cosine similarity for a hit
+    SEMANTIC_CACHE_MAX_ENTRIES: int = 2000
+    SEMANTIC_CACHE_MAX_AGE: float = 30 * 24 * 3600  # Unused entries dropped after this many seconds; 0 = keep
+    SEMANTIC_CACHE_MIN_WORDS: int = 5  # Shorter inputs only hit replies given after the same previous exchange
+    SEMANTIC_CACHE_CANDIDATES: int = 5  # Closest inputs checked for a usable reply
+
+    # Long-term memory (past messages recalled by embedding similarity; uses EMBEDDING_MODEL_PATH)
+    MEMORY_ENABLED: bool = False
+    MEMORY_DIR: str = os.path.expanduser('~/my_AI/memory')
+    MEMORY_EMBEDDING_DIM: int = 128  # Leading embedding components kept; smaller = faster search
+    MEMORY_TOP_K: int = 3  # Most similar past messages recalled per input (each with its reply/question)
+    MEMORY_MIN_SIMILARITY: float = 0.6  # Weaker matches are not recalled
+    MEMORY_TOKEN_BUDGET: int = 150  # Prompt tokens reserved for recalled messages
+
+    # Rolling summary of messages evicted from the history window (local model, idle time)
+    SUMMARY_ENABLED: bool = True
+    SUMMARY_FILE: str = os.path.expanduser('~/my_AI/conversation_summary.json')
+    SUMMARY_BATCH_MESSAGES: int = 6  # Evicted messages folded into the summary per pass
+    SUMMARY_MAX_TOKENS: int = 160
+
+    # Per-turn latency metrics
+    METRICS_ENABLED: bool = True
+    METRICS_FILE: str = os.path.expanduser('~/my_AI/metrics.jsonl')  # One JSON line per turn
+    METRICS_PORT: int = 0  # Serve Prometheus metrics on 127.0.0.1:<port>/metrics; 0 = off
+    METRICS_AUDIO_TIMEOUT: float = 300.0  # Longest wait for a turn's playback before recording it
+
+    # Deterministic fake LLM and TTS for offline testing (python main.py --mock)
+    MOCK_BACKENDS: bool = False
+    MOCK_SEED: int = 0  # Same seed and input, same reply and timings
+    MOCK_TTFT: float = 0.3  # Seconds to the first token
+    MOCK_TOKEN_DELAY: float = 0.03  # Seconds per further token
+    MOCK_RESPONSE_TOKENS: int = 60
+    MOCK_TTS_RTF: float = 0.3  # Synthesis time per second of audio
+    MOCK_SPEECH_WORDS_PER_SECOND: float = 2.5
+    MOCK_JITTER: float = 0.2  # Relative +/- variation of every delay
+
+    # Benchmark suite (python main.py --bench)
+    BENCH_CORPUS_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_prompts.jsonl')
+    BENCH_DIR: str = os.path.expanduser('~/my_AI/bench')  # One JSON results file per run
+    BENCH_REPETITIONS: int = 3  # Runs of every prompt per target
+    BENCH_MAX_TOKENS: int = 128
+    BENCH_REGRESSION_THRESHOLD: float = 0.10  # Relative change of a median flagged as a regression
+
+    # Profiling (python main.py --profile [MODE])
+    PROFILE_ENABLED: bool = False
+    PROFILE_MODE: str = 'spans'  # 'spans' (stage spans only), 'cprofile' or 'sample' (stack sampler, all threads)
+    PROFILE_DIR: str = os.path.expanduser('~/my_AI/profiles')  # One Chrome trace per session
+    PROFILE_SAMPLE_INTERVAL: float = 0.005  # Seconds between stack samples
+    PROFILE_MAX_EVENTS: int = 1000000  # Further trace events are dropped
+
+    # Local model daemon (python main.py --serve)
+    SERVER_HOST: str = '127.0.0.1'
+    SERVER_PORT: int = 8765
+    SERVER_SOCKET: str = ''  # Listen on this Unix socket instead of TCP when set
+    SERVER_URL: str = os.environ.get('RENA_SERVER_URL', 'http://127.0.0.1:8765')  # or unix:/path/to/socket
+    SERVER_LOG_REQUESTS: bool = False
+    SCHEDULER_SLOTS: int = 4  # Requests decoded together in one batch by the daemon
+    SCHEDULER_TIMEOUT: float = 120.0  # Default per-request deadline in seconds (0 = none)
     
     # Conversation settings
     MAX_HISTORY: int = 20
+    HISTORY_TOKEN_BUDGET: int = 384  # Tokens of raw history kept in the prompt
+    HISTORY_EVICT_FRACTION: float = 0.5  # Share of the window dropped at once when it overflows
+    GOODBYE_POOL_SIZE: int = 3  # Goodbye messages pre-generated during idle time
+    SPECULATIVE_PREFILL: bool = True  # Evaluate the next prompt's known prefix while the user types
+    PREFILL_CHUNK_TOKENS: int = 32  # Tokens per background prefill step (bounds the delay of a new turn)
     
     
     # Resource thresholds
@@ -32,3 +146,4 @@ class Config:
         'file_not_found': "Required file not found: {path}",
         'initialization_error': "Failed to initialize: {error}"
     }
+    INTERRUPTED_REPLY_MARK: str = " [interrupted]"  # Appended in the history to replies cut off by the user
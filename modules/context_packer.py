@@ -0,0 +1,190 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Union
+from modules.config import Config
+from modules.history_window import HistoryWindow, estimate_tokens, format_history_message
+from modules.prompt_template import PromptTemplate, PromptSegment
+
+class ContextOverflowError(ValueError):
+    """The required prompt segments leave no room to generate in the context."""
+
+@dataclass
+class PackedPrompt:
+    """A prompt that fits the context, plus the generation budget left for it."""
+    prompt: str
+    prompt_tokens: int
+    max_tokens: int
+    history: List[Dict] = field(default_factory=list)
+    recalled: List[Dict] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+    segments: List[PromptSegment] = field(default_factory=list)  # only with a tokenizing template
+
+    @property
+    def tokens(self) -> Optional[List[int]]:
+        """Token ids of the prompt, if its segments were tokenized."""
+        return PromptTemplate.join_tokens(self.segments) if self.segments else None
+
+class ContextPacker:
+    """
+    Fits the chat prompt and the generation budget into the model context.
+
+    Every segment is measured with the model tokenizer (counts are cached per
+    text, so history messages are only tokenized once) and admitted in
+    priority order until ``n_ctx - reserved_generation`` is reached:
+
+    1. system prompt and user input (always kept, the input is cut if needed)
+    2. personality block
+    3. user information
+    4. rolling summary of the messages before the history window
+    5. conversation history, through the HistoryWindow so evictions happen
+       in blocks and the prompt prefix stays stable
+    6. messages recalled from long-term memory, within their own budget
+       (Config.MEMORY_TOKEN_BUDGET) and skipping those already in the window
+
+    ``max_tokens`` is then clamped so prompt plus generation never exceed
+    the context.
+
+    With a tokenizing ``template`` (see PromptTemplate) segments are measured
+    by their memoized token ids, and the packed prompt carries them, so the
+    model can be fed token ids instead of re-tokenizing the text.
+
+    A remote tokenizer (the model daemon) can also pass ``prefetch``, which
+    counts a list of texts in one round trip; the segments a turn will
+    measure are then sent together before packing instead of one by one.
+    """
+
+    def __init__(self, n_ctx: int = Config.CONTEXT_SIZE,
+                 reserved_generation: int = Config.RESERVED_GENERATION_TOKENS,
+                 count_tokens: Optional[Callable[[str], int]] = None,
+                 template: Optional[PromptTemplate] = None,
+                 prefetch: Optional[Callable[[List[str]], object]] = None):
+        self.n_ctx = n_ctx
+        self.reserved_generation = reserved_generation
+        self.count_tokens = lru_cache(maxsize=4096)(count_tokens or estimate_tokens)
+        self.template = template if template is not None and template.tokenize is not None else None
+        self.prefetch = prefetch if self.template is None else None
+
+    def _segment_cost(self, text: str) -> int:
+        """Tokens a segment (e.g. a history message) adds to the prompt."""
+        if self.template is not None:
+            return len(self.template.segment(text).tokens)
+        return self.count_tokens(text)
+
+    def _measure(self, texts: List[str]) -> int:
+        """Tokens of a whole prompt given as its segment texts, BOS included."""
+        if self.template is not None:
+            return len(PromptTemplate.join_tokens(self.template.segments(texts)))
+        return self.count_tokens("".join(texts)) + 1
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Cut ``text`` (keeping its end) until it fits in ``max_tokens``."""
+        while text and self.count_tokens(text) > max_tokens:
+            text = text[len(text) // 4 or 1:]
+        return text
+
+    def pack(self, system_prompt: str, history: List[Dict], user_input: str,
+             user_info: str = "", history_window: Optional[HistoryWindow] = None,
+             max_tokens: int = Config.MAX_TOKENS, recalled: Optional[List[Dict]] = None,
+             recall_budget: int = Config.MEMORY_TOKEN_BUDGET, summary: str = "") -> PackedPrompt:
+        """Build the largest prompt that leaves room for the reserved generation."""
+        available = self.n_ctx - self.reserved_generation
+        dropped = []
+        include_personality = True
+
+        def build(window, info, personality=True, memories=()):
+            return PromptTemplate.get_chat_segments(system_prompt, window, user_input, info,
+                                                    include_personality=personality, recalled=memories,
+                                                    summary=summary)
+
+        if self.prefetch is not None:
+            # The window never reaches further back than its message limit
+            max_messages = history_window.max_messages if history_window is not None else Config.MAX_HISTORY
+            recent = history[-(max_messages + 1):] + list(recalled or [])
+            self.prefetch(["".join(build([], user_info)), user_input, "\nRelevant Earlier Conversation:\n"]
+                          + [format_history_message(msg) for msg in recent])
+
+        # Required and optional fixed segments, dropped lowest priority first
+        fixed_tokens = self._measure(build([], user_info))
+        if fixed_tokens > available and summary:
+            dropped.append("summary")
+            summary = ""
+            fixed_tokens = self._measure(build([], user_info))
+        if fixed_tokens > available and user_info:
+            dropped.append("user_info")
+            user_info = ""
+            fixed_tokens = self._measure(build([], user_info))
+        if fixed_tokens > available:
+            dropped.append("personality")
+            include_personality = False
+            fixed_tokens = self._measure(build([], user_info, False))
+        if fixed_tokens > available:
+            dropped.append("input")
+            # Re-measured after every cut: the text count only estimates the tokenized prompt
+            while fixed_tokens > available and user_input:
+                overflow = fixed_tokens - available
+                user_input = self._truncate(user_input, max(0, self.count_tokens(user_input) - overflow))
+                fixed_tokens = self._measure(build([], user_info, False))
+        if fixed_tokens >= self.n_ctx:
+            # max_tokens would be 0 (llama-cpp: "until the context is full") or the decode would fail
+            raise ContextOverflowError(f"The system prompt needs {fixed_tokens} tokens, leaving no room to "
+                                       f"generate in a context of {self.n_ctx} tokens")
+
+        # History fills whatever is left after the recalled messages' share
+        recall_budget = min(recall_budget, max(0, available - fixed_tokens)) if recalled else 0
+        history_budget = max(0, available - fixed_tokens - recall_budget)
+        if history_window is not None:
+            window = history_window.select(history, self._segment_cost, history_budget)
+        else:
+            window, used = [], 0
+            for msg in reversed(history):
+                cost = self._segment_cost(format_history_message(msg))
+                if used + cost > history_budget:
+                    break
+                window.insert(0, msg)
+                used += cost
+        if len(window) < len(history):
+            dropped.append("history")
+
+        # Recalled messages, best match first, as long as they fit their budget
+        memories = []
+        if recalled:
+            in_window = {(msg["role"], msg["content"]) for msg in window}
+            used = self._segment_cost("\nRelevant Earlier Conversation:\n")
+            for msg in recalled:
+                if (msg["role"], msg["content"]) in in_window:
+                    continue
+                cost = self._segment_cost(format_history_message(msg))
+                if used + cost > recall_budget:
+                    continue
+                memories.append(msg)
+                used += cost
+
+        texts = build(window, user_info, include_personality, memories)
+        segments = self.template.segments(texts) if self.template is not None else []
+        prompt_tokens = self._measure(texts)
+        return PackedPrompt(
+            prompt="".join(texts),
+            prompt_tokens=prompt_tokens,
+            max_tokens=max(0, min(max_tokens, self.n_ctx - prompt_tokens)),
+            history=window,
+            recalled=memories,
+            dropped=dropped,
+            segments=segments,
+        )
+
+    def known_prefix(self, system_prompt: str, history: List[Dict], user_info: str = "",
+                     history_window: Optional[HistoryWindow] = None,
+                     summary: str = "") -> Union[str, List[int]]:
+        """
+        The part of the next turn's prompt that does not depend on the input.
+
+        Everything up to the final ``User:`` line is fixed once the previous
+        turn has ended, so it can be evaluated while the user is still typing.
+        Returned as token ids when the packer tokenizes segments, else as text.
+        Raises ContextOverflowError like ``pack``.
+        """
+        packed = self.pack(system_prompt, history, "", user_info, history_window, summary=summary)
+        if packed.segments:
+            # The last segment holds the input
+            return PromptTemplate.join_tokens(packed.segments[:-1])
+        return packed.prompt[:packed.prompt.rfind("\nUser: ") + 1]
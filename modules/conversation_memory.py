@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, Iterable, List, Optional
+import numpy as np
+from rich.console import Console
+from modules.config import Config
+from modules.embeddings import Embedder
+
+console = Console()
+
+class ConversationMemory:
+    """
+    Long-term memory over every message ever exchanged.
+
+    Messages are embedded once, when they are written, and appended to a
+    memory-mapped float32 matrix (``vectors.npy``, grown by doubling); their
+    texts go to an append-only ``messages.jsonl``. ``recall`` ranks all stored
+    messages against the input with a single matrix-vector product.
+
+    Vectors are cut to their first ``dim`` components and renormalized. The
+    default embedding model (nomic-embed-text v1.5) is trained so that such
+    prefixes remain good embeddings, and 128 components keep a search over
+    100k messages at a few milliseconds on one core.
+    """
+
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, embedder: Embedder, directory: str = Config.MEMORY_DIR,
+                 dim: int = Config.MEMORY_EMBEDDING_DIM):
+        self.embedder = embedder
+        self.directory = directory
+        self.dim = min(dim, embedder.dim)
+        self.vectors_path = os.path.join(directory, "vectors.npy")
+        self.messages_path = os.path.join(directory, "messages.jsonl")
+        self._vectors: Optional[np.ndarray] = None
+        self._messages: List[Dict] = []
+        self._lock = threading.Lock()
+        self._load()
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = self.embedder.embed(text)[:self.dim]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self.messages_path, "r") as f:
+                for line in f:
+                    try:
+                        self._messages.append(json.loads(line))
+                    except ValueError:
+                        continue  # Partially written last line
+        except OSError:
+            return
+        try:
+            vectors = np.load(self.vectors_path, mmap_mode="r+")
+        except (OSError, ValueError):
+            vectors = None
+        if vectors is not None and vectors.shape[1] == self.dim and vectors.shape[0] >= len(self._messages):
+            self._vectors = vectors
+            return
+        # Index missing or built for another dimension: embed the stored texts again
+        console.print(f"[yellow]Warning: Rebuilding the conversation memory index "
+                      f"({len(self._messages)} messages)...[/yellow]")
+        self._vectors = None
+        self._reserve(len(self._messages))
+        for row, message in enumerate(self._messages):
+            self._vectors[row] = self._embed(message["content"])
+        self._vectors.flush()
+
+    def _reserve(self, rows: int):
+        """Make room for ``rows`` vectors, doubling the file when it is full."""
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if rows <= capacity:
+            return
+        new_capacity = max(self.INITIAL_CAPACITY, capacity)
+        while new_capacity < rows:
+            new_capacity *= 2
+        tmp_path = f"{self.vectors_path}.tmp.npy"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                          shape=(new_capacity, self.dim))
+        if capacity:
+            grown[:capacity] = self._vectors
+        grown.flush()
+        del grown
+        self._vectors = None
+        os.replace(tmp_path, self.vectors_path)
+        self._vectors = np.load(self.vectors_path, mmap_mode="r+")
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def add(self, role: str, content: str):
+        """Embed a message and append it to the memory."""
+        self.add_many([{"role": role, "content": content}])
+
+    def add_many(self, messages: Iterable[Dict]):
+        """Append several messages (e.g. an existing history) at once."""
+        entries = [{"role": msg["role"], "content": msg["content"], "time": msg.get("time", time.time())}
+                   for msg in messages if msg.get("content")]
+        vectors = [self._embed(entry["content"]) for entry in entries]
+        if not entries:
+            return
+        with self._lock:
+            start = len(self._messages)
+            self._reserve(start + len(entries))
+            self._vectors[start:start + len(entries)] = vectors
+            self._messages.extend(entries)
+            with open(self.messages_path, "a") as f:
+                for entry in entries:
+                    f.write(json.dumps(entry) + "\n")
+
+    def recall(self, query: str, k: int = Config.MEMORY_TOP_K,
+               min_similarity: float = Config.MEMORY_MIN_SIMILARITY) -> List[Dict]:
+        """
+        Past messages most similar to ``query``, best first.
+
+        Each hit is returned together with the other half of its exchange
+        (the reply to a user message, or the question an answer was given
+        to), as ``{"role", "content", "score"}`` dicts.
+        """
+        if not self._messages or not query.strip():
+            return []
+        vector = self._embed(query)
+        with self._lock:
+            count = len(self._messages)
+            scores = self._vectors[:count] @ vector
+        k = min(k, count)
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows])]
+        results, seen = [], set()
+        for row in rows:
+            score = float(scores[row])
+            if score < min_similarity:
+                break
+            role = self._messages[row]["role"]
+            partner = row + 1 if role == "user" else row - 1
+            indices = [int(row)]
+            if 0 <= partner < count and self._messages[partner]["role"] != role:
+                indices.append(int(partner))
+            for index in sorted(indices):
+                if index not in seen:
+                    seen.add(index)
+                    message = self._messages[index]
+                    results.append({"role": message["role"], "content": message["content"], "score": score})
+        return results
+
+    def flush(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
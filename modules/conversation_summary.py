@@ -0,0 +1,145 @@
+import os
+import json
+from typing import Callable, Dict, List
+from rich.console import Console
+from modules.config import Config
+from modules.history_window import format_history_message
+
+console = Console()
+
+class RollingSummary:
+    """
+    Compact running summary of the conversation before the history window.
+
+    Messages evicted from the HistoryWindow are not simply lost: once
+    ``batch_messages`` of them have accumulated, the loaded model folds them,
+    together with the previous summary, into a new summary during idle time.
+    The prompt then carries the summary in place of those messages.
+    ``covered`` is the number of history messages the summary accounts for;
+    the state is persisted so it survives restarts.
+    """
+
+    def __init__(self, summary_file: str = Config.SUMMARY_FILE,
+                 batch_messages: int = Config.SUMMARY_BATCH_MESSAGES,
+                 max_tokens: int = Config.SUMMARY_MAX_TOKENS):
+        self.summary_file = summary_file
+        self.batch_messages = max(1, batch_messages)
+        self.max_tokens = max_tokens
+        self.text = ""
+        self.covered = 0
+        self.summarized_tokens = 0  # prompt tokens of all the messages folded in
+        self.summary_tokens = 0
+        self.passes = 0
+        self._epoch = 0  # bumped by reset() so results of older passes are ignored
+        self._load()
+
+    @property
+    def tokens_saved(self) -> int:
+        """Prompt tokens saved by sending the summary instead of the messages it covers."""
+        return max(0, self.summarized_tokens - self.summary_tokens)
+
+    def pending(self, history: List[Dict], window_start: int) -> List[Dict]:
+        """Evicted messages not yet in the summary."""
+        return history[self.covered:window_start]
+
+    def ready(self, history: List[Dict], window_start: int) -> bool:
+        """Whether enough messages are waiting for a summarization pass."""
+        return len(self.pending(history, window_start)) >= self.batch_messages
+
+    def prompt(self, messages: List[Dict]) -> str:
+        """Summarization prompt folding ``messages`` into the current summary."""
+        max_words = int(self.max_tokens * 0.6)
+        conversation = "".join(format_history_message(msg) for msg in messages)
+        return f"""Update the summary of a conversation between a user and their assistant, Rena.
+Keep names, facts about the user, preferences, decisions and open questions; leave out small talk.
+Write at most {max_words} words.
+
+Current summary:
+{self.text or "(none yet)"}
+
+New messages:
+{conversation}
+Updated summary:"""
+
+    def begin_pass(self, history: List[Dict], window_start: int,
+                   count_tokens: Callable[[str], int], max_prompt_tokens: int) -> Dict:
+        """
+        Take the next batch of evicted messages, at most ``batch_messages``
+        and as many as fit in ``max_prompt_tokens``; returns the pass to hand
+        back to ``apply``.
+        """
+        messages = self.pending(history, window_start)[:self.batch_messages]
+        # Measured per message, so each one is tokenized once
+        count, used = 0, count_tokens(self.prompt([]))
+        for msg in messages:
+            used += count_tokens(format_history_message(msg))
+            if count and used > max_prompt_tokens:
+                break
+            count += 1
+        # The joined prompt can tokenize slightly differently than its parts
+        while count > 1 and count_tokens(self.prompt(messages[:count])) > max_prompt_tokens:
+            count -= 1
+        batch = messages[:count]
+        # A single message too long to summarize is cut down
+        while batch and len(batch[0]["content"]) > 1 and count_tokens(self.prompt(batch)) > max_prompt_tokens:
+            batch = [{**batch[0], "content": batch[0]["content"][:len(batch[0]["content"]) * 3 // 4]}]
+        return {"epoch": self._epoch, "start": self.covered, "count": count,
+                "prompt": self.prompt(batch), "messages": messages[:count]}
+
+    def apply(self, summary_pass: Dict, text: str, count_tokens: Callable[[str], int]) -> bool:
+        """Install the summary produced by a pass; stale or empty results are dropped."""
+        text = text.strip()
+        if not text or summary_pass["epoch"] != self._epoch or summary_pass["start"] != self.covered:
+            return False
+        self.summarized_tokens += sum(count_tokens(format_history_message(msg))
+                                      for msg in summary_pass["messages"])
+        self.text = text
+        self.summary_tokens = count_tokens(text)
+        self.covered += summary_pass["count"]
+        self.passes += 1
+        self.save()
+        return True
+
+    def reset(self):
+        """Forget the summary (e.g. after the history is cleared)."""
+        self._epoch += 1
+        self.text = ""
+        self.covered = 0
+        self.summarized_tokens = 0
+        self.summary_tokens = 0
+        self.save()
+
+    def stats(self) -> Dict:
+        return {
+            "covered": self.covered,
+            "passes": self.passes,
+            "summary_tokens": self.summary_tokens,
+            "tokens_saved": self.tokens_saved,
+        }
+
+    def _load(self):
+        try:
+            with open(self.summary_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.text = data.get("text", "")
+        self.covered = data.get("covered", 0)
+        self.summarized_tokens = data.get("summarized_tokens", 0)
+        self.summary_tokens = data.get("summary_tokens", 0)
+
+    def save(self):
+        """Write the summary to disk (atomically)."""
+        try:
+            os.makedirs(os.path.dirname(self.summary_file), exist_ok=True)
+            tmp_path = f"{self.summary_file}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({
+                    "text": self.text,
+                    "covered": self.covered,
+                    "summarized_tokens": self.summarized_tokens,
+                    "summary_tokens": self.summary_tokens,
+                }, f)
+            os.replace(tmp_path, self.summary_file)
+        except OSError as e:
+            console.print(f"[yellow]Warning: Could not save conversation summary: {e}[/yellow]")
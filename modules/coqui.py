@@ -1,6 +1,7 @@
 from gradio_client import Client, handle_file
 import os
 import sys
+import subprocess
 
 def init():
     global client
@@ -30,17 +31,31 @@ def generate_audio(text):
         print("No audio file returned.")
         return None
 
-def play_audio_file(audio_path):
+def play_audio_file(audio_path, cancel_token=None):
     #print(f"Playing audio: {audio_path}")
     # Try to play audio using aplay, paplay, or ffplay
     played = False
-    for player in ["paplay", "aplay", "ffplay -autoexit -nodisp"]:
-        cmd = f"{player} '{audio_path}'"
-        exit_code = os.system(cmd)
+    for player in [["paplay"], ["aplay"], ["ffplay", "-autoexit", "-nodisp"]]:
+        try:
+            process = subprocess.Popen(player + [audio_path],
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            continue
+        # Poll so a cancelled turn stops the player right away
+        while True:
+            if cancel_token is not None and cancel_token.cancelled:
+                process.terminate()
+                process.wait()
+                return
+            try:
+                exit_code = process.wait(timeout=0.05)
+                break
+            except subprocess.TimeoutExpired:
+                pass
         if exit_code == 0:
             played = True
             break
     if not played:
         print(f"Could not play audio. Please play it manually: {audio_path}")
     else:
-        pass
\ No newline at end of file
+        pass
@@ -0,0 +1,44 @@
+import threading
+import warnings
+from functools import lru_cache
+import numpy as np
+from llama_cpp import Llama
+from modules.config import Config
+
+class Embedder:
+    """
+    Sentence embeddings from a llama-cpp embedding model (e.g. nomic-embed-text).
+
+    Vectors are L2-normalized, so the dot product of two embeddings is their
+    cosine similarity. Models without a pooling layer are mean-pooled here.
+    """
+
+    def __init__(self, model_path: str = Config.EMBEDDING_MODEL_PATH,
+                 n_ctx: int = Config.EMBEDDING_CONTEXT_SIZE, n_threads: int = None):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            self.llm = Llama(
+                model_path=model_path,
+                embedding=True,
+                n_ctx=n_ctx,
+                n_threads=n_threads,
+                verbose=False
+            )
+        self.model_path = model_path
+        self._lock = threading.Lock()
+        self.embed = lru_cache(maxsize=1024)(self._embed)
+
+    def _embed(self, text: str) -> np.ndarray:
+        with self._lock:
+            vector = np.asarray(self.llm.embed(text), dtype=np.float32)
+        if vector.ndim == 2:
+            vector = vector.mean(axis=0)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    @property
+    def dim(self) -> int:
+        return self.llm.n_embd()
+
+    def close(self):
+        self.llm.close()
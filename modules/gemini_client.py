@@ -6,20 +6,23 @@ class GeminiClient:
     """
     A client to interact with the Google Gemini API.
     """
-    def __init__(self, api_key: str, model: str = "gemini-1.5-flash"):
+    def __init__(self, api_key: str, model: str = "gemini-1.5-flash", response_cache=None):
         """
         Initializes the Gemini client.
 
         Args:
             api_key: The Google AI API key.
             model: The Gemini model to use (e.g., "gemini-1.5-flash").
+            response_cache: Optional ResponseCache; cache hits skip the API round trip.
         """
         if not api_key:
             raise ValueError("API key cannot be empty.")
         self.api_key = api_key
         self.model = model
         self.api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={self.api_key}"
+        self.stream_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?alt=sse&key={self.api_key}"
         self.headers = {"Content-Type": "application/json"}
+        self.response_cache = response_cache
 
     def __call__(self, 
                  prompt: str, 
@@ -27,8 +30,8 @@ class GeminiClient:
                  temperature: float | None = None, 
                  stop: list[str] | None = None,
                  echo: bool = False, # Parameter to match Llama interface, ignored by Gemini
-                 stream: bool = False # Parameter to match Llama interface, ignored by Gemini
-                 ) -> dict:
+                 stream: bool = False
+                 ):
         """
         Generates content using the Gemini API, mimicking the llama-cpp-python call signature.
 
@@ -38,7 +41,8 @@ class GeminiClient:
             temperature: Controls randomness (0.0-1.0). Higher values are more creative.
             stop: A list of sequences where the API will stop generating further tokens.
             echo: Ignored. Present for compatibility.
-            stream: Ignored. Present for compatibility.
+            stream: If True, return a generator of chunks (same shape as the
+                dictionary below) as the API produces them.
 
 
         Returns:
@@ -53,19 +57,17 @@ class GeminiClient:
             }
             Returns an error structure on failure.
         """
-        payload = {
-            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
-            "generationConfig": {}
-        }
+        if self.response_cache is not None:
+            return self.response_cache.cached_call(self._generate, self.model, prompt, stream=stream,
+                                                   max_tokens=max_tokens, temperature=temperature, stop=stop)
+        return self._generate(prompt, max_tokens, temperature, stop, stream=stream)
 
-        if temperature is not None:
-            payload["generationConfig"]["temperature"] = temperature
-        if max_tokens is not None:
-            # Note: Gemini uses 'maxOutputTokens'. Mapping Llama's 'max_tokens'.
-            payload["generationConfig"]["maxOutputTokens"] = max_tokens 
-        if stop:
-             # Note: Gemini uses 'stopSequences'. Mapping Llama's 'stop'.
-            payload["generationConfig"]["stopSequences"] = stop
+    def _generate(self, prompt: str, max_tokens: int | None = None, temperature: float | None = None,
+                  stop: list[str] | None = None, stream: bool = False):
+        """Call the API (see ``__call__``)."""
+        payload = self._build_payload(prompt, max_tokens, temperature, stop)
+        if stream:
+            return self._stream(payload)
 
         try:
             response = requests.post(self.api_url, headers=self.headers, data=json.dumps(payload))
@@ -135,6 +137,59 @@ class GeminiClient:
                 ]
             }
 
+    def _build_payload(self, prompt: str, max_tokens: int | None, temperature: float | None, stop: list[str] | None) -> dict:
+        """Build the generateContent request body from Llama-style arguments."""
+        payload = {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": {}
+        }
+
+        if temperature is not None:
+            payload["generationConfig"]["temperature"] = temperature
+        if max_tokens is not None:
+            # Note: Gemini uses 'maxOutputTokens'. Mapping Llama's 'max_tokens'.
+            payload["generationConfig"]["maxOutputTokens"] = max_tokens 
+        if stop:
+             # Note: Gemini uses 'stopSequences'. Mapping Llama's 'stop'.
+            payload["generationConfig"]["stopSequences"] = stop
+        return payload
+
+    def _stream(self, payload: dict):
+        """
+        Yield Llama-style chunks from the streamGenerateContent endpoint.
+
+        The API sends server-sent events; each ``data:`` line carries a partial
+        candidate whose text is yielded as soon as it arrives.
+        """
+        try:
+            with requests.post(self.stream_url, headers=self.headers, data=json.dumps(payload), stream=True) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    event = json.loads(line[len("data:"):])
+                    candidates = event.get("candidates", [])
+                    if not candidates:
+                        continue
+                    parts = candidates[0].get("content", {}).get("parts", [{}])
+                    text = "".join(part.get("text", "") for part in parts)
+                    yield {
+                        "choices": [
+                            {
+                                "text": text,
+                                "finish_reason": candidates[0].get("finishReason")
+                            }
+                        ]
+                    }
+        except requests.exceptions.RequestException as e:
+            error_msg = f"Gemini API request failed: {e}"
+            print(f"[red]{error_msg}[/red]") # Use print for visibility
+            yield {"choices": [{"text": f"(Error: {error_msg})", "finish_reason": "error"}]}
+        except Exception as e:
+            error_msg = f"Gemini: Error processing stream: {e}"
+            print(f"[red]{error_msg}[/red]") # Use print for visibility
+            yield {"choices": [{"text": f"(Error: {error_msg})", "finish_reason": "error"}]}
+
 # Example usage (optional, for testing):
 if __name__ == "__main__":
     api_key = os.getenv("GEMINI_API_KEY")
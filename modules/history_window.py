@@ -0,0 +1,94 @@
+from typing import Callable, Dict, List, Optional
+from modules.config import Config
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count used when no model tokenizer is available."""
+    return max(1, len(text) // 4)
+
+def format_history_message(msg: Dict) -> str:
+    """Render one history message exactly as it appears in the chat prompt."""
+    role = "Assistant" if msg["role"] == "assistant" else "User"
+    return f"{role}: {msg['content']}\n"
+
+class HistoryWindow:
+    """
+    Append-only window over the conversation history.
+
+    A sliding "last N messages" window changes the start of the history block
+    every turn, so llama-cpp's prefix matching misses from that point on. This
+    window keeps its start fixed while new messages are appended, and only
+    when the token budget or Config.MAX_HISTORY is exceeded does it jump
+    forward, evicting a large block at once. Between evictions consecutive
+    prompts share everything up to the newest messages.
+    """
+
+    def __init__(self,
+                 token_budget: int = Config.HISTORY_TOKEN_BUDGET,
+                 max_messages: int = Config.MAX_HISTORY,
+                 evict_fraction: float = Config.HISTORY_EVICT_FRACTION):
+        self.token_budget = token_budget
+        self.max_messages = max_messages
+        self.evict_fraction = evict_fraction
+        self._anchor: Optional[Dict] = None  # first message inside the window
+        self.evictions = 0
+
+    def _find_start(self, history: List[Dict]) -> Optional[int]:
+        """Locate the current window start; messages are matched by identity."""
+        if self._anchor is None:
+            return None
+        for i in range(len(history) - 1, -1, -1):
+            if history[i] is self._anchor:
+                return i
+        # The anchor was trimmed away or the history was cleared
+        return None
+
+    def _tail(self, history: List[Dict], count_tokens: Callable[[str], int], budget: int):
+        """
+        Start of a new window and its message costs, measured from the newest message back.
+
+        Stops at the first message that exceeds the budget or message limit
+        (it is kept, so ``select`` evicts down to the usual target), so a long
+        saved history is not tokenized as a whole after a restart.
+        """
+        start, costs, total = len(history), [], 0
+        while start > 0 and total <= budget and len(costs) <= self.max_messages:
+            start -= 1
+            costs.append(count_tokens(format_history_message(history[start])))
+            total += costs[-1]
+        return start, costs[::-1]
+
+    def select(self, history: List[Dict],
+               count_tokens: Optional[Callable[[str], int]] = None,
+               token_budget: Optional[int] = None) -> List[Dict]:
+        """Return the messages to include in the prompt for this turn."""
+        count_tokens = count_tokens or estimate_tokens
+        budget = self.token_budget if token_budget is None else token_budget
+        start = self._find_start(history)
+        if start is None:
+            start, costs = self._tail(history, count_tokens, budget)
+        else:
+            costs = [count_tokens(format_history_message(msg)) for msg in history[start:]]
+        window = history[start:]
+
+        total = sum(costs)
+        if total > budget or len(window) > self.max_messages:
+            # Evict a whole block so the following turns can append to a stable prefix
+            target_tokens = budget * (1 - self.evict_fraction)
+            target_messages = int(self.max_messages * (1 - self.evict_fraction))
+            drop = 0
+            while drop < len(window) and (total > target_tokens or len(window) - drop > target_messages):
+                total -= costs[drop]
+                drop += 1
+            window = window[drop:]
+            self.evictions += 1
+
+        self._anchor = window[0] if window else None
+        return window
+
+    def reset(self):
+        """Forget the window position (e.g. after the history is cleared)."""
+        self._anchor = None
+
+    def start_at(self, message: Dict):
+        """Make ``message`` the first one in the window (e.g. after a restart)."""
+        self._anchor = message
@@ -0,0 +1,94 @@
+import threading
+import contextlib
+from collections import deque
+from typing import Callable, Iterator
+from rich.console import Console
+
+console = Console()
+
+class IdleTaskRunner:
+    """
+    Runs background jobs only while no real turn is in progress.
+
+    A job is a callable returning a generator; the runner advances it one
+    step (e.g. one decoded token) at a time. When a turn starts (``turn()``),
+    the running job is stopped after its current step and queued again, so
+    idle work never holds the model for longer than a single step.
+    """
+
+    def __init__(self):
+        self._jobs: deque = deque()
+        self._cond = threading.Condition()
+        self._step_lock = threading.Lock()
+        self._active_turns = 0
+        self._running = None
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="idle-tasks", daemon=True)
+        self._worker.start()
+
+    def submit(self, name: str, job: Callable[[], Iterator]):
+        """Queue a job to run when the model is idle."""
+        with self._cond:
+            self._jobs.append((name, job))
+            self._cond.notify()
+
+    def discard(self, name: str):
+        """Drop queued (not yet started) jobs with this name."""
+        with self._cond:
+            self._jobs = deque(job for job in self._jobs if job[0] != name)
+
+    def pending(self, name: str) -> int:
+        """Number of queued or running jobs with this name."""
+        with self._cond:
+            return sum(1 for job_name, _ in self._jobs if job_name == name) + (self._running == name)
+
+    @contextlib.contextmanager
+    def turn(self):
+        """Hold off idle work while a real turn uses the model."""
+        with self._cond:
+            self._active_turns += 1
+        # Wait for the step in flight; the job is stopped before the lock is released
+        with self._step_lock:
+            pass
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active_turns -= 1
+                self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (self._active_turns or not self._jobs):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                name, job = self._jobs.popleft()
+                self._running = name
+            steps = None
+            try:
+                while True:
+                    with self._step_lock:
+                        if steps is None:
+                            steps = job()
+                        try:
+                            next(steps)
+                        except StopIteration:
+                            break
+                        if self._active_turns:
+                            # Preempted: stop before the turn gets the lock, retry later
+                            steps.close()
+                            with self._cond:
+                                self._jobs.appendleft((name, job))
+                            break
+            except Exception as e:
+                console.print(f"[yellow]Warning: Idle task '{name}' failed: {e}[/yellow]")
+            finally:
+                with self._cond:
+                    self._running = None
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence
+from rich.console import Console
+from modules.config import Config
+
+console = Console()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+RATIO_BUCKETS = (0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0)
+
+class Histogram:
+    """Histogram with cumulative buckets, as in the Prometheus text format."""
+
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            label = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f'{self.name}_bucket{{le="{label}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {self.sum:g}")
+        lines.append(f"{self.name}_count {self.count}")
+        return lines
+
+class TurnMetrics:
+    """
+    Latency breakdown of every conversation turn.
+
+    ``record`` takes one turn's measurements (keys of ``METRICS``; missing or
+    ``None`` values are skipped, e.g. TTS figures of a silent turn), adds
+    them to a histogram per metric and appends the turn as one JSON line to
+    ``metrics_file``. ``render`` returns the histograms in the Prometheus
+    text format, which ``serve`` exposes at ``http://127.0.0.1:<port>/metrics``.
+    """
+
+    METRICS = {
+        "intent_check_seconds": ("Time spent on profile queries and the semantic cache before prompting",
+                                 LATENCY_BUCKETS),
+        "prompt_build_seconds": ("Time spent recalling memories and packing the prompt", LATENCY_BUCKETS),
+        "prompt_tokens": ("Tokens in the prompt", TOKEN_BUCKETS),
+        "generated_tokens": ("Tokens generated for the reply", TOKEN_BUCKETS),
+        "prefill_tokens_per_second": ("Prompt evaluation speed", RATE_BUCKETS),
+        "decode_tokens_per_second": ("Generation speed", RATE_BUCKETS),
+        "time_to_first_token_seconds": ("Time from the request to the first visible token", LATENCY_BUCKETS),
+        "generation_seconds": ("Time from the request to the end of the reply", LATENCY_BUCKETS),
+        "tts_synthesis_seconds": ("Time spent synthesizing the reply's clips", LATENCY_BUCKETS),
+        "tts_real_time_factor": ("Synthesis time per second of played audio", RATIO_BUCKETS),
+        "time_to_first_audio_seconds": ("Time from the request to the start of playback", LATENCY_BUCKETS),
+        "playback_seconds": ("Time spent playing the reply", LATENCY_BUCKETS),
+    }
+
+    def __init__(self, metrics_file: str = Config.METRICS_FILE, prefix: str = "rena_turn_"):
+        self.metrics_file = metrics_file
+        self.histograms = {name: Histogram(prefix + name, help_text, buckets)
+                           for name, (help_text, buckets) in self.METRICS.items()}
+        self._lock = threading.Lock()
+        self.httpd = None
+
+    def record(self, values: Dict, **labels):
+        """Observe one turn; ``labels`` (e.g. the backend) only go to the JSONL record."""
+        values = {name: value for name, value in values.items() if name in self.METRICS and value is not None}
+        with self._lock:
+            for name, value in values.items():
+                self.histograms[name].observe(value)
+            if not self.metrics_file:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.metrics_file), exist_ok=True)
+                with open(self.metrics_file, "a") as f:
+                    f.write(json.dumps({"time": time.time(), **labels, **values}) + "\n")
+            except OSError as e:
+                console.print(f"[yellow]Warning: Could not write metrics: {e}[/yellow]")
+
+    def render(self) -> str:
+        with self._lock:
+            lines = [line for histogram in self.histograms.values() for line in histogram.render()]
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int = Config.METRICS_PORT, host: str = "127.0.0.1"):
+        """Serve ``/metrics`` on a background thread."""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        try:
+            self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            console.print(f"[yellow]Warning: Could not serve metrics on port {port}: {e}[/yellow]")
+            return
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="metrics", daemon=True).start()
+        console.print(f"[dim]Metrics at http://{host}:{self.httpd.server_address[1]}/metrics[/dim]")
+
+    def shutdown(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
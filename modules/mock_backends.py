@@ -0,0 +1,166 @@
+import os
+import time
+import wave
+import random
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Iterator, List, Optional
+from modules.config import Config
+from modules.cancellation import CancellationToken
+from modules.history_window import estimate_tokens
+
+WORDS = (
+    "well", "I", "think", "that", "sounds", "really", "interesting", "you", "could", "try", "a", "little",
+    "more", "of", "it", "every", "day", "and", "see", "how", "feels", "oh", "the", "best", "part", "is",
+    "learning", "something", "new", "with", "friends", "hmm", "maybe", "start", "small", "then", "grow",
+)
+
+def _seeded_random(*parts) -> random.Random:
+    """Random generator determined by ``parts`` and Config.MOCK_SEED."""
+    material = repr((Config.MOCK_SEED,) + parts).encode("utf-8")
+    return random.Random(int.from_bytes(hashlib.sha256(material).digest()[:8], "big"))
+
+def _jittered(rng: random.Random, delay: float, jitter: float) -> float:
+    return max(0.0, delay * (1 + rng.uniform(-jitter, jitter)))
+
+class MockLLM:
+    """
+    Stand-in for Brain / GeminiClient without a model or network.
+
+    Same call surface (``llm(prompt, max_tokens=..., stream=...)``, chunks and
+    completions shaped like llama-cpp's, ``last_stats``, ``count_tokens``).
+    The reply is a pseudo-random text determined by the prompt and
+    Config.MOCK_SEED, so runs are reproducible; the first token arrives
+    after ``ttft`` and each further one after ``token_delay`` seconds, both
+    varied by +/- ``jitter`` (a fraction, also seeded by the prompt). A
+    ``cancel_token`` ends the reply at the next token, as with Brain.
+    """
+
+    def __init__(self, ttft: float = Config.MOCK_TTFT, token_delay: float = Config.MOCK_TOKEN_DELAY,
+                 jitter: float = Config.MOCK_JITTER, response_tokens: int = Config.MOCK_RESPONSE_TOKENS):
+        self.ttft = ttft
+        self.token_delay = token_delay
+        self.jitter = jitter
+        self.response_tokens = response_tokens
+        self.model_name = "mock"
+        self.context_size = Config.CONTEXT_SIZE
+        self.last_stats: Dict = {}
+
+    def count_tokens(self, text: str) -> int:
+        return estimate_tokens(text)
+
+    def reply_tokens(self, prompt, max_tokens: Optional[int] = None) -> List[str]:
+        """The pieces of text (one per token) the reply to ``prompt`` consists of."""
+        rng = _seeded_random("reply", prompt if isinstance(prompt, str) else list(prompt))
+        count = min(self.response_tokens, max_tokens or self.response_tokens)
+        pieces = []
+        sentence_length = rng.randint(6, 14)
+        for i in range(count):
+            word = rng.choice(WORDS)
+            if sentence_length == 0 or i == count - 1:
+                pieces.append(f" {word}.")
+                sentence_length = rng.randint(6, 14)
+            else:
+                pieces.append(f" {word}")
+                sentence_length -= 1
+        return pieces
+
+    def __call__(self, prompt, max_tokens: Optional[int] = None, temperature: Optional[float] = None,
+                 stop: Optional[List[str]] = None, echo: bool = False, stream: bool = False,
+                 cancel_token: Optional[CancellationToken] = None, **kwargs):
+        self.last_stats = {}
+        chunks = self._stream(prompt, max_tokens, cancel_token)
+        if stream:
+            return chunks
+        pieces, finish_reason = [], None
+        for chunk in chunks:
+            pieces.append(chunk["choices"][0]["text"])
+            finish_reason = chunk["choices"][0]["finish_reason"]
+        return {
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": self.model_name,
+            "choices": [{"text": "".join(pieces), "index": 0, "logprobs": None,
+                         "finish_reason": finish_reason}],
+            "usage": {"completion_tokens": len(pieces)},
+        }
+
+    def _stream(self, prompt, max_tokens: Optional[int],
+                cancel_token: Optional[CancellationToken]) -> Iterator[Dict]:
+        cancel_token = cancel_token or CancellationToken()
+        pieces = self.reply_tokens(prompt, max_tokens)
+        rng = _seeded_random("latency", prompt if isinstance(prompt, str) else list(prompt))
+        start = time.time()
+        first_token_time = None
+        emitted = 0
+        try:
+            for i, piece in enumerate(pieces):
+                delay = self.ttft if i == 0 else self.token_delay
+                if cancel_token.wait(_jittered(rng, delay, self.jitter)):
+                    self.last_stats["cancelled"] = True
+                    break
+                if first_token_time is None:
+                    first_token_time = time.time() - start
+                emitted += 1
+                last = i == len(pieces) - 1
+                yield {"choices": [{"text": piece, "index": 0, "logprobs": None,
+                                    "finish_reason": "length" if last else None}]}
+        finally:
+            # Also when the consumer closes the stream early
+            decode_time = time.time() - start - (first_token_time or 0)
+            self.last_stats.update({
+                "prompt_tokens": self.count_tokens(prompt) if isinstance(prompt, str) else len(prompt),
+                "completion_tokens": emitted,
+                "tokens_per_second": (emitted - 1) / decode_time if emitted > 1 and decode_time > 0 else 0.0,
+            })
+
+class MockTTS:
+    """
+    Stand-in for the coqui module (``init``, ``generate_audio``, ``play_audio_file``).
+
+    ``generate_audio`` writes a silent WAV whose length follows the text
+    (Config.MOCK_SPEECH_WORDS_PER_SECOND) and takes ``real_time_factor`` times
+    that long, +/- ``jitter``; the file name and timing are determined by the
+    text. ``play_audio_file`` waits for the clip's duration instead of
+    playing it and stops early when ``cancel_token`` is cancelled.
+    """
+
+    SAMPLE_RATE = 8000
+
+    def __init__(self, real_time_factor: float = Config.MOCK_TTS_RTF, jitter: float = Config.MOCK_JITTER,
+                 words_per_second: float = Config.MOCK_SPEECH_WORDS_PER_SECOND,
+                 directory: Optional[str] = None):
+        self.real_time_factor = real_time_factor
+        self.jitter = jitter
+        self.words_per_second = words_per_second
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "rena_mock_tts")
+
+    def init(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def duration(self, text: str) -> float:
+        """Seconds of speech for ``text``."""
+        return max(0.2, len(text.split()) / self.words_per_second)
+
+    def generate_audio(self, text: str) -> Optional[str]:
+        duration = self.duration(text)
+        rng = _seeded_random("tts", text)
+        time.sleep(_jittered(rng, duration * self.real_time_factor, self.jitter))
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(self.directory, f"{digest}.wav")
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with wave.open(tmp_path, "wb") as f:
+                f.setnchannels(1)
+                f.setsampwidth(2)
+                f.setframerate(self.SAMPLE_RATE)
+                f.writeframes(b"\0\0" * int(duration * self.SAMPLE_RATE))
+            os.replace(tmp_path, path)
+        return path
+
+    def play_audio_file(self, audio_path: str, cancel_token: Optional[CancellationToken] = None):
+        with wave.open(audio_path, "rb") as f:
+            duration = f.getnframes() / f.getframerate()
+        (cancel_token or CancellationToken()).wait(duration)
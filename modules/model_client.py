@@ -0,0 +1,139 @@
+import json
+import socket
+import http.client
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+from modules.config import Config
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection over a Unix domain socket."""
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class ModelServerClient:
+    """
+    Client for the local model daemon (see ModelServer).
+
+    Mimics the llama-cpp-python call signature, like GeminiClient, so it can
+    be used as the chatbot's ``llm``. ``url`` is either ``http://host:port``
+    or ``unix:/path/to/socket``. Token counts are memoized, and
+    ``count_tokens_batch`` fetches any missing ones in a single request.
+    """
+
+    # Memoized token counts
+    MAX_COUNTED_TEXTS = 4096
+
+    def __init__(self, url: str = Config.SERVER_URL, timeout: Optional[float] = None):
+        self.url = url
+        self.timeout = timeout
+        self.model_name = None
+        self._token_counts: "OrderedDict[str, int]" = OrderedDict()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.url.startswith("unix:"):
+            return _UnixHTTPConnection(self.url[len("unix:"):], timeout=self.timeout)
+        parsed = urlparse(self.url)
+        return http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, payload: Optional[Dict] = None):
+        conn = self._connection()
+        body = json.dumps(payload) if payload is not None else None
+        conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        if response.status != 200:
+            detail = response.read().decode("utf-8", errors="ignore")
+            conn.close()
+            raise RuntimeError(f"Model server returned {response.status}: {detail}")
+        return conn, response
+
+    def health(self) -> Dict:
+        """Return the daemon's health status (raises if it is not reachable)."""
+        conn, response = self._request("GET", "/health")
+        try:
+            status = json.loads(response.read())
+        finally:
+            conn.close()
+        self.model_name = status.get("model")
+        return status
+
+    def __call__(self,
+                 prompt: str,
+                 max_tokens: Optional[int] = None,
+                 temperature: Optional[float] = None,
+                 stop: Optional[List[str]] = None,
+                 echo: bool = False, # Parameter to match Llama interface, ignored by the daemon
+                 stream: bool = False,
+                 **kwargs):
+        """Request a completion; with ``stream=True`` returns a generator of chunks."""
+        payload = {"prompt": prompt, "stream": stream, **kwargs}
+        if max_tokens is not None:
+            payload["max_tokens"] = max_tokens
+        if temperature is not None:
+            payload["temperature"] = temperature
+        if stop:
+            payload["stop"] = stop
+        if stream:
+            return self._stream("/v1/completions", payload)
+        conn, response = self._request("POST", "/v1/completions", payload)
+        try:
+            return json.loads(response.read())
+        finally:
+            conn.close()
+
+    def chat(self, messages: List[Dict], stream: bool = False, **kwargs):
+        """Request a chat completion from OpenAI-style ``messages``."""
+        payload = {"messages": messages, "stream": stream, **kwargs}
+        if stream:
+            return self._stream("/v1/chat/completions", payload)
+        conn, response = self._request("POST", "/v1/chat/completions", payload)
+        try:
+            return json.loads(response.read())
+        finally:
+            conn.close()
+
+    def _stream(self, path: str, payload: Dict) -> Iterator[Dict]:
+        """Yield the JSON events of a server-sent event stream."""
+        conn, response = self._request("POST", path, payload)
+        try:
+            for raw_line in response:
+                line = raw_line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                yield json.loads(data)
+        finally:
+            conn.close()
+
+    def count_tokens(self, text: str) -> int:
+        """Number of model tokens in ``text``, counted by the daemon's tokenizer."""
+        return self.count_tokens_batch([text])[0]
+
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Token counts of several texts; those not seen before are tokenized in one request."""
+        missing = list(dict.fromkeys(text for text in texts if text not in self._token_counts))
+        if missing:
+            conn, response = self._request("POST", "/extras/tokenize", {"input": missing})
+            try:
+                token_lists = json.loads(response.read())["tokens"]
+            finally:
+                conn.close()
+            for text, tokens in zip(missing, token_lists):
+                self._token_counts[text] = len(tokens)
+        counts = []
+        for text in texts:
+            self._token_counts.move_to_end(text)
+            counts.append(self._token_counts[text])
+        while len(self._token_counts) > self.MAX_COUNTED_TEXTS:
+            self._token_counts.popitem(last=False)
+        return counts
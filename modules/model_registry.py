@@ -0,0 +1,140 @@
+import os
+import gc
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import psutil
+from llama_cpp import Llama
+from rich.console import Console
+from modules.config import Config
+
+console = Console()
+
+class ModelRegistry:
+    """
+    Registry of local GGUF models.
+
+    Models are loaded lazily, on the first ``get()`` for their name. Before a
+    model is loaded, the least recently used resident models are evicted
+    until the estimated resident memory fits in the budget, so models can be
+    switched mid-session without restarting.
+
+    A model's memory is estimated from its weights plus the KV cache of
+    ``context_tokens`` positions (from the GGUF's layer and head counts)
+    until it has been loaded once; from then on the process RSS growth
+    measured during the load is used when it is larger (e.g. compute
+    buffers), since mmap'd weights may not all be resident right after loading.
+    """
+
+    # Scratch buffers relative to the GGUF file
+    MEMORY_OVERHEAD = 1.05
+
+    def __init__(self, loader: Callable[[str], object],
+                 models: Optional[Dict[str, str]] = None,
+                 memory_budget_mb: int = Config.MODEL_MEMORY_BUDGET_MB,
+                 context_tokens: int = Config.CONTEXT_SIZE):
+        self.loader = loader
+        self.context_tokens = context_tokens
+        self.models: Dict[str, str] = dict(models if models is not None else Config.MODELS)
+        if not memory_budget_mb:
+            memory_budget_mb = int(psutil.virtual_memory().total / (1024 * 1024) * 0.7)
+        self.memory_budget_mb = memory_budget_mb
+        self._loaded: "OrderedDict[str, object]" = OrderedDict()
+        self._measured_mb: Dict[str, float] = {}  # RSS growth while loading, per model
+        self._kv_mb: Dict[str, float] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, path: str) -> str:
+        """Add (or replace) a model entry and return its name."""
+        with self._lock:
+            if self.models.get(name) != path and name in self._loaded:
+                self.evict(name)
+            self.models[name] = path
+            self._measured_mb.pop(name, None)
+            self._kv_mb.pop(name, None)
+        return name
+
+    def names(self) -> List[str]:
+        """All registered model names."""
+        return list(self.models)
+
+    def available(self) -> List[str]:
+        """Registered models whose GGUF file exists on disk."""
+        return [name for name, path in self.models.items() if os.path.exists(path)]
+
+    def path(self, name: str) -> str:
+        """File path of a registered model."""
+        if name not in self.models:
+            raise KeyError(f"Unknown model '{name}'. Available: {', '.join(self.models)}")
+        return self.models[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._loaded
+
+    def estimate_memory_mb(self, name: str) -> float:
+        """Estimated resident memory of a model once loaded: weights and KV cache, or the measured figure."""
+        estimate = os.path.getsize(self.path(name)) / (1024 * 1024) * self.MEMORY_OVERHEAD + self.kv_cache_mb(name)
+        return max(estimate, self._measured_mb.get(name, 0.0))
+
+    def kv_cache_mb(self, name: str) -> float:
+        """Size of the model's f16 KV cache for ``context_tokens`` positions (0 if the GGUF can't be read)."""
+        if name not in self._kv_mb:
+            try:
+                # Only the header and vocabulary are read
+                metadata = Llama(model_path=self.path(name), n_ctx=64, vocab_only=True, verbose=False).metadata
+                arch = metadata.get("general.architecture", "llama")
+                n_layer = int(metadata.get(f"{arch}.block_count", 0))
+                n_embd = int(metadata.get(f"{arch}.embedding_length", 0))
+                n_head = int(metadata.get(f"{arch}.attention.head_count", 1)) or 1
+                n_head_kv = int(metadata.get(f"{arch}.attention.head_count_kv", n_head))
+                # K and V, two bytes per value, for every layer and position
+                kv_bytes = 2 * n_layer * self.context_tokens * (n_embd * n_head_kv // n_head) * 2
+                self._kv_mb[name] = kv_bytes / (1024 * 1024)
+            except Exception as e:
+                console.print(f"[yellow]Warning: Could not read the KV cache size of '{name}': {e}[/yellow]")
+                self._kv_mb[name] = 0.0
+        return self._kv_mb[name]
+
+    def resident_mb(self) -> float:
+        """Estimated memory held by the currently loaded models."""
+        return sum(self.estimate_memory_mb(name) for name in self._loaded)
+
+    def get(self, name: str):
+        """Return the loaded model, loading it (and evicting others) if needed."""
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+
+            path = self.path(name)
+            if not os.path.exists(path):
+                raise FileNotFoundError(Config.ERROR_MESSAGES['file_not_found'].format(path=path))
+            needed = self.estimate_memory_mb(name)
+            while self._loaded and self.resident_mb() + needed > self.memory_budget_mb:
+                lru_name = next(iter(self._loaded))
+                console.print(f"[dim]Evicting model '{lru_name}' to stay within {self.memory_budget_mb} MB[/dim]")
+                self.evict(lru_name)
+
+            process = psutil.Process()
+            rss_before = process.memory_info().rss
+            model = self.loader(path)
+            self._measured_mb[name] = (process.memory_info().rss - rss_before) / (1024 * 1024)
+            self._loaded[name] = model
+            return model
+
+    def evict(self, name: str):
+        """Unload a model and release its memory."""
+        with self._lock:
+            model = self._loaded.pop(name, None)
+            if model is None:
+                return
+            if hasattr(model, 'close'):
+                model.close()
+            del model
+            gc.collect()
+
+    def clear(self):
+        """Unload every resident model."""
+        with self._lock:
+            for name in list(self._loaded):
+                self.evict(name)
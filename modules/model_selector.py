@@ -3,21 +3,37 @@ from rich.console import Console
 from rich.prompt import Prompt
 from modules.gemini_client import GeminiClient
 from modules.brain import Brain
+from modules.model_client import ModelServerClient
+from modules.mock_backends import MockLLM
+from modules.response_cache import ResponseCache
+from modules.config import Config
 
 console = Console()
 
 class ModelSelector:
     """
-    Handles user selection and initialization of response generation backend (local or Gemini).
+    Handles user selection and initialization of response generation backend
+    (local model, shared local daemon or Gemini; a mock model with --mock).
     """
     def __init__(self):
         self.llm = None
         self.gemini_client = None
         self.gpu_manager = None
         self.backend = None
+        self.model_name = None
+        self.api_key = None
 
     def select_and_initialize(self):
-        choices = ["Local Model (on-device)", "Gemini API (cloud)"]
+        self.select()
+        return self.initialize()
+
+    def select(self):
+        """Ask for the backend (and local model or API key) without loading anything."""
+        if Config.MOCK_BACKENDS:
+            self.backend = "mock"
+            self.model_name = "mock"
+            return True
+        choices = ["Local Model (on-device)", "Gemini API (cloud)", "Local model daemon (shared, see --serve)"]
         console.print("[bold cyan]Select response generation backend:[/bold cyan]")
         for i, c in enumerate(choices, 1):
             console.print(f"  {i}. {c}")
@@ -26,25 +42,62 @@ class ModelSelector:
             idx = int(choice) - 1
         except Exception:
             idx = 0
-        self.backend = "local" if idx == 0 else "gemini"
+        self.backend = {1: "gemini", 2: "daemon"}.get(idx, "local")
+        if self.backend == "local":
+            self.model_name = self.select_local_model()
+        elif self.backend == "gemini":
+            self.api_key = os.environ.get("GEMINI_API_KEY")
+            if not self.api_key:
+                self.api_key = Prompt.ask("[bold cyan]Enter your Gemini API key[/bold cyan]", password=True)
+        return True
+
+    def initialize(self):
+        """Create the selected backend; for the local model this is the slow part."""
         if self.backend == "local":
-            self.llm = Brain()
+            self.llm = Brain(model_name=self.model_name)
             # Optionally, set gpu_manager if needed
             # from modules.gpu_manager import GPUManager
             # self.gpu_manager = GPUManager()
+        elif self.backend == "mock":
+            self.llm = MockLLM()
+        elif self.backend == "daemon":
+            self.llm = ModelServerClient(Config.SERVER_URL)
+            try:
+                self.model_name = self.llm.health().get("model")
+            except OSError as e:
+                raise RuntimeError(f"Model daemon not reachable at {Config.SERVER_URL}: {e}")
         else:
-            api_key = os.environ.get("GEMINI_API_KEY")
-            if not api_key:
-                api_key = Prompt.ask("[bold cyan]Enter your Gemini API key[/bold cyan]", password=True)
             model = "gemini-1.5-flash"
-            self.gemini_client = GeminiClient(api_key, model)
+            cache = ResponseCache() if Config.RESPONSE_CACHE_ENABLED else None
+            self.gemini_client = GeminiClient(self.api_key, model, response_cache=cache)
         return True
 
+    def select_local_model(self) -> str:
+        """Ask which registered GGUF model to start with."""
+        models = [name for name, path in Config.MODELS.items() if os.path.exists(path)]
+        if len(models) <= 1:
+            return models[0] if models else Config.DEFAULT_MODEL
+        default = models.index(Config.DEFAULT_MODEL) + 1 if Config.DEFAULT_MODEL in models else 1
+        console.print("[bold cyan]Select local model:[/bold cyan]")
+        for i, name in enumerate(models, 1):
+            console.print(f"  {i}. {name}")
+        choice = Prompt.ask(f"Choose model [1-{len(models)}] (default: {default})", default=str(default))
+        try:
+            index = int(choice)
+        except ValueError:
+            index = default
+        if not 1 <= index <= len(models):
+            index = default
+        return models[index - 1]
+
     def get_llm(self):
-        return self.llm if self.backend == "local" else self.gemini_client
+        return self.gemini_client if self.backend == "gemini" else self.llm
 
     def is_using_gemini(self):
         return self.backend == "gemini"
 
+    def is_using_daemon(self):
+        return self.backend == "daemon"
+
     def get_gpu_manager(self):
         return self.gpu_manager
@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import uuid
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional
+from rich.console import Console
+from modules.config import Config
+from modules.prompt_template import PromptTemplate
+from modules.scheduler import SAMPLER_OPTIONS, BatchScheduler
+
+console = Console()
+
+# Request fields passed through to the model call
+SAMPLING_FIELDS = ("max_tokens", "stop", "seed", "timeout", *SAMPLER_OPTIONS)
+# Request fields handled by the server itself
+REQUEST_FIELDS = ("model", "prompt", "messages", "stream", "user")
+
+def chat_messages_to_prompt(messages: List[Dict]) -> str:
+    """
+    Render OpenAI-style chat messages with the chatbot's own prompt template.
+
+    A leading system message replaces the default system prompt; without one
+    the prompt starts with the usual static prefix, so its cached KV state
+    is reused.
+    """
+    messages = list(messages)
+    system_prompt = PromptTemplate.get_system_prompt()
+    if messages and messages[0].get("role") == "system":
+        system_prompt = messages.pop(0).get("content", "")
+    user_input = ""
+    if messages and messages[-1].get("role") == "user":
+        user_input = messages.pop().get("content", "")
+    history = [msg for msg in messages if msg.get("role") in ("user", "assistant")]
+    return PromptTemplate.get_chat_prompt(system_prompt, history, user_input)
+
+class _ModelRequestHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible endpoints in front of the resident Brain."""
+
+    server_version = "RenaModelServer/1.0"
+
+    def address_string(self):
+        # Unix socket peers have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        if Config.SERVER_LOG_REQUESTS:
+            console.print(f"[dim]{self.address_string()} {format % args}[/dim]")
+
+    def _send_json(self, payload: Dict, status: int = 200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, message: str):
+        self._send_json({"error": {"message": message, "type": "invalid_request_error"}}, status)
+
+    def _send_events(self, events: Iterator[Dict]):
+        """Send server-sent events, one JSON object per ``data:`` line."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        try:
+            for event in events:
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away; closing the generator stops the decode
+            if hasattr(events, "close"):
+                events.close()
+        self.close_connection = True
+
+    def _read_json(self) -> Optional[Dict]:
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, "Request body is not valid JSON")
+            return None
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json({"status": "ok", "model": self.server.model_server.model_id})
+        elif self.path == "/scheduler/stats":
+            self._send_json(self.server.model_server.scheduler.stats())
+        elif self.path == "/v1/models":
+            self._send_json({"object": "list", "data": [
+                {"id": self.server.model_server.model_id, "object": "model", "owned_by": "local"}
+            ]})
+        else:
+            self._send_error(404, f"Unknown endpoint {self.path}")
+
+    def do_POST(self):
+        body = self._read_json()
+        if body is None:
+            return
+        model_server = self.server.model_server
+        try:
+            if self.path == "/v1/completions":
+                prompt = body.get("prompt", "")
+                if isinstance(prompt, list):
+                    prompt = prompt[0] if prompt else ""
+                self._respond(model_server.complete(prompt, body), body.get("stream", False))
+            elif self.path == "/v1/chat/completions":
+                self._respond(model_server.chat_complete(body.get("messages", []), body), body.get("stream", False))
+            elif self.path == "/extras/tokenize":
+                self._send_json({"tokens": model_server.tokenize(body.get("input", ""))})
+            else:
+                self._send_error(404, f"Unknown endpoint {self.path}")
+        except ValueError as e:
+            self._send_error(400, str(e))
+        except Exception as e:
+            console.print(f"[red]Model server error: {e}[/red]")
+            self._send_error(500, str(e))
+
+    def _respond(self, result, stream: bool):
+        if stream:
+            self._send_events(result)
+        else:
+            self._send_json(result)
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class ModelServer:
+    """
+    Keeps a Brain resident and serves it over an OpenAI-compatible HTTP API.
+
+    ``/v1/completions`` and ``/v1/chat/completions`` support both plain and
+    streaming (server-sent events) responses. The server listens on
+    localhost TCP or, if ``socket_path`` is given, on a Unix socket, so
+    several frontends on the same machine can share one loaded model.
+    Concurrent requests go through a BatchScheduler; an optional ``timeout``
+    field (seconds) sets the request's deadline.
+    """
+
+    def __init__(self, brain, host: str = Config.SERVER_HOST, port: int = Config.SERVER_PORT,
+                 socket_path: Optional[str] = None):
+        self.brain = brain
+        self.model_id = getattr(brain, "model_name", "local")
+        self.host = host
+        self.port = port
+        self.socket_path = socket_path
+        if getattr(brain, "draft_stats", None) is not None:
+            console.print("[yellow]Warning: Speculative decoding does not apply to batched requests; "
+                          "the daemon decodes without it[/yellow]")
+        # Takes over the Brain's model and context; every slot starts with the static prefix evaluated
+        self.scheduler = BatchScheduler(brain.release_model(), slot_context=brain.context_size,
+                                        prefix_tokens=getattr(brain, "prefix_tokens", ()))
+        self.response_cache = getattr(brain, "response_cache", None)
+        self.httpd = None
+
+    def _sampling_params(self, body: Dict) -> Dict:
+        """The call arguments of a request; fields the daemon cannot honour are a 400, not ignored."""
+        unsupported = sorted(key for key, value in body.items()
+                             if key not in SAMPLING_FIELDS and key not in REQUEST_FIELDS and value is not None)
+        if unsupported:
+            raise ValueError(f"Unsupported field(s): {', '.join(unsupported)}")
+        return {key: body[key] for key in SAMPLING_FIELDS if body.get(key) is not None}
+
+    def _generate(self, prompt: str, stream: bool = False, **params):
+        """Run a completion through the Brain's response cache (if enabled) and the scheduler."""
+        if self.response_cache is None:
+            return self.scheduler(prompt, stream=stream, **params)
+        return self.response_cache.cached_call(self.scheduler, self.brain.model_path, prompt, stream=stream, **params)
+
+    def complete(self, prompt: str, body: Dict):
+        """Handle a /v1/completions request; returns a dict or a chunk iterator."""
+        params = self._sampling_params(body)
+        return self._generate(prompt, stream=bool(body.get("stream")), **params)
+
+    def chat_complete(self, messages: List[Dict], body: Dict):
+        """Handle a /v1/chat/completions request by mapping it onto a completion."""
+        prompt = chat_messages_to_prompt(messages)
+        params = self._sampling_params(body)
+        params.setdefault("stop", ["User:", "\n\n"])
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        if body.get("stream"):
+            def chunks():
+                for chunk in self._generate(prompt, stream=True, **params):
+                    choice = chunk["choices"][0]
+                    yield {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": self.model_id,
+                        "choices": [{
+                            "index": 0,
+                            "delta": {"content": choice.get("text", "")},
+                            "finish_reason": choice.get("finish_reason"),
+                        }],
+                    }
+            return chunks()
+
+        result = self._generate(prompt, **params)
+        choice = result["choices"][0]
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": self.model_id,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": choice["text"].strip()},
+                "finish_reason": choice.get("finish_reason"),
+            }],
+            "usage": result.get("usage", {}),
+        }
+
+    def tokenize(self, text):
+        """Token ids of a text, or a list of them for a list of texts."""
+        if isinstance(text, list):
+            return [self.tokenize(item) for item in text]
+        return self.scheduler.llm.tokenize(str(text).encode("utf-8"), add_bos=False)
+
+    def serve_forever(self):
+        """Bind the socket and serve until interrupted."""
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.httpd = _UnixHTTPServer(self.socket_path, _ModelRequestHandler)
+            where = f"unix:{self.socket_path}"
+        else:
+            self.httpd = ThreadingHTTPServer((self.host, self.port), _ModelRequestHandler)
+            where = f"http://{self.host}:{self.port}"
+        self.httpd.model_server = self
+        console.print(f"[green]Serving {self.model_id} on {where}[/green]")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            self.scheduler.close()
+            if self.response_cache is not None:
+                self.response_cache.save()
+            if self.socket_path and os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
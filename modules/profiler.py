@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import contextlib
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from rich.console import Console
+from modules.config import Config
+
+console = Console()
+
+class Tracer:
+    """
+    Collects spans in the Chrome trace-event format (open in Perfetto or chrome://tracing).
+
+    ``span`` times a block on the calling thread, so generation, synthesis
+    and playback show up on their own thread tracks. Until ``start`` is
+    called the tracer is disabled and ``span`` costs one attribute check;
+    instrumented code can therefore use the shared ``tracer`` unconditionally.
+    """
+
+    def __init__(self, max_events: int = Config.PROFILE_MAX_EVENTS):
+        self.max_events = max_events
+        self.enabled = False
+        self.dropped = 0
+        self._events: List[Dict] = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+
+    def start(self):
+        with self._lock:
+            self._events = []
+            self._threads = {}
+            self.dropped = 0
+            self._origin = time.perf_counter()
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def now(self) -> float:
+        """Microseconds since ``start``, the trace's time base."""
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def span(self, name: str, category: str = "stage", **args):
+        """Context manager timing a block; yields its ``args`` dict, which may be filled in meanwhile."""
+        if not self.enabled:
+            return contextlib.nullcontext(args)
+        return self._span(name, category, args)
+
+    @contextlib.contextmanager
+    def _span(self, name: str, category: str, args: Dict):
+        start = self.now()
+        try:
+            yield args
+        finally:
+            self.complete(name, start, self.now(), category, **args)
+
+    def complete(self, name: str, start: float, end: float, category: str = "stage",
+                 thread_id: Optional[int] = None, **args):
+        """Add a span that has already ended (times from ``now``); ``thread_id`` defaults to the caller's."""
+        self._add({"name": name, "cat": category, "ph": "X", "ts": start, "dur": max(0.0, end - start),
+                   "args": args}, thread_id)
+
+    def instant(self, name: str, category: str = "stage", **args):
+        """Mark a point in time on the calling thread (e.g. the first token)."""
+        if self.enabled:
+            self._add({"name": name, "cat": category, "ph": "i", "s": "t", "ts": self.now(), "args": args})
+
+    def _add(self, event: Dict, thread_id: Optional[int] = None):
+        if thread_id is None:
+            thread_id = threading.get_ident()
+        event["pid"] = self._pid
+        event["tid"] = thread_id
+        with self._lock:
+            if len(self._events) >= self.max_events:
+                self.dropped += 1
+                return
+            if thread_id not in self._threads:
+                self._threads[thread_id] = _thread_name(thread_id)
+            self._events.append(event)
+
+    def name_thread(self, thread_id: int):
+        """Look up a thread's name now, while it is alive, for events added after it ends."""
+        with self._lock:
+            if thread_id not in self._threads:
+                self._threads[thread_id] = _thread_name(thread_id)
+
+    def save(self, path: str):
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+        metadata = [{"name": "process_name", "ph": "M", "pid": self._pid, "tid": 0, "args": {"name": "Rena"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+                     for tid, name in threads.items()]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms"}, f)
+
+def _thread_name(thread_id: int) -> str:
+    for thread in threading.enumerate():
+        if thread.ident == thread_id:
+            return thread.name
+    return str(thread_id)
+
+# Shared by all instrumented modules; enabled by --profile
+tracer = Tracer()
+
+class StackSampler:
+    """
+    Sampling profiler for all threads.
+
+    Every ``interval`` seconds a daemon thread takes the stacks of the other
+    threads (``sys._current_frames``). A frame that stays on a thread's stack
+    over consecutive samples becomes one span (category "sample") nested
+    under its caller, so the trace shows a flame chart per thread next to
+    the stage spans. Resolution is the interval; shorter calls are missed.
+    """
+
+    MAX_DEPTH = 48
+
+    def __init__(self, tracer: Tracer, interval: float = Config.PROFILE_SAMPLE_INTERVAL):
+        self.tracer = tracer
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._open: Dict[int, List[Tuple[str, float]]] = {}  # thread -> frames (root first) with start times
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        now = self.tracer.now()
+        for thread_id in list(self._open):
+            self._close(thread_id, 0, now)
+        self._open = {}
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            now = self.tracer.now()
+            frames = sys._current_frames()
+            for thread_id, frame in frames.items():
+                if thread_id != own:
+                    self._sample(thread_id, self._stack(frame), now)
+            for thread_id in [t for t in self._open if t not in frames]:
+                self._close(thread_id, 0, now)  # The thread has ended
+                del self._open[thread_id]
+
+    def _stack(self, frame) -> List[str]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        stack.reverse()
+        return stack[:self.MAX_DEPTH]
+
+    def _sample(self, thread_id: int, stack: List[str], now: float):
+        if thread_id not in self._open:
+            self.tracer.name_thread(thread_id)
+        current = self._open.setdefault(thread_id, [])
+        common = 0
+        while common < min(len(current), len(stack)) and current[common][0] == stack[common]:
+            common += 1
+        self._close(thread_id, common, now)
+        current.extend((name, now) for name in stack[common:])
+
+    def _close(self, thread_id: int, depth: int, now: float):
+        """End the thread's open frames from ``depth`` on (innermost first)."""
+        current = self._open.get(thread_id, [])
+        while len(current) > depth:
+            name, start = current.pop()
+            self.tracer.complete(name, start, now, "sample", thread_id=thread_id)
+
+class Profiler:
+    """
+    Profiling session of the chatbot (python main.py --profile [MODE]).
+
+    Starts the shared ``tracer``, so the instrumented pipeline stages are
+    recorded as spans, and wraps every turn (``turn``) in a span and, by
+    ``mode``, a profiler: ``"spans"`` only records the stages, ``"cprofile"``
+    runs cProfile around each turn (it only sees the event loop thread; the
+    worker threads appear as their stage spans) and ``"sample"`` runs the
+    StackSampler over all threads. ``save`` writes the Chrome trace and,
+    with cProfile, the accumulated stats (``python -m pstats``) to
+    ``directory``.
+    """
+
+    MODES = ("spans", "cprofile", "sample")
+
+    def __init__(self, mode: str = Config.PROFILE_MODE, directory: str = Config.PROFILE_DIR):
+        if mode not in self.MODES:
+            console.print(f"[yellow]Warning: Unknown profile mode '{mode}', recording spans only[/yellow]")
+            mode = "spans"
+        self.mode = mode
+        self.directory = directory
+        self.turns = 0
+        self.started = datetime.now()
+        self.cprofile = cProfile.Profile() if mode == "cprofile" else None
+        self.sampler = StackSampler(tracer) if mode == "sample" else None
+        tracer.start()
+
+    @contextlib.contextmanager
+    def turn(self, **args):
+        """Profile one conversation turn."""
+        self.turns += 1
+        if self.sampler is not None:
+            self.sampler.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        try:
+            with tracer.span(f"turn {self.turns}", "turn", **args) as span_args:
+                yield span_args
+        finally:
+            if self.cprofile is not None:
+                self.cprofile.disable()
+            if self.sampler is not None:
+                self.sampler.stop()
+
+    def save(self) -> Optional[str]:
+        """Write the trace (and cProfile stats); returns the trace path."""
+        if self.sampler is not None:
+            self.sampler.stop()
+        tracer.stop()
+        stem = os.path.join(self.directory, f"trace-{self.started:%Y%m%d-%H%M%S}")
+        try:
+            tracer.save(stem + ".json")
+            if self.cprofile is not None and self.turns:
+                pstats.Stats(self.cprofile).dump_stats(stem + ".prof")
+        except OSError as e:
+            console.print(f"[yellow]Warning: Could not save profile: {e}[/yellow]")
+            return None
+        if tracer.dropped:
+            console.print(f"[yellow]Warning: Trace is incomplete, {tracer.dropped} events over "
+                          f"Config.PROFILE_MAX_EVENTS were dropped[/yellow]")
+        message = f"[dim]Trace of {self.turns} turns saved to {stem}.json (open in https://ui.perfetto.dev)"
+        if self.cprofile is not None and self.turns:
+            message += f"; cProfile stats in {stem}.prof"
+        console.print(message + "[/dim]")
+        return stem + ".json"
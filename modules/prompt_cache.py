@@ -0,0 +1,115 @@
+import os
+import json
+import hashlib
+from typing import Optional
+import numpy as np
+from llama_cpp import LlamaState
+from rich.console import Console
+from modules.config import Config
+
+console = Console()
+
+def model_fingerprint(model_path: str, sample_size: int = 4 * 1024 * 1024) -> str:
+    """
+    Cheap content hash of a model file.
+
+    Hashing a multi-GB GGUF on every start would cost more than the prefill it
+    saves, so only the file size and its first and last few MB are hashed.
+    """
+    digest = hashlib.sha256()
+    size = os.path.getsize(model_path)
+    digest.update(str(size).encode())
+    with open(model_path, "rb") as f:
+        digest.update(f.read(sample_size))
+        if size > sample_size:
+            f.seek(max(sample_size, size - sample_size))
+            digest.update(f.read(sample_size))
+    return digest.hexdigest()[:16]
+
+class PrefixStateCache:
+    """
+    Stores llama state snapshots of the static prompt prefix on disk.
+
+    Snapshots are keyed by the model fingerprint, the context size and a hash
+    of the prefix text, so a changed prompt or model never restores a stale
+    KV cache.
+
+    A file holds the raw LlamaState fields, not a pickle: a magic line, a JSON
+    header (format version, key, array shapes and sizes) and the input ids,
+    scores and llama state bytes. Files whose header does not match are
+    ignored, and loading never executes anything from the cache directory.
+    """
+
+    MAGIC = b"RENA-PREFIX-STATE\n"
+    VERSION = 1
+
+    def __init__(self, cache_dir: str = Config.PROMPT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model_path: str, prefix_text: str, n_ctx: int) -> str:
+        """Build the snapshot key for a model / prompt / context combination."""
+        prompt_hash = hashlib.sha256(prefix_text.encode("utf-8")).hexdigest()[:16]
+        return f"{model_fingerprint(model_path)}-{prompt_hash}-{n_ctx}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.state")
+
+    def load(self, key: str):
+        """Return the stored llama state for ``key``, or None."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                if f.readline() != self.MAGIC:
+                    raise ValueError("not a prefix state file")
+                header = json.loads(f.readline())
+                if header.get("version") != self.VERSION or header.get("key") != key:
+                    raise ValueError(f"unexpected header {header}")
+                input_ids = self._read_array(f, np.intc, header["input_ids_shape"])
+                scores = self._read_array(f, np.single, header["scores_shape"])
+                llama_state = f.read(header["llama_state_size"])
+                if len(llama_state) != header["llama_state_size"] or f.read(1):
+                    raise ValueError("truncated or oversized file")
+            return LlamaState(input_ids=input_ids, scores=scores, n_tokens=header["n_tokens"],
+                              llama_state=llama_state, llama_state_size=len(llama_state), seed=header["seed"])
+        except Exception as e:
+            console.print(f"[yellow]Warning: Could not load prompt cache {path}: {e}[/yellow]")
+            return None
+
+    @staticmethod
+    def _read_array(f, dtype, shape) -> np.ndarray:
+        count = int(np.prod(shape))
+        data = f.read(count * np.dtype(dtype).itemsize)
+        if len(data) != count * np.dtype(dtype).itemsize:
+            raise ValueError("truncated file")
+        return np.frombuffer(data, dtype=dtype).reshape(shape).copy()
+
+    def save(self, key: str, state) -> None:
+        """Persist a llama state snapshot under ``key``."""
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            input_ids = np.ascontiguousarray(state.input_ids, dtype=np.intc)
+            scores = np.ascontiguousarray(state.scores, dtype=np.single)
+            llama_state = bytes(state.llama_state[:state.llama_state_size])
+            header = {
+                "version": self.VERSION,
+                "key": key,
+                "n_tokens": int(state.n_tokens),
+                "seed": int(state.seed),
+                "input_ids_shape": list(input_ids.shape),
+                "scores_shape": list(scores.shape),
+                "llama_state_size": len(llama_state),
+            }
+            with open(tmp_path, "wb") as f:
+                f.write(self.MAGIC)
+                f.write(json.dumps(header).encode("utf-8") + b"\n")
+                f.write(input_ids.tobytes())
+                f.write(scores.tobytes())
+                f.write(llama_state)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            console.print(f"[yellow]Warning: Could not save prompt cache {path}: {e}[/yellow]")
@@ -1,11 +1,52 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
 from modules.config import Config
+from modules.history_window import format_history_message
+
+@dataclass(frozen=True)
+class PromptSegment:
+    """A piece of a prompt together with its token ids."""
+    text: str
+    tokens: Tuple[int, ...]
 
 class PromptTemplate:
-    """Template manager for chatbot prompts."""
+    """
+    Template manager for chatbot prompts.
+
+    Prompts are assembled from segments (static prefix, summary, one per
+    history message, recalled messages, user information, input). Created
+    with a ``tokenize`` function, the template also tokenizes them:
+    ``chat_segments`` returns each segment with its token ids, memoized by
+    content, so the static prefix and every history message are tokenized
+    once however many turns they appear in. Only the segments that are new
+    in a turn (typically the last reply and the input) reach the tokenizer.
+    """
+
+    PERSONALITY_TRAITS = """
+Personality: You are warm, curious, and enthusiastic. You enjoy conversation and making personal connections.
+You have these qualities:
+- Friendly and approachable, like talking to a good friend
+- Curious about the user's thoughts and experiences
+- Enthusiastic about helping and sharing knowledge
+- Occasionally uses humor and light-heartedness
+- Shows empathy and understanding when appropriate
+- Conversational rather than formal or academic
+"""
     
+    def __init__(self, tokenize: Optional[Callable[[bytes, bool, bool], List[int]]] = None,
+                 cache_size: int = Config.PROMPT_SEGMENT_CACHE_SIZE):
+        """``tokenize(text, add_bos, special)`` is the model tokenizer, e.g. ``Llama.tokenize``."""
+        self.tokenize = tokenize
+        self._segment_tokens = lru_cache(maxsize=cache_size)(self._tokenize_segment)
+
     @staticmethod
     def get_system_prompt():
-        memory_cap = Config.MAX_HISTORY
+        return PromptTemplate._system_prompt(Config.MAX_HISTORY)
+
+    @staticmethod
+    @lru_cache(maxsize=4)
+    def _system_prompt(memory_cap: int) -> str:
         return f"""
 Your name is Rena. You are a friendly, chatty, and personable AI assistant with a warm personality. 
 You engage users in a casual, conversational manner and show enthusiasm in your responses.
@@ -27,26 +68,43 @@ Always be helpful and informative, but in a friendly, chatty way rather than for
 If you don't know something, be honest but stay conversational."""
 
     @staticmethod
-    def get_chat_prompt(system_prompt: str, conversation_history: list, user_input: str, user_info: str = "") -> str:
-        """Construct the full chat prompt from components."""
-        # Format conversation history
-        history_text = ""
-        for msg in conversation_history[-5:]:  # Keep last 5 messages for context
-            role = "Assistant" if msg["role"] == "assistant" else "User"
-            history_text += f"{role}: {msg['content']}\n"
-        
-        # Add personality traits
-        personality_traits = """
-Personality: You are warm, curious, and enthusiastic. You enjoy conversation and making personal connections.
-You have these qualities:
-- Friendly and approachable, like talking to a good friend
-- Curious about the user's thoughts and experiences
-- Enthusiastic about helping and sharing knowledge
-- Occasionally uses humor and light-heartedness
-- Shows empathy and understanding when appropriate
-- Conversational rather than formal or academic
+    def get_static_prefix(system_prompt: str, include_personality: bool = True) -> str:
+        """The part of every chat prompt that does not change between turns."""
+        personality_traits = PromptTemplate.PERSONALITY_TRAITS if include_personality else ""
+        return f"""System: {system_prompt}
+
+{personality_traits}
 """
 
+    @staticmethod
+    def get_chat_prompt(system_prompt: str, conversation_history: list, user_input: str, user_info: str = "",
+                        include_personality: bool = True, recalled: list = (), summary: str = "") -> str:
+        """Construct the full chat prompt from components (see ``get_chat_segments``)."""
+        return "".join(PromptTemplate.get_chat_segments(system_prompt, conversation_history, user_input,
+                                                        user_info, include_personality, recalled, summary))
+
+    @staticmethod
+    def get_chat_segments(system_prompt: str, conversation_history: list, user_input: str, user_info: str = "",
+                          include_personality: bool = True, recalled: list = (), summary: str = "") -> List[str]:
+        """
+        The chat prompt as a list of segments.
+
+        The history is used as given (see HistoryWindow), preceded by the
+        rolling summary of older messages, which only changes when the window
+        moves on. Everything that can change from one turn to the next -
+        messages recalled from long-term memory, the per-input user
+        information and the input itself - comes after the history, so
+        consecutive prompts share the longest possible prefix.
+        """
+        # Format conversation history, one segment per message
+        history_segments = [format_history_message(msg) for msg in conversation_history]
+        
+        # Earlier messages recalled for this input
+        recalled_segments = []
+        if recalled:
+            recalled_segments = ["\nRelevant Earlier Conversation:\n"]
+            recalled_segments += [format_history_message(msg) for msg in recalled]
+
         # Add user information if available
         user_context = ""
         if user_info:
@@ -57,18 +115,58 @@ User Information:
 Use this information only when relevant to the conversation. Don't mention that you have this information directly.
 """
         
-        # Construct the full prompt
-        prompt = f"""System: {system_prompt}
+        # Summary of the messages before the history window
+        summary_context = ""
+        if summary:
+            summary_context = f"""Summary of Earlier Conversation:
+{summary}
 
-{personality_traits}
-{user_context}
-Conversation History:
-{history_text}
+"""
 
+        # Construct the full prompt (static prefix first so its KV state can be reused)
+        segments = [PromptTemplate.get_static_prefix(system_prompt, include_personality), summary_context,
+                    "Conversation History:\n", *history_segments, *recalled_segments,
+                    "\n" + user_context, f"""
 User: {user_input}
 
-A:"""
-        return prompt
+A:"""]
+        return [segment for segment in segments if segment]
+
+    def chat_segments(self, *args, **kwargs) -> List[PromptSegment]:
+        """``get_chat_segments`` with the token ids of every segment (requires ``tokenize``)."""
+        return self.segments(self.get_chat_segments(*args, **kwargs))
+
+    def segments(self, texts: List[str]) -> List[PromptSegment]:
+        """Tokenized segments of a prompt given as the list of its segment texts."""
+        return [self.segment(text, first=i == 0) for i, text in enumerate(texts)]
+
+    def segment(self, text: str, first: bool = False) -> PromptSegment:
+        """One tokenized segment; ``first`` if it starts the prompt (and so gets the BOS token)."""
+        return PromptSegment(text, self._segment_tokens(text, first))
+
+    @staticmethod
+    def join_tokens(segments: List[PromptSegment]) -> List[int]:
+        """Token ids of a whole prompt."""
+        return [token for segment in segments for token in segment.tokens]
+
+    def _tokenize_segment(self, text: str, first: bool) -> Tuple[int, ...]:
+        """
+        Tokenize one segment as it continues the prompt.
+
+        The first segment gets the BOS token. Any other is tokenized after a
+        separator that is then removed again, so the tokenizer does not treat
+        it as the start of a text (SentencePiece would insert a space). Token
+        ids can therefore differ from tokenizing the joined prompt at segment
+        boundaries; the text is identical.
+        """
+        if first:
+            return tuple(self.tokenize(text.encode("utf-8"), True, True))
+        for separator in ("\n", "a"):
+            base = self.tokenize(separator.encode("utf-8"), False, True)
+            tokens = self.tokenize((separator + text).encode("utf-8"), False, True)
+            if tokens[:len(base)] == base:
+                return tuple(tokens[len(base):])
+        return tuple(self.tokenize(text.encode("utf-8"), False, True))
 
     @staticmethod
     def get_error_prompt(error_type: str, details: str) -> str:
@@ -1,6 +1,6 @@
 import psutil
 import time
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from rich.console import Console
 import os
 from modules.config import Config
@@ -15,6 +15,9 @@ class ResourceManager:
         self.memory_threshold = Config.MEMORY_THRESHOLD
         self._last_check_time = 0
         self._check_interval = 1.0  # seconds between checks
+        self._process = psutil.Process()
+        # (time, system CPU seconds busy, own CPU seconds) at the last available_cores call
+        self._cpu_sample = self._take_cpu_sample()
         
     def get_system_stats(self) -> Dict[str, float]:
         """Get current system resource usage statistics."""
@@ -82,18 +85,61 @@ class ResourceManager:
         if new_memory_limit is not None:
             self.memory_threshold = new_memory_limit 
     
-    def get_target_cores(self) -> int:
+    def _take_cpu_sample(self) -> Tuple[float, float, float]:
+        system = psutil.cpu_times()
+        # Guest time is already counted in user time on Linux
+        idle = (system.idle + getattr(system, 'iowait', 0.0)
+                + getattr(system, 'guest', 0.0) + getattr(system, 'guest_nice', 0.0))
+        own = self._process.cpu_times()
+        return time.monotonic(), sum(system) - idle, own.user + own.system
+
+    def available_cores(self) -> int:
+        """
+        Cores not kept busy by other processes, judged from the load since the last call.
+
+        System-wide and own CPU time are read together, so both deltas cover
+        the same interval and their difference is the other processes' load.
+        """
+        cpu_count = os.cpu_count() or 1
+        now, system_busy, own_busy = self._take_cpu_sample()
+        then, system_before, own_before = self._cpu_sample
+        self._cpu_sample = (now, system_busy, own_busy)
+        elapsed = now - then
+        if elapsed <= 0:
+            return cpu_count
+        others = max(0.0, (system_busy - system_before) - (own_busy - own_before)) / elapsed
+        return max(1, cpu_count - int(round(others)))
+
+    def llama_threads(self, n_threads: int, n_threads_batch: int) -> Tuple[int, int]:
+        """
+        Decode and prefill thread counts for the current load.
+
+        Threads beyond the free cores only wait on each other, which hurts
+        decode (bandwidth-bound, one token per step) the most.
+        """
+        available = self.available_cores()
+        return max(1, min(n_threads, available)), max(1, min(n_threads_batch, available))
+
+    def get_target_cores(self, n_threads: Optional[int] = None) -> int:
         """Get the number of CPU cores being used by the model."""
-        _, target_cores, _ = self.optimize_cpu_usage()
+        _, target_cores, _ = self.optimize_cpu_usage(n_threads)
         return target_cores
 
-    def optimize_cpu_usage(self):
+    def optimize_cpu_usage(self, n_threads: Optional[int] = None):
+        """
+        Pin the process to the cores the model will use.
+
+        When the model's thread count is known (e.g. calibrated by AutoTuner),
+        that many cores are used; otherwise the count is guessed from the load.
+        """
         process = psutil.Process()
         stats = self.get_system_stats()
 
         if stats['cpu_count'] > 1:
             current_load = psutil.getloadavg()[0] / stats['cpu_count']
-            if current_load < 0.8:
+            if n_threads:
+                target_cores = max(1, min(n_threads, stats['cpu_count']))
+            elif current_load < 0.8:
                 target_cores = max(1, min(int(stats['cpu_count']*0.75), 4))
             else:
                 target_cores = max(1, min(int(stats['cpu_count']*0.5), 2))
@@ -0,0 +1,157 @@
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+from rich.console import Console
+from modules.config import Config
+
+console = Console()
+
+# Finish reasons of complete answers (llama-cpp and Gemini spellings); errors and blocks are not cached
+CACHEABLE_FINISH_REASONS = {"stop", "length", "STOP", "MAX_TOKENS"}
+
+# Call arguments that do not change the generated text
+IGNORED_PARAMS = {"stream", "echo", "timeout"}
+
+def normalize_prompt(prompt: str) -> str:
+    """Case- and whitespace-insensitive form of a prompt."""
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+class ResponseCache:
+    """
+    Memoizes completions keyed by normalized prompt, model and sampling parameters.
+
+    Entries are kept in LRU order, bounded by ``max_entries`` and expired
+    after ``ttl`` seconds. For sampled (temperature > 0) calls up to
+    ``variants`` different answers are collected per key before hits start
+    being served, picked at random, so cached replies keep some variety.
+    The cache is persisted to a JSON file.
+    """
+
+    def __init__(self, cache_file: str = Config.RESPONSE_CACHE_FILE,
+                 max_entries: int = Config.RESPONSE_CACHE_MAX_ENTRIES,
+                 ttl: float = Config.RESPONSE_CACHE_TTL,
+                 variants: int = Config.RESPONSE_CACHE_VARIANTS):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.variants = max(1, variants)
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    @staticmethod
+    def make_key(prompt: str, model: str, params: Dict) -> str:
+        """Cache key for a call; parameters that don't affect the output are ignored."""
+        relevant = {k: v for k, v in params.items() if k not in IGNORED_PARAMS and v is not None}
+        # Token-id prompts (see PromptTemplate.chat_segments) are keyed as they are
+        prompt_key = normalize_prompt(prompt) if isinstance(prompt, str) else list(prompt)
+        material = json.dumps([prompt_key, model, relevant], sort_keys=True, default=str)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _wanted_variants(self, params: Dict) -> int:
+        return 1 if not params.get("temperature") else self.variants
+
+    def get(self, prompt: str, model: str, params: Dict) -> Optional[Dict]:
+        """Return a cached completion, or None on a miss."""
+        key = self.make_key(prompt, model, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.time() - entry["created"] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None or len(entry["responses"]) < self._wanted_variants(params):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return random.choice(entry["responses"])
+
+    def put(self, prompt: str, model: str, params: Dict, response: Dict):
+        """Store a completion if it finished normally."""
+        choices = response.get("choices") or [{}]
+        if choices[0].get("finish_reason") not in CACHEABLE_FINISH_REASONS:
+            return
+        key = self.make_key(prompt, model, params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {"created": time.time(), "responses": []}
+            if len(entry["responses"]) < self._wanted_variants(params):
+                entry["responses"].append(response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def cached_call(self, llm, model: str, prompt: str, stream: bool = False, **params):
+        """
+        Call ``llm`` (llama-style signature) through the cache.
+
+        Streaming hits are replayed as a single chunk; streaming misses are
+        passed through and stored once the stream completes.
+        """
+        cached = self.get(prompt, model, params)
+        if cached is not None:
+            return iter([cached]) if stream else cached
+        if stream:
+            return self._record_stream(llm(prompt, stream=True, **params), prompt, model, params)
+        response = llm(prompt, **params)
+        self.put(prompt, model, params, response)
+        return response
+
+    def _record_stream(self, chunks: Iterator[Dict], prompt: str, model: str, params: Dict) -> Iterator[Dict]:
+        pieces: List[str] = []
+        finish_reason = None
+        for chunk in chunks:
+            choice = chunk["choices"][0]
+            pieces.append(choice.get("text", ""))
+            finish_reason = choice.get("finish_reason") or finish_reason
+            yield chunk
+        self.put(prompt, model, params,
+                 {"choices": [{"text": "".join(pieces), "index": 0, "finish_reason": finish_reason}]})
+
+    def stats(self) -> Dict:
+        """Hit/miss counters and current size."""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        self.save()
+
+    def _load(self):
+        try:
+            with open(self.cache_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, entry in data.items():
+            if not self.ttl or now - entry["created"] <= self.ttl:
+                self._entries[key] = entry
+
+    def save(self):
+        """Write the cache to disk (atomically)."""
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with self._lock:
+                data = dict(self._entries)
+            tmp_path = f"{self.cache_file}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            console.print(f"[yellow]Warning: Could not save response cache: {e}[/yellow]")
@@ -0,0 +1,444 @@
+import time
+import uuid
+import heapq
+import codecs
+import itertools
+import threading
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Sequence
+import llama_cpp
+from llama_cpp import Llama, _internals as llama_internals
+from rich.console import Console
+from modules.config import Config
+from modules.cancellation import CancellationToken
+
+console = Console()
+
+# Request options and the llama sampler arguments they map to, with Llama.create_completion's defaults
+SAMPLER_OPTIONS = {
+    "temperature": ("temp", 0.8),
+    "top_p": ("top_p", 0.95),
+    "top_k": ("top_k", 40),
+    "min_p": ("min_p", 0.05),
+    "typical_p": ("typical_p", 1.0),
+    "repeat_penalty": ("repeat_penalty", 1.0),
+    "frequency_penalty": ("frequency_penalty", 0.0),
+    "presence_penalty": ("presence_penalty", 0.0),
+    "mirostat_mode": ("mirostat_mode", 0),
+    "mirostat_tau": ("mirostat_tau", 5.0),
+    "mirostat_eta": ("mirostat_eta", 0.1),
+}
+
+def sampler_settings(options: Dict) -> Dict:
+    """Arguments of ``Llama._init_sampler`` for request ``options``; unknown options raise ValueError."""
+    unsupported = sorted(key for key, value in options.items() if key not in SAMPLER_OPTIONS and value is not None)
+    if unsupported:
+        raise ValueError(f"Unsupported sampling option(s): {', '.join(unsupported)}")
+    return {name: options[key] if options.get(key) is not None else default
+            for key, (name, default) in SAMPLER_OPTIONS.items()}
+
+class GenerationRequest:
+    """
+    A queued completion. Iterate over it to receive text pieces as the
+    scheduler decodes them; iteration ends when the request finishes.
+    """
+
+    def __init__(self, prompt_tokens: List[int], max_tokens: int, stop: List[str], sampling: Dict,
+                 deadline: Optional[float], seed: Optional[int]):
+        self.id = f"cmpl-{uuid.uuid4()}"
+        self.prompt_tokens = prompt_tokens
+        self.max_tokens = max_tokens
+        self.stop = [s for s in stop if s]
+        self.sampling = sampling  # see sampler_settings
+        self.deadline = deadline
+        self.seed = seed
+        self.sampler = None  # llama sampler chain, created when the request gets a slot
+
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.finish_reason: Optional[str] = None
+        self.generated: List[int] = []
+        self.text = ""
+        self.cancelled = False
+
+        self._emitted = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self._pieces: deque = deque()
+        self._ready = threading.Condition()
+
+    @property
+    def done(self) -> bool:
+        return self.finish_reason is not None
+
+    def cancel(self):
+        """Stop generating; the slot is freed on the scheduler's next step."""
+        self.cancelled = True
+
+    def _push(self, piece: Optional[str]):
+        with self._ready:
+            self._pieces.append(piece)
+            self._ready.notify()
+
+    def __iter__(self) -> Iterator[str]:
+        while True:
+            with self._ready:
+                while not self._pieces:
+                    self._ready.wait()
+                piece = self._pieces.popleft()
+            if piece is None:
+                return
+            yield piece
+
+class _Slot:
+    """One sequence of the shared context, with the tokens held in its KV cache."""
+
+    def __init__(self, seq_id: int):
+        self.seq_id = seq_id
+        self.tokens: List[int] = []
+        self.pending: List[int] = []
+        self.request: Optional[GenerationRequest] = None
+
+class BatchScheduler:
+    """
+    Serializes access to a shared model and batches concurrent requests.
+
+    Requests wait in a queue ordered by deadline. Up to ``n_slots`` of them
+    run at once, each as its own sequence of the model's context: every step
+    decodes one batch holding the next token of every generating sequence
+    plus prompt chunks of newly admitted ones, so aggregate tokens/s grows
+    with the number of users instead of responses being produced strictly
+    one after another. Each slot keeps its KV cache between requests and
+    reuses the longest common prefix; ``prefix_tokens`` (the static prompt
+    prefix) are evaluated once and shared by all slots. Tokens are sampled
+    with llama's own sampler chain, built as ``Llama`` builds it.
+
+    The model keeps a single context: its one-sequence context is replaced
+    by one with a sequence per slot and a unified KV cache, so the shared
+    prefix is stored once. From then on the scheduler owns the model; it
+    must not be called directly.
+    """
+
+    def __init__(self, llm: Llama, n_slots: int = Config.SCHEDULER_SLOTS,
+                 slot_context: int = Config.CONTEXT_SIZE,
+                 default_timeout: float = Config.SCHEDULER_TIMEOUT,
+                 prefix_tokens: Sequence[int] = ()):
+        self.llm = llm
+        self.n_slots = max(1, n_slots)
+        self.slot_context = slot_context
+        self.default_timeout = default_timeout
+        self.n_batch = llm.n_batch
+        self.eog_tokens = {t for t in (llm.token_eos(), llm._model.token_eot()) if t is not None and t >= 0}
+
+        self._ctx = self._take_context(llm)
+        self._batch = llama_internals.LlamaBatch(n_tokens=self.n_batch, embd=0, n_seq_max=1, verbose=llm.verbose)
+        self._slots = [_Slot(i) for i in range(self.n_slots)]
+        if prefix_tokens and len(prefix_tokens) < self.slot_context:
+            self._prime(list(prefix_tokens))
+
+        self._queue: List = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Metrics
+        self._wait_times: deque = deque(maxlen=256)
+        self.completed = 0
+        self.cancelled = 0
+        self.timed_out = 0
+        self.failed = 0
+        self.decoded_tokens = 0
+        self.busy_time = 0.0
+
+        self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def _take_context(self, llm: Llama) -> llama_internals.LlamaContext:
+        """Replace the model's context with one holding a sequence per slot, and return it."""
+        params = llama_cpp.llama_context_params.from_buffer_copy(llm.context_params)
+        params.n_ctx = self.slot_context * self.n_slots
+        params.n_seq_max = self.n_slots
+        params.kv_unified = True  # Sequences share cells, e.g. the common prefix
+        llm._ctx.close()  # Release the single-sequence KV cache first
+        llm._ctx = llama_internals.LlamaContext(model=llm._model, params=params, verbose=llm.verbose)
+        llm.context_params = params
+        llm.n_tokens = 0
+        return llm._ctx
+
+    def _prime(self, prefix_tokens: List[int]):
+        """Evaluate the prefix once in the first sequence and share it with every slot."""
+        batch = self._batch.batch
+        for start in range(0, len(prefix_tokens), self.n_batch):
+            chunk = prefix_tokens[start:start + self.n_batch]
+            batch.n_tokens = 0
+            for offset, token in enumerate(chunk):
+                i = batch.n_tokens
+                batch.token[i] = token
+                batch.pos[i] = start + offset
+                batch.seq_id[i][0] = 0
+                batch.n_seq_id[i] = 1
+                batch.logits[i] = False
+                batch.n_tokens += 1
+            self._ctx.decode(self._batch)
+        for slot in self._slots:
+            if slot.seq_id != 0:
+                self._ctx.kv_cache_seq_cp(0, slot.seq_id, -1, -1)
+            slot.tokens = list(prefix_tokens)
+
+    # --- Submission -----------------------------------------------------
+
+    def submit(self, prompt, max_tokens: int = Config.MAX_TOKENS, stop: Optional[List[str]] = None,
+               timeout: Optional[float] = None, seed: Optional[int] = None,
+               cancel_token: Optional[CancellationToken] = None, **sampling) -> GenerationRequest:
+        """
+        Queue a completion and return its request handle.
+
+        ``sampling`` takes the options in SAMPLER_OPTIONS (temperature, top_p,
+        repeat_penalty, frequency_penalty, ...); others raise ValueError
+        rather than being silently ignored.
+        """
+        settings = sampler_settings(sampling)
+        if isinstance(prompt, str):
+            prompt_tokens = self.llm.tokenize(prompt.encode("utf-8"))
+        else:
+            prompt_tokens = list(prompt)
+        if len(prompt_tokens) >= self.slot_context:
+            raise ValueError(f"Prompt of {len(prompt_tokens)} tokens does not fit the "
+                             f"{self.slot_context}-token context")
+        timeout = timeout if timeout is not None else self.default_timeout
+        request = GenerationRequest(
+            prompt_tokens, max_tokens, stop or [], settings,
+            time.monotonic() + timeout if timeout else None, seed
+        )
+        if cancel_token is not None:
+            cancel_token.on_cancel(request.cancel)
+        with self._cond:
+            deadline = request.deadline if request.deadline is not None else float("inf")
+            heapq.heappush(self._queue, (deadline, next(self._order), request))
+            self._cond.notify()
+        return request
+
+    def __call__(self, prompt, max_tokens: Optional[int] = None, stop: Optional[List[str]] = None,
+                 stream: bool = False, echo: bool = False, **kwargs):
+        """Llama-compatible completion call; unsupported options (and ``echo=True``) raise ValueError."""
+        if echo:
+            raise ValueError("Unsupported option: echo")
+        request = self.submit(prompt, max_tokens or Config.MAX_TOKENS, stop, **kwargs)
+        if stream:
+            return self._stream_chunks(request)
+        text = "".join(request)
+        return {
+            "id": request.id,
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": self.llm.model_path,
+            "choices": [{"text": text, "index": 0, "logprobs": None,
+                         "finish_reason": request.finish_reason}],
+            "usage": {
+                "prompt_tokens": len(request.prompt_tokens),
+                "completion_tokens": len(request.generated),
+                "total_tokens": len(request.prompt_tokens) + len(request.generated),
+            },
+        }
+
+    def _stream_chunks(self, request: GenerationRequest) -> Iterator[Dict]:
+        created = int(time.time())
+        try:
+            for piece in request:
+                yield {"id": request.id, "object": "text_completion", "created": created,
+                       "model": self.llm.model_path,
+                       "choices": [{"text": piece, "index": 0, "logprobs": None, "finish_reason": None}]}
+            yield {"id": request.id, "object": "text_completion", "created": created,
+                   "model": self.llm.model_path,
+                   "choices": [{"text": "", "index": 0, "logprobs": None,
+                                "finish_reason": request.finish_reason}]}
+        finally:
+            # Consumer stopped early (e.g. client disconnected)
+            request.cancel()
+
+    # --- Metrics --------------------------------------------------------
+
+    def stats(self) -> Dict:
+        """Queue depth, wait times and aggregate throughput."""
+        with self._cond:
+            queue_depth = len(self._queue)
+            waits = sorted(self._wait_times)
+        active = sum(1 for slot in self._slots if slot.request is not None)
+        return {
+            "queue_depth": queue_depth,
+            "active_requests": active,
+            "slots": self.n_slots,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "timed_out": self.timed_out,
+            "failed": self.failed,
+            "wait_time_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_time_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "tokens_per_second": self.decoded_tokens / self.busy_time if self.busy_time else 0.0,
+        }
+
+    # --- Scheduling loop ------------------------------------------------
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._worker.join(timeout=5)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._queue and not self._has_active():
+                    self._cond.wait()
+                if self._closed:
+                    break
+                self._admit()
+            if not self._has_active():
+                continue
+            start = time.perf_counter()
+            try:
+                self._step()
+            except Exception as e:
+                console.print(f"[red]Scheduler error: {e}[/red]")
+                for slot in self._slots:
+                    if slot.request is not None:
+                        self._finish(slot, "error")
+                        slot.tokens = []
+                self._ctx.kv_cache_clear()
+            self.busy_time += time.perf_counter() - start
+
+    def _has_active(self) -> bool:
+        return any(slot.request is not None for slot in self._slots)
+
+    def _admit(self):
+        """Move queued requests into free slots, dropping the ones already past their deadline."""
+        now = time.monotonic()
+        while self._queue:
+            free = [slot for slot in self._slots if slot.request is None]
+            if not free:
+                break
+            _, _, request = heapq.heappop(self._queue)
+            if request.cancelled:
+                self.cancelled += 1
+                request.finish_reason = "cancelled"
+                request._push(None)
+                continue
+            if request.deadline is not None and now > request.deadline:
+                self.timed_out += 1
+                request.finish_reason = "timeout"
+                request._push(None)
+                continue
+            # Prefer the slot whose KV cache already holds most of this prompt
+            slot = max(free, key=lambda s: Llama.longest_token_prefix(s.tokens, request.prompt_tokens))
+            reuse = min(Llama.longest_token_prefix(slot.tokens, request.prompt_tokens),
+                        len(request.prompt_tokens) - 1)  # Re-evaluate at least one token for its logits
+            self._ctx.kv_cache_seq_rm(slot.seq_id, reuse, -1)
+            slot.tokens = slot.tokens[:reuse]
+            slot.pending = request.prompt_tokens[reuse:]
+            slot.request = request
+            # The chain Llama itself samples with, seeded per request
+            self.llm.set_seed(request.seed if request.seed is not None else llama_cpp.LLAMA_DEFAULT_SEED)
+            request.sampler = self.llm._init_sampler(**request.sampling)
+            request.started_at = now
+            self._wait_times.append(now - request.submitted_at)
+
+    def _step(self):
+        """Decode one batch: a token for every generating slot, then prompt chunks."""
+        now = time.monotonic()
+        for slot in self._slots:
+            request = slot.request
+            if request is None:
+                continue
+            if request.cancelled:
+                self._finish(slot, "cancelled")
+            elif request.deadline is not None and now > request.deadline:
+                self._finish(slot, "timeout")
+
+        batch = self._batch.batch
+        batch.n_tokens = 0
+        outputs = []  # (slot, batch index of its logits)
+        budget = self.n_batch
+        active = [slot for slot in self._slots if slot.request is not None]
+        # Generating sequences first, so a long new prompt cannot stall them
+        active.sort(key=lambda slot: len(slot.pending) > 1)
+        for slot in active:
+            if budget == 0:
+                break
+            chunk = slot.pending[:budget]
+            for offset, token in enumerate(chunk):
+                i = batch.n_tokens
+                batch.token[i] = token
+                batch.pos[i] = len(slot.tokens) + offset
+                batch.seq_id[i][0] = slot.seq_id
+                batch.n_seq_id[i] = 1
+                batch.logits[i] = False
+                batch.n_tokens += 1
+            budget -= len(chunk)
+            slot.tokens.extend(chunk)
+            slot.pending = slot.pending[len(chunk):]
+            if not slot.pending:
+                batch.logits[batch.n_tokens - 1] = True
+                outputs.append((slot, batch.n_tokens - 1))
+        if batch.n_tokens == 0:
+            return
+
+        self._ctx.decode(self._batch)
+
+        for slot, index in outputs:
+            # Samples from the logits of this batch position and feeds the token to the penalties
+            token = slot.request.sampler.sample(self._ctx, index)
+            self._accept(slot, token)
+
+    def _accept(self, slot: _Slot, token: int):
+        """Record a sampled token, emit any text that is safe to show, and check for the end."""
+        request = slot.request
+        if request.first_token_at is None:
+            request.first_token_at = time.monotonic()
+        if token in self.eog_tokens:
+            self._finish(slot, "stop")
+            return
+        request.generated.append(token)
+        self.decoded_tokens += 1
+        request.text += request._decoder.decode(self.llm._model.detokenize([token]))
+
+        longest_stop = max((len(s) for s in request.stop), default=0)
+        search_from = max(0, request._emitted - longest_stop)
+        hits = [i for i in (request.text.find(s, search_from) for s in request.stop) if i >= 0]
+        if hits:
+            request.text = request.text[:min(hits)]
+            self._finish(slot, "stop")
+            return
+        # Hold back a tail that could still turn into a stop sequence
+        safe_end = len(request.text) - max(0, longest_stop - 1)
+        if safe_end > request._emitted:
+            request._push(request.text[request._emitted:safe_end])
+            request._emitted = safe_end
+
+        if len(request.generated) >= request.max_tokens or len(slot.tokens) + 1 >= self.slot_context:
+            self._finish(slot, "length")
+        else:
+            slot.pending = [token]
+
+    def _finish(self, slot: _Slot, reason: str):
+        request = slot.request
+        if reason != "cancelled" and len(request.text) > request._emitted:
+            request._push(request.text[request._emitted:])
+            request._emitted = len(request.text)
+        request.finish_reason = reason
+        request.finished_at = time.monotonic()
+        if request.sampler is not None:
+            request.sampler.close()
+            request.sampler = None
+        slot.request = None
+        slot.pending = []
+        if reason == "cancelled":
+            self.cancelled += 1
+        elif reason == "timeout":
+            self.timed_out += 1
+        elif reason == "error":
+            self.failed += 1
+        else:
+            self.completed += 1
+        # Signalled last, so a caller reading stats() right after sees its request finished
+        request._push(None)
@@ -0,0 +1,81 @@
+import re
+import hashlib
+from typing import Dict, List, Optional
+from modules.config import Config
+from modules.embeddings import Embedder
+from modules.history_window import format_history_message
+from modules.vector_store import VectorStore
+
+NAME_PLACEHOLDER = "{user_name}"
+
+def context_key(history: List[Dict]) -> str:
+    """Fingerprint of the exchange before an input (the last user and assistant messages)."""
+    recent = "".join(format_history_message(msg) for msg in history[-2:])
+    return hashlib.sha256(re.sub(r"\s+", " ", recent).strip().lower().encode("utf-8")).hexdigest()[:16]
+
+class SemanticCache:
+    """
+    Answers paraphrases of earlier inputs from stored replies.
+
+    The user input is embedded and looked up in a VectorStore of past inputs;
+    if the closest one is at least ``threshold`` cosine-similar, its reply is
+    returned instead of generating a new one. The user's name is stored as a
+    placeholder, so a cached reply is re-personalized for the current user.
+
+    Each reply is stored with the exchange that preceded its input (see
+    ``context_key``). Short inputs (fewer than ``min_words`` words, e.g.
+    "why?" or "tell me more") depend on that exchange, so they only hit
+    replies given after the same one.
+    """
+
+    def __init__(self, embedder: Embedder, store: Optional[VectorStore] = None,
+                 threshold: float = Config.SEMANTIC_CACHE_THRESHOLD,
+                 max_age: float = Config.SEMANTIC_CACHE_MAX_AGE,
+                 min_words: int = Config.SEMANTIC_CACHE_MIN_WORDS):
+        self.embedder = embedder
+        if store is None:
+            store = VectorStore(Config.SEMANTIC_CACHE_DIR, Config.SEMANTIC_CACHE_MAX_ENTRIES)
+        self.store = store
+        self.threshold = threshold
+        self.max_age = max_age
+        self.min_words = min_words
+        self.hits = 0
+        self.misses = 0
+        if max_age:
+            self.store.evict_older_than(max_age)
+
+    def lookup(self, user_input: str, user_name: str = "", history: Optional[List[Dict]] = None) -> Optional[str]:
+        """Return a stored reply for a sufficiently similar input in a compatible context, or None."""
+        standalone = len(user_input.split()) >= self.min_words
+        context = context_key(history or [])
+        matches = self.store.search(self.embedder.embed(user_input.strip().lower()),
+                                    k=Config.SEMANTIC_CACHE_CANDIDATES)
+        for similarity, row in matches:
+            if similarity < self.threshold:
+                break
+            if not standalone and self.store.peek(row).get("context") != context:
+                continue
+            payload = self.store.get(row)
+            self.hits += 1
+            return payload["reply"].replace(NAME_PLACEHOLDER, user_name or "there")
+        self.misses += 1
+        return None
+
+    def add(self, user_input: str, reply: str, user_name: str = "", history: Optional[List[Dict]] = None):
+        """Remember the reply generated for ``user_input`` after ``history``."""
+        if user_name:
+            reply = re.sub(rf"\b{re.escape(user_name)}\b", NAME_PLACEHOLDER, reply)
+        self.store.add(self.embedder.embed(user_input.strip().lower()),
+                       {"input": user_input, "reply": reply, "context": context_key(history or [])})
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.store),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def save(self):
+        self.store.flush()
@@ -0,0 +1,110 @@
+import numpy as np
+from typing import Optional
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+from rich.console import Console
+from modules.config import Config
+
+console = Console()
+
+class GGUFDraftModel(LlamaDraftModel):
+    """
+    Proposes draft tokens with a small GGUF model.
+
+    The draft model must share the main model's vocabulary (e.g. TinyLlama
+    drafting for a Llama-family 7B). Drafts are greedy; the draft context is
+    kept between calls so llama-cpp only evaluates the new tokens.
+    """
+
+    def __init__(self, model_path: str, num_pred_tokens: int = Config.SPECULATIVE_NUM_PRED_TOKENS,
+                 n_ctx: int = Config.CONTEXT_SIZE, n_threads: int = Config.N_THREADS):
+        self.num_pred_tokens = num_pred_tokens
+        self.llm = Llama(
+            model_path=model_path,
+            n_ctx=n_ctx,
+            n_threads=n_threads,
+            n_batch=512,
+            use_mmap=True,
+            verbose=False
+        )
+
+    SAMPLE_TEXT = "Hello! How are you today? 12345 naïve café"
+
+    def compatible_with(self, model_path: str) -> bool:
+        """Whether the draft proposes token ids that mean the same to the model at ``model_path``."""
+        # Only the vocabulary is read, so this is cheap next to loading the model
+        target = Llama(model_path=model_path, n_ctx=64, vocab_only=True, verbose=False)
+        sample = self.SAMPLE_TEXT.encode("utf-8")
+        return (self.llm.n_vocab() == target.n_vocab()
+                and self.llm.token_bos() == target.token_bos()
+                and self.llm.token_eos() == target.token_eos()
+                and self.llm.tokenize(sample) == target.tokenize(sample))
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = []
+        eos = self.llm.token_eos()
+        for token in self.llm.generate(input_ids.tolist(), temp=0.0, top_k=1, reset=True):
+            if token == eos:
+                break
+            draft.append(token)
+            if len(draft) >= self.num_pred_tokens:
+                break
+        return np.array(draft, dtype=np.intc)
+
+class DraftStats(LlamaDraftModel):
+    """
+    Wraps a draft model and counts its proposals.
+
+    llama-cpp does not report how many drafted tokens it accepted, but every
+    verification step yields the accepted drafts plus one sampled token and
+    then asks for a new draft. The accepted count is therefore estimated as
+    ``generated_tokens - draft_calls``.
+    """
+
+    def __init__(self, draft_model: LlamaDraftModel):
+        self.draft_model = draft_model
+        self.reset()
+
+    def reset(self):
+        """Start counting for a new completion."""
+        self.calls = 0
+        self.drafted = 0
+
+    def __call__(self, input_ids, /, **kwargs):
+        draft = self.draft_model(input_ids, **kwargs)
+        self.calls += 1
+        self.drafted += len(draft)
+        return draft
+
+    def acceptance_rate(self, generated_tokens: int) -> float:
+        """Estimated share of drafted tokens the main model accepted."""
+        if not self.drafted:
+            return 0.0
+        accepted = max(0, generated_tokens - self.calls)
+        return min(1.0, accepted / self.drafted)
+
+def build_draft_model(mode: str = Config.SPECULATIVE_MODE) -> Optional[LlamaDraftModel]:
+    """
+    Create the draft model selected in Config, or None when speculation is off.
+
+    One draft model can serve several targets; wrap it in a DraftStats per
+    target and check ``draft_compatible`` first.
+    """
+    if mode == "prompt_lookup":
+        draft = LlamaPromptLookupDecoding(
+            max_ngram_size=Config.SPECULATIVE_MAX_NGRAM,
+            num_pred_tokens=Config.SPECULATIVE_NUM_PRED_TOKENS
+        )
+    elif mode == "draft":
+        try:
+            draft = GGUFDraftModel(Config.DRAFT_MODEL_PATH)
+        except Exception as e:
+            console.print(f"[yellow]Warning: Could not load draft model {Config.DRAFT_MODEL_PATH}: {e}[/yellow]")
+            return None
+    else:
+        return None
+    return draft
+
+def draft_compatible(draft: LlamaDraftModel, model_path: str) -> bool:
+    """Prompt lookup works with any model; a GGUF draft model must share the target's vocabulary."""
+    return not isinstance(draft, GGUFDraftModel) or draft.compatible_with(model_path)
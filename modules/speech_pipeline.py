@@ -0,0 +1,226 @@
+import re
+import time
+import queue
+import threading
+import itertools
+from typing import Callable, Dict, List, Optional
+from rich.console import Console
+from modules.config import Config
+from modules.cancellation import CancellationToken
+from modules.profiler import tracer
+
+console = Console()
+
+class SentenceSplitter:
+    """
+    Cuts streamed text into sentences as soon as they are complete.
+
+    A sentence ends at ``.``, ``!``, ``?`` (or a newline) followed by
+    whitespace. Very short sentences are merged with the next one, since
+    each clip costs a TTS round trip.
+    """
+
+    BOUNDARY = re.compile(r'[.!?…]+["\')\]]*\s+|\n+')
+
+    def __init__(self, min_chars: int = Config.TTS_MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        """Add streamed text; return the sentences it completed."""
+        self._buffer += text
+        sentences = []
+        start = 0
+        for match in self.BOUNDARY.finditer(self._buffer):
+            sentence = self._buffer[start:match.end()].strip()
+            if len(sentence) >= self.min_chars:
+                sentences.append(sentence)
+                start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> Optional[str]:
+        """Return whatever is left at the end of the response."""
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest or None
+
+class SpeechPipeline:
+    """
+    Overlaps generation, speech synthesis and playback.
+
+    Text is fed in as it streams; every complete sentence is queued for
+    synthesis on ``workers`` TTS threads, and a playback thread plays the
+    clips strictly in order as they become ready. The first sentence is
+    therefore heard while later ones are still being generated and
+    synthesized. ``time_to_first_audio`` reports, per turn, how long after
+    ``start_turn()`` playback began.
+
+    Each turn carries a CancellationToken: once it is cancelled, queued
+    sentences are not synthesized, ready clips are skipped and the clip
+    being played is stopped (``play`` receives the token).
+
+    ``turn_stats`` accumulates the turn's synthesis and playback time;
+    ``wait_for_turn`` blocks until all of its clips are played or skipped.
+    """
+
+    def __init__(self, synthesize: Callable[[str], Optional[str]],
+                 play: Callable[[str, Optional[CancellationToken]], None],
+                 workers: int = Config.TTS_WORKERS):
+        self.synthesize = synthesize
+        self.play = play
+        self._splitter = SentenceSplitter()
+        self._sequence = itertools.count()
+        self._tts_queue: "queue.Queue" = queue.Queue()
+        self._clips: Dict[int, Optional[str]] = {}
+        self._clip_tokens: Dict[int, CancellationToken] = {}
+        self._clip_stats: Dict[int, Dict] = {}
+        self._clips_ready = threading.Condition()
+        self._next_to_play = 0
+        self._submitted = 0
+
+        self.turn_start: Optional[float] = None
+        self.cancel_token = CancellationToken()
+        self._turn_first_clip: Optional[int] = None
+        self.time_to_first_audio: Optional[float] = None
+        self._first_audio = threading.Event()
+        self.turn_stats = self._new_turn_stats()
+
+        for i in range(max(1, workers)):
+            threading.Thread(target=self._synthesis_worker, name=f"tts-{i}", daemon=True).start()
+        threading.Thread(target=self._playback_worker, name="playback", daemon=True).start()
+
+    def start_turn(self, cancel_token: Optional[CancellationToken] = None):
+        """Begin timing a new turn; cancelling ``cancel_token`` silences it."""
+        self.cancel_token = cancel_token or CancellationToken()
+        self._splitter = SentenceSplitter()
+        self.turn_start = time.time()
+        self._turn_first_clip = None
+        self.time_to_first_audio = None
+        self.turn_stats = self._new_turn_stats()
+        self._first_audio.clear()
+        # A cancelled turn will never start playing; don't keep playback waiting for its clips
+        self.cancel_token.on_cancel(self._first_audio.set)
+        self.cancel_token.on_cancel(self._wake_playback)
+
+    def feed(self, text: str):
+        """Queue the sentences completed by a piece of streamed text."""
+        for sentence in self._splitter.feed(text):
+            self._submit(sentence)
+
+    def finish(self):
+        """Queue the rest of the response; call once generation is done."""
+        rest = self._splitter.flush()
+        if rest:
+            self._submit(rest)
+        with self._clips_ready:
+            self.turn_stats["finished"] = True
+            self._clips_ready.notify_all()
+        if self._turn_first_clip is None:
+            # Nothing to say this turn
+            self._first_audio.set()
+
+    def cancel(self):
+        """Silence the current turn: drop its queued sentences and stop playback."""
+        self.cancel_token.cancel()
+
+    def speak(self, text: str, cancel_token: Optional[CancellationToken] = None):
+        """Synthesize and play a complete text as its own turn."""
+        self.start_turn(cancel_token)
+        self.feed(text)
+        self.finish()
+
+    def wait_for_first_audio(self, timeout: Optional[float] = None) -> Optional[float]:
+        """Block until this turn's first clip starts playing; returns the time to first audio."""
+        self._first_audio.wait(timeout)
+        return self.time_to_first_audio
+
+    def wait_until_done(self, timeout: Optional[float] = None) -> bool:
+        """Block until every queued clip has been played."""
+        with self._clips_ready:
+            return self._clips_ready.wait_for(lambda: self._next_to_play >= self._submitted, timeout)
+
+    def wait_for_turn(self, turn_stats: Dict, timeout: Optional[float] = None) -> bool:
+        """Block until every clip of the turn ``turn_stats`` belongs to has been played or skipped."""
+        with self._clips_ready:
+            return self._clips_ready.wait_for(
+                lambda: turn_stats["finished"] and turn_stats["pending"] == 0, timeout)
+
+    @staticmethod
+    def _new_turn_stats() -> Dict:
+        return {"clips": 0, "pending": 0, "finished": False, "synthesis_time": 0.0, "playback_time": 0.0}
+
+    def _submit(self, sentence: str):
+        index = next(self._sequence)
+        if self._turn_first_clip is None:
+            self._turn_first_clip = index
+        with self._clips_ready:
+            self._submitted = index + 1
+            self._clip_tokens[index] = self.cancel_token
+            self._clip_stats[index] = self.turn_stats
+            self.turn_stats["clips"] += 1
+            self.turn_stats["pending"] += 1
+        self._tts_queue.put((index, sentence, self.cancel_token))
+
+    def _wake_playback(self):
+        with self._clips_ready:
+            self._clips_ready.notify_all()
+
+    def _playable(self) -> bool:
+        token = self._clip_tokens.get(self._next_to_play)
+        return self._next_to_play in self._clips or (token is not None and token.cancelled)
+
+    def _synthesis_worker(self):
+        while True:
+            index, sentence, cancel_token = self._tts_queue.get()
+            path = None
+            elapsed = 0.0
+            if not cancel_token.cancelled:
+                start = time.time()
+                try:
+                    with tracer.span("tts", clip=index, chars=len(sentence)):
+                        path = self.synthesize(sentence)
+                except Exception as e:
+                    console.print(f"[red]Error during TTS synthesis: {e}[/red]")
+                elapsed = time.time() - start
+            with self._clips_ready:
+                stats = self._clip_stats.get(index)
+                if stats is not None:
+                    stats["synthesis_time"] += elapsed
+                if index >= self._next_to_play:
+                    self._clips[index] = path
+                self._clips_ready.notify_all()
+
+    def _playback_worker(self):
+        while True:
+            with self._clips_ready:
+                self._clips_ready.wait_for(self._playable)
+                index = self._next_to_play
+                path = self._clips.pop(index, None)
+                cancel_token = self._clip_tokens.pop(index)
+                stats = self._clip_stats.pop(index)
+            if cancel_token.cancelled:
+                path = None
+            elif index == self._turn_first_clip:
+                if path:
+                    self.time_to_first_audio = time.time() - self.turn_start
+                    self._first_audio.set()
+                else:
+                    # Synthesis failed; time the turn's next clip instead
+                    self._turn_first_clip = index + 1
+                    if index + 1 >= self._submitted:
+                        self._first_audio.set()
+            start = time.time()
+            if path:
+                try:
+                    with tracer.span("playback", clip=index):
+                        self.play(path, cancel_token)
+                except Exception as e:
+                    console.print(f"[red]Error during audio playback: {e}[/red]")
+            with self._clips_ready:
+                # A cancelled clip may have finished synthesizing after it was skipped
+                self._clips.pop(index, None)
+                if path:
+                    stats["playback_time"] += time.time() - start
+                stats["pending"] -= 1
+                self._next_to_play = index + 1
+                self._clips_ready.notify_all()
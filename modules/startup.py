@@ -0,0 +1,84 @@
+import time
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+from rich.console import Console
+from rich.table import Table
+from rich.box import SIMPLE
+from modules.profiler import tracer
+
+console = Console()
+
+class StartupOrchestrator:
+    """
+    Runs independent startup steps concurrently.
+
+    Each step is a callable with optional dependencies on other steps; it
+    starts as soon as those have finished. Results are collected as futures,
+    so callers only block on the step they actually need (``result()``), and
+    the wall-clock time of every step is recorded for ``print_timings()``.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="startup")
+        self._futures: Dict[str, Future] = {}
+        self._timings: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self.start_time = time.time()
+
+    def add(self, name: str, func: Callable, depends_on: Iterable[str] = ()) -> Future:
+        """Schedule ``func`` to run once the steps in ``depends_on`` are done."""
+        dependencies = [self._futures[dep] for dep in depends_on]
+
+        def run_step():
+            for dependency in dependencies:
+                dependency.result()
+            started = time.time()
+            try:
+                with tracer.span(f"startup: {name}", "startup"):
+                    return func()
+            finally:
+                with self._lock:
+                    self._timings[name] = {
+                        "start": started - self.start_time,
+                        "duration": time.time() - started,
+                    }
+
+        future = self._executor.submit(run_step)
+        self._futures[name] = future
+        return future
+
+    def result(self, name: str, timeout: Optional[float] = None):
+        """Wait for a step and return its result (re-raising its exception)."""
+        return self._futures[name].result(timeout)
+
+    def result_or_none(self, name: str):
+        """Result of a finished step, or None if it is still running or failed."""
+        future = self._futures.get(name)
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def done(self, name: str) -> bool:
+        """Whether a step has finished."""
+        return name in self._futures and self._futures[name].done()
+
+    def print_timings(self):
+        """Print when each step started and how long it took."""
+        table = Table(box=SIMPLE)
+        table.add_column("[dim]Startup step[/dim]", style="cyan")
+        table.add_column("[dim]Started[/dim]", style="green")
+        table.add_column("[dim]Took[/dim]", style="green")
+        with self._lock:
+            timings = dict(self._timings)
+        for name in self._futures:
+            if name in timings:
+                table.add_row(f"[dim]{name}[/dim]", f"[dim]+{timings[name]['start']:.2f}s[/dim]",
+                              f"[dim]{timings[name]['duration']:.2f}s[/dim]")
+            else:
+                table.add_row(f"[dim]{name}[/dim]", "[dim]-[/dim]", "[dim]running...[/dim]")
+        console.print(table)
+
+    def shutdown(self):
+        """Stop accepting steps; running steps finish in the background."""
+        self._executor.shutdown(wait=False)
@@ -3,6 +3,7 @@ import json
 from datetime import datetime, date, time
 from typing import Dict, Optional, Tuple
 from rich.console import Console
+from modules.profiler import tracer
 
 console = Console()
 
@@ -85,7 +86,7 @@ class UserManager:
     def save_user_data(self):
         """Save user data to JSON file."""
         try:
-            with open(self.user_db_file, "w") as f:
+            with tracer.span("save user data", "io"), open(self.user_db_file, "w") as f:
                 json.dump(self.user_data, f, indent=4)
         except Exception as e:
             console.print(f"[red]Error saving user data: {e}[/red]")
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import threading
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from rich.console import Console
+
+console = Console()
+
+class VectorStore:
+    """
+    Fixed-capacity vector index persisted to memory-mapped files.
+
+    Vectors live in ``vectors.npy`` (opened with ``np.load(mmap_mode='r+')``),
+    their payloads in ``meta.json``. Search is a brute-force dot product over
+    the occupied rows, which is fast for a few thousand entries; when the
+    store is full the least recently used entry is overwritten.
+    """
+
+    def __init__(self, directory: str, capacity: int):
+        self.directory = directory
+        self.capacity = capacity
+        self.vectors_path = os.path.join(directory, "vectors.npy")
+        self.meta_path = os.path.join(directory, "meta.json")
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Optional[Dict]] = [None] * capacity
+        self._occupied = np.zeros(capacity, dtype=bool)  # Rows holding an entry, kept in step with _entries
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.meta_path, "r") as f:
+                meta = json.load(f)
+            vectors = np.load(self.vectors_path, mmap_mode="r+")
+        except (OSError, ValueError):
+            return
+        if vectors.shape[0] != self.capacity or len(meta.get("entries", [])) != self.capacity:
+            console.print("[yellow]Warning: Vector store capacity changed; starting a new index.[/yellow]")
+            return
+        self._vectors = vectors
+        self._entries = meta["entries"]
+        self._occupied = np.array([entry is not None for entry in self._entries], dtype=bool)
+
+    def _create(self, dim: int):
+        os.makedirs(self.directory, exist_ok=True)
+        self._vectors = np.lib.format.open_memmap(self.vectors_path, mode="w+", dtype=np.float32,
+                                                  shape=(self.capacity, dim))
+        self._entries = [None] * self.capacity
+        self._occupied[:] = False
+
+    def __len__(self) -> int:
+        return int(self._occupied.sum())
+
+    def add(self, vector: np.ndarray, payload: Dict) -> int:
+        """Insert a vector with its payload, evicting the LRU entry if full; returns the row."""
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._create(vector.shape[0])
+            free = np.flatnonzero(~self._occupied)
+            if free.size:
+                row = int(free[0])
+            else:
+                row = min(range(self.capacity), key=lambda i: self._entries[i]["last_used"])
+            now = time.time()
+            self._vectors[row] = vector
+            self._entries[row] = {"payload": payload, "created": now, "last_used": now}
+            self._occupied[row] = True
+            return row
+
+    def search(self, vector: np.ndarray, k: int = 1) -> List[Tuple[float, int]]:
+        """Return up to ``k`` (similarity, row) pairs, best first."""
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                return []
+            occupied = self._occupied
+            if not occupied.any():
+                return []
+            scores = self._vectors @ vector
+            scores[~occupied] = -np.inf
+            k = min(k, int(occupied.sum()))
+            rows = np.argpartition(-scores, k - 1)[:k]
+            rows = rows[np.argsort(-scores[rows])]
+            return [(float(scores[row]), int(row)) for row in rows]
+
+    def get(self, row: int) -> Optional[Dict]:
+        """Payload of a row, marking it as recently used."""
+        entry = self._entries[row]
+        if entry is None:
+            return None
+        entry["last_used"] = time.time()
+        return entry["payload"]
+
+    def peek(self, row: int) -> Dict:
+        """Payload of a row without marking it as used (empty if the row is free)."""
+        entry = self._entries[row]
+        return entry["payload"] if entry is not None else {}
+
+    def remove(self, row: int):
+        with self._lock:
+            self._entries[row] = None
+            self._occupied[row] = False
+
+    def evict_older_than(self, max_age: float):
+        """Drop entries not used for ``max_age`` seconds."""
+        cutoff = time.time() - max_age
+        with self._lock:
+            for row, entry in enumerate(self._entries):
+                if entry is not None and entry["last_used"] < cutoff:
+                    self._entries[row] = None
+                    self._occupied[row] = False
+
+    def flush(self):
+        """Persist the payloads and flush the vector file."""
+        with self._lock:
+            if self._vectors is None:
+                return
+            self._vectors.flush()
+            tmp_path = f"{self.meta_path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"entries": self._entries}, f)
+            os.replace(tmp_path, self.meta_path)